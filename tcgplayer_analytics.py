@@ -0,0 +1,340 @@
+import argparse
+import datetime
+import logging
+
+import gspread
+import numpy as np
+
+from tcgplayer_price_history import DEFAULT_HISTORY_PATH, PriceHistory
+from tcgplayer_price_source import format_price, parse_price
+from tcgplayer_run_metrics import DEFAULT_LOG_LEVEL, LOG_LEVELS, configure_logging
+from tcgplayer_sheet_schema import column_letter
+from tcgplayer_snapshot import InventorySnapshot
+
+
+DEFAULT_SUMMARY_TAB = "Summary"
+DEFAULT_TOP_PRODUCTS = 10
+# Modified z-score of the price change above which a row is an outlier
+DEFAULT_OUTLIER_THRESHOLD = 3.5
+# Percentage points from the median change that make a row an outlier when
+# most prices didn't move, so the z-score has no spread to work with
+DEFAULT_OUTLIER_PERCENT = 10.0
+SUMMARY_COLUMNS = 6
+
+logger = logging.getLogger(__name__)
+
+
+class Inventory(object):
+    """The inventory as parallel NumPy arrays with one entry per row.
+
+    Games and series are stored as integer codes into ``games`` and
+    ``series`` so every group-by is a single ``np.bincount``.  Prices that
+    are missing are NaN.  ``previous`` holds the unit price of the same
+    product in an earlier run, NaN when it wasn't held then.
+    """
+
+    def __init__(self, positions, previous_prices=None):
+        previous_prices = previous_prices or {}
+        positions = list(positions)
+        self.rows = np.array([position[0] for position in positions], dtype=np.int64)
+        self.product_ids = np.array([str(position[1]) for position in positions], dtype=object)
+        self.names = np.array([position[5] or "" for position in positions], dtype=object)
+        self.quantity = np.array([position[6] for position in positions], dtype=np.float64)
+        self.price = self._prices(position[7] for position in positions)
+        self.previous = self._prices(
+            previous_prices.get((str(position[1]), position[2])) for position in positions)
+        self.games, self.game_codes = np.unique(
+            np.array([position[3] or "" for position in positions], dtype=object), return_inverse=True)
+        series_keys = np.array(
+            ["{}\t{}".format(position[3] or "", position[4] or "") for position in positions], dtype=object)
+        series, self.series_codes = np.unique(series_keys, return_inverse=True)
+        # (game, series) for every series code
+        self.series = [tuple(key.split("\t", 1)) for key in series]
+
+    @staticmethod
+    def _prices(values):
+        prices = [parse_price(value) for value in values]
+        return np.array([np.nan if price is None else price for price in prices], dtype=np.float64)
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def percent_change(current, previous):
+    """Returns the percent change of every entry, NaN where there is nothing to compare"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(previous > 0, (current - previous) / previous * 100, np.nan)
+
+
+def find_outliers(changes, threshold=DEFAULT_OUTLIER_THRESHOLD, percent=DEFAULT_OUTLIER_PERCENT):
+    """
+    Flags the changes far from the rest using the modified z-score
+
+    The median and median absolute deviation are used instead of the mean
+    and standard deviation so a few big movers don't hide each other.  When
+    more than half the changes are the same the deviation is 0, and a change
+    is an outlier once it is ``percent`` points away from the median.
+
+    Returns:
+        np.ndarray: True for every outlier
+    """
+    known = ~np.isnan(changes)
+    if not known.any():
+        return np.zeros(changes.shape, dtype=bool)
+    median = np.median(changes[known])
+    deviation = np.median(np.abs(changes[known] - median))
+    if deviation == 0:
+        return known & (np.abs(changes - median) > percent)
+    scores = 0.6745 * (changes - median) / deviation
+    return known & (np.abs(scores) > threshold)
+
+
+def summarize(inventory, top=DEFAULT_TOP_PRODUCTS, threshold=DEFAULT_OUTLIER_THRESHOLD):
+    """
+    Computes the portfolio totals in one vectorized pass over the inventory
+
+    Returns:
+        dict: The totals, the values by game and by series, the concentration
+            and the outlier rows
+    """
+    value = np.nan_to_num(inventory.quantity * inventory.price)
+    compared = ~np.isnan(inventory.price) & ~np.isnan(inventory.previous)
+    current_compared = np.where(compared, value, 0.0)
+    previous_compared = np.where(compared, np.nan_to_num(inventory.quantity * inventory.previous), 0.0)
+    total = value.sum()
+
+    game_count = len(inventory.games)
+    series_count = len(inventory.series)
+    game_values = np.bincount(inventory.game_codes, weights=value, minlength=game_count)
+    game_items = np.bincount(inventory.game_codes, weights=inventory.quantity, minlength=game_count)
+    series_values = np.bincount(inventory.series_codes, weights=value, minlength=series_count)
+    series_items = np.bincount(inventory.series_codes, weights=inventory.quantity, minlength=series_count)
+    series_changes = percent_change(
+        np.bincount(inventory.series_codes, weights=current_compared, minlength=series_count),
+        np.bincount(inventory.series_codes, weights=previous_compared, minlength=series_count),
+    )
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares = value / total if total else np.zeros_like(value)
+    top_rows = np.argsort(value)[::-1][:top]
+
+    changes = percent_change(inventory.price, inventory.previous)
+    outliers = np.flatnonzero(find_outliers(changes, threshold=threshold))
+    outliers = outliers[np.argsort(np.abs(changes[outliers]))[::-1]]
+
+    return {
+        'total': float(total),
+        'items': int(inventory.quantity.sum()),
+        'rows': len(inventory),
+        'unpriced': int(np.isnan(inventory.price).sum()),
+        'change': float(percent_change(current_compared.sum(), previous_compared.sum())),
+        'top_share': float(shares[top_rows].sum()),
+        # Herfindahl index, 1 when everything is in one row
+        'concentration': float(np.square(shares).sum()),
+        'games': [
+            (inventory.games[code], int(game_items[code]), float(game_values[code]))
+            for code in np.argsort(game_values)[::-1]
+        ],
+        'series': [
+            inventory.series[code] + (int(series_items[code]), float(series_values[code]),
+                                      float(series_changes[code]))
+            for code in np.argsort(series_values)[::-1]
+        ],
+        'top': [
+            (int(inventory.rows[index]), inventory.names[index], float(value[index]), float(shares[index]))
+            for index in top_rows
+        ],
+        'outliers': [
+            (int(inventory.rows[index]), inventory.product_ids[index], inventory.names[index],
+             float(inventory.previous[index]), float(inventory.price[index]), float(changes[index]))
+            for index in outliers
+        ],
+    }
+
+
+def format_percent(value):
+    if value is None or np.isnan(value):
+        return "-"
+    return "{:+.1f}%".format(value)
+
+
+def build_summary_rows(summary, generated=None):
+    """
+    Lays the summary out as rows of cells for the summary tab
+
+    Returns:
+        list<list<str>>: Rows of SUMMARY_COLUMNS cells
+    """
+    generated = generated or datetime.datetime.now()
+    total = summary['total']
+    rows = [
+        ["Portfolio Summary", generated.strftime("%Y-%m-%d %H:%M")],
+        ["Total Value", format_price(total)],
+        ["Change Since Last Run", format_percent(summary['change'])],
+        ["Items", summary['items']],
+        ["Rows", summary['rows']],
+        ["Unpriced Rows", summary['unpriced']],
+        ["Top {} Share".format(len(summary['top'])), "{:.1f}%".format(summary['top_share'] * 100)],
+        ["Concentration (HHI)", "{:.4f}".format(summary['concentration'])],
+        [],
+        ["Game", "Items", "Value", "Share"],
+    ]
+    for (game, items, value) in summary['games']:
+        rows.append([game, items, format_price(value), "{:.1f}%".format(value / total * 100 if total else 0)])
+    rows.extend([[], ["Game", "Series", "Items", "Value", "Share", "Change"]])
+    for (game, series, items, value, change) in summary['series']:
+        rows.append([
+            game, series, items, format_price(value),
+            "{:.1f}%".format(value / total * 100 if total else 0), format_percent(change),
+        ])
+    rows.extend([[], ["Row", "Top Products", "Value", "Share"]])
+    for (row, name, value, share) in summary['top']:
+        rows.append([row, name, format_price(value), "{:.1f}%".format(share * 100)])
+    rows.extend([[], ["Row", "Product ID", "Outliers", "Previous", "Price", "Change"]])
+    for (row, product_id, name, previous, price, change) in summary['outliers']:
+        rows.append([row, product_id, name, format_price(previous), format_price(price), format_percent(change)])
+    return [row + [""] * (SUMMARY_COLUMNS - len(row)) for row in rows]
+
+
+def write_summary_tab(spreadsheet, rows, title=DEFAULT_SUMMARY_TAB):
+    """
+    Writes the summary rows to their own tab in one batch update
+
+    The tab is created the first time.  The rows below the summary are
+    blanked in the same request so nothing is left over from a longer
+    summary.
+
+    Returns:
+        gspread.Worksheet: The summary tab
+    """
+    try:
+        worksheet = spreadsheet.worksheet(title)
+    except gspread.exceptions.WorksheetNotFound:
+        worksheet = spreadsheet.add_worksheet(title, rows=max(len(rows), 100), cols=SUMMARY_COLUMNS)
+    if worksheet.row_count < len(rows):
+        worksheet.add_rows(len(rows) - worksheet.row_count)
+    height = max(len(rows), worksheet.row_count)
+    values = rows + [[""] * SUMMARY_COLUMNS for _ in range(height - len(rows))]
+    worksheet.batch_update(
+        [{
+            'range': "A1:{}{}".format(column_letter(SUMMARY_COLUMNS), height),
+            'values': values,
+        }],
+        value_input_option='USER_ENTERED',
+    )
+    return worksheet
+
+
+def load_inventory(history, from_sheet=False, snapshot_path=None):
+    """
+    Loads the inventory and the prices of the run before it
+
+    Args:
+        history(PriceHistory): The price history
+        from_sheet(bool): Read the rows from the sheet instead of the last
+            run recorded in the history
+        snapshot_path(str): Read the rows from a snapshot written by
+            tcgplayer_snapshot instead
+
+    Returns:
+        Inventory: The inventory
+    """
+    latest = history.latestRun()
+    if snapshot_path:
+        positions = InventorySnapshot(snapshot_path).getPositions()
+        compare = latest
+    elif from_sheet:
+        # Imported here so the offline path doesn't need the tracker's dependencies
+        from tcgplayer_tracker import TCGPlayerSheetManager
+        manager = TCGPlayerSheetManager.shared_instance()
+        positions = manager.getPositions(manager.loadRecords())
+        compare = latest
+    else:
+        if latest is None:
+            raise ValueError("The price history at {} has no runs yet".format(history.path))
+        positions = history.runPositions(latest)
+        compare = history.previousRun(latest)
+    previous_prices = {}
+    if compare is not None:
+        previous_prices = {
+            (str(product_id), condition): price
+            for (row, product_id, condition, game, series, name, quantity, price) in history.runPositions(compare)
+        }
+    return Inventory(positions, previous_prices)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize the portfolio and write it to a summary tab')
+
+    parser.add_argument(
+        '--history-path',
+        default=DEFAULT_HISTORY_PATH,
+        help='SQLite price history written by the tracker (default: {})'.format(DEFAULT_HISTORY_PATH),
+    )
+
+    parser.add_argument(
+        '--from-sheet',
+        action='store_true',
+        help='Read the inventory from the sheet instead of the last recorded run (default: False)',
+    )
+
+    parser.add_argument(
+        '--snapshot',
+        default=None,
+        help='Read the inventory from a snapshot directory written by tcgplayer_snapshot (default: off)',
+    )
+
+    parser.add_argument(
+        '--tab',
+        default=DEFAULT_SUMMARY_TAB,
+        help='Name of the tab to write the summary to (default: {})'.format(DEFAULT_SUMMARY_TAB),
+    )
+
+    parser.add_argument(
+        '--top',
+        type=int,
+        default=DEFAULT_TOP_PRODUCTS,
+        help='Number of most valuable rows to list (default: {})'.format(DEFAULT_TOP_PRODUCTS),
+    )
+
+    parser.add_argument(
+        '--outlier-threshold',
+        type=float,
+        default=DEFAULT_OUTLIER_THRESHOLD,
+        help='Modified z-score of the price change that makes a row an outlier (default: {:g})'.format(DEFAULT_OUTLIER_THRESHOLD),
+    )
+
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Print the summary instead of writing it to the sheet (default: False)',
+    )
+
+    parser.add_argument(
+        '--log-level',
+        choices=LOG_LEVELS,
+        default=DEFAULT_LOG_LEVEL,
+        help='Only log messages at this level or above (default: {})'.format(DEFAULT_LOG_LEVEL),
+    )
+
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+
+    with PriceHistory(args.history_path) as history:
+        inventory = load_inventory(history, from_sheet=args.from_sheet, snapshot_path=args.snapshot)
+    summary = summarize(inventory, top=args.top, threshold=args.outlier_threshold)
+    rows = build_summary_rows(summary)
+    if args.dry_run:
+        for row in rows:
+            print("\t".join(str(cell) for cell in row).rstrip())
+        return
+
+    # Imported here so a dry run doesn't need the tracker's dependencies
+    from tcgplayer_tracker import TCGPlayerSheetManager
+    spreadsheet = TCGPlayerSheetManager.shared_instance().sheet.spreadsheet
+    write_summary_tab(spreadsheet, rows, title=args.tab)
+    logger.info("Wrote the summary of %s rows to the %s tab", summary['rows'], args.tab)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+DEFAULT_CONCURRENCY = 8
+# Requests per second allowed against a single host
+DEFAULT_RATE_LIMIT = 4.0
+DEFAULT_BURST = 8
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_BACKOFF_BASE = 1.0
+DEFAULT_BACKOFF_MAX = 30.0
+DEFAULT_TIMEOUT = 10
+
+RETRY_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """Token bucket allowing ``rate`` requests per second with bursts of ``capacity``."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        # The same bucket can be shared by event loops in several threads
+        self._lock = threading.Lock()
+
+    def _take(self):
+        """Takes a token if one is available.
+
+        Returns:
+            float: 0 when a token was taken, otherwise the seconds to wait
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    async def acquire(self):
+        """Waits until a token is available and takes it."""
+        while True:
+            delay = self._take()
+            if not delay:
+                return
+            await asyncio.sleep(delay)
+
+
+class AsyncFetcher(object):
+    """Fetches many URLs at once without tripping the site's throttling.
+
+    At most ``concurrency`` requests are in flight and every host gets its
+    own token bucket of ``rate_limit`` requests per second.  Responses with
+    a 429 or 5xx status are retried with exponential backoff and full
+    jitter, honouring ``Retry-After`` when the server sends it.
+
+    The blocking ``requests`` session runs in worker threads so the same
+    keep-alive connection pool is shared by every request.
+    """
+
+    def __init__(self, session=None, concurrency=DEFAULT_CONCURRENCY,
+                 rate_limit=DEFAULT_RATE_LIMIT, burst=DEFAULT_BURST,
+                 max_retries=DEFAULT_MAX_RETRIES, backoff_base=DEFAULT_BACKOFF_BASE,
+                 backoff_max=DEFAULT_BACKOFF_MAX, timeout=DEFAULT_TIMEOUT):
+        self.session = session or self.createSession(concurrency)
+        self.concurrency = concurrency
+        self.rate_limit = rate_limit
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.request_count = 0
+        self.retry_count = 0
+        # Buckets outlive a single batch so back to back batches share the limit
+        self._buckets = {}
+        self._buckets_lock = threading.Lock()
+
+    @staticmethod
+    def createSession(pool_size):
+        """Creates a keep-alive session with a connection pool sized for the concurrency."""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def getBackoff(self, attempt, response=None):
+        """Returns the seconds to wait before retrying.
+
+        Args:
+            attempt(int): The number of the retry, starting at 0
+            response(requests.Response): The throttled response, if any
+        """
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                return min(self.backoff_max, float(retry_after))
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(0, ceiling)
+
+    async def fetch(self, url, semaphore, headers=None, body=None):
+        """Fetches a URL, retrying throttled and failed responses.
+
+        The request is a POST of ``body`` as JSON when one is given.
+
+        Returns:
+            requests.Response: The successful response
+
+        Raises:
+            requests.exceptions.RequestException: When every attempt failed
+        """
+        host = urlparse(url).netloc
+        with self._buckets_lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = TokenBucket(self.rate_limit, self.burst)
+
+        for attempt in range(self.max_retries + 1):
+            response = None
+            error = None
+            await bucket.acquire()
+            async with semaphore:
+                self.request_count += 1
+                try:
+                    response = await asyncio.to_thread(
+                        self.session.request, "GET" if body is None else "POST", url,
+                        headers=headers, json=body, timeout=self.timeout)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    error = e
+            if response is not None and response.status_code not in RETRY_STATUS_CODES:
+                response.raise_for_status()
+                return response
+            if attempt == self.max_retries:
+                break
+            self.retry_count += 1
+            delay = self.getBackoff(attempt, response)
+            reason = error or "status {}".format(response.status_code)
+            logger.warning("Retrying %s in %.1fs (%s)", url, delay, reason)
+            await asyncio.sleep(delay)
+
+        if error is not None:
+            raise error
+        response.raise_for_status()
+        return response
+
+    async def fetchAll(self, urls, headers=None, bodies=None):
+        """Fetches every URL concurrently.
+
+        Args:
+            bodies(list<dict>): JSON to POST to each URL, in the same order
+
+        Returns:
+            list: The response for every URL in order, or the exception it failed with
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        bodies = bodies or [None] * len(urls)
+        tasks = [self.fetch(url, semaphore, headers=headers, body=body) for (url, body) in zip(urls, bodies)]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    def fetchAllSync(self, urls, headers=None, bodies=None):
+        """Runs ``fetchAll`` on its own event loop for callers that aren't async."""
+        return asyncio.run(self.fetchAll(urls, headers=headers, bodies=bodies))
+
+    def close(self):
+        self.session.close()
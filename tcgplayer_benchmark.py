@@ -0,0 +1,410 @@
+"""Benchmarks a pricing refresh against a local fake TCGPlayer site and an
+in-memory worksheet, so changes can be measured without touching Google
+Sheets or tcgplayer.com.
+
+    python tcgplayer_benchmark.py --rows 100 1000 10000
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import multiprocessing
+import os
+import random
+import re
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from tcgplayer_async_fetch import DEFAULT_CONCURRENCY
+from tcgplayer_price_source import HTTP_HEADERS, HtmlPriceSource, HttpPriceSource
+from tcgplayer_run_metrics import percentile
+from tcgplayer_sheet_schema import column_number
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+
+DEFAULT_ROWS = [100, 1000, 10000]
+DEFAULT_SERVER_DELAY = 0.02
+DEFAULT_DUPLICATE_RATIO = 0.1
+PRICE_SOURCES = ["http", "html"]
+BENCHMARK_RATE_LIMIT = 100000.0
+
+HEADERS = [
+    "Game",
+    "Series",
+    "Product Name",
+    "Number",
+    "TCG Product ID",
+    "TCG Link",
+    "Current Price (per unit)",
+    "Total Value",
+]
+
+DETAILS_REGEX = re.compile(r"/v2/product/(\d+)/details")
+PAGE_REGEX = re.compile(r"/product/(\d+)")
+A1_REGEX = re.compile(r"([A-Z]+)(\d+)")
+
+PRODUCT_PAGE = """<html><body>
+<div class="product-details__header"><h1 class="product-details__name">{product_name}</h1></div>
+<span data-testid="lblProductDetailsSetName">{set_name}</span>
+<section class="price-guide__points"><span class="price-points__upper__price">{price}</span></section>
+<img class="product-image__image" src="https://tcgplayer-cdn.tcgplayer.com/product/{product_id}_in_1000x1000.jpg">
+</body></html>"""
+
+
+class InMemoryWorksheet(object):
+    """Stands in for a gspread worksheet, counting every API call."""
+
+    def __init__(self, headers, records):
+        self.headers = list(headers)
+        self.rows = [[record.get(name, "") for name in self.headers] for record in records]
+        self.api_calls = 0
+        self.cells_written = 0
+
+    def get_all_records(self, head=1):
+        # The headers are always row 1
+        self.api_calls += 1
+        return [dict(zip(self.headers, row)) for row in self.rows]
+
+    def row_values(self, row):
+        self.api_calls += 1
+        return list(self.headers) if row == 1 else list(self.rows[row - 2])
+
+    def batch_update(self, data, value_input_option=None):
+        self.api_calls += 1
+        for update in data:
+            start = update['range'].split(':')[0]
+            match = A1_REGEX.match(start)
+            column = column_number(match.group(1))
+            row = self.rows[int(match.group(2)) - 2]
+            for (offset, value) in enumerate(update['values'][0]):
+                row[column - 1 + offset] = value
+                self.cells_written += 1
+
+
+class FakeTCGPlayerHandler(BaseHTTPRequestHandler):
+    """Serves product details JSON and product pages.
+
+    Recorded responses are read from ``recordings/<product id>.json`` or
+    ``.html`` when present.  Otherwise a product is generated from its ID.
+    """
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, don't let keep-alive responses stall on Nagle
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        if server.delay:
+            time.sleep(server.delay)
+        server.count()
+
+        match = DETAILS_REGEX.search(self.path)
+        if match:
+            self.sendRecorded(match.group(1), "json", "application/json")
+            return
+        match = PAGE_REGEX.search(self.path)
+        if match:
+            self.sendRecorded(match.group(1), "html", "text/html")
+            return
+        self.sendBody(404, b"", "text/plain")
+
+    def sendRecorded(self, product_id, extension, content_type):
+        body = self.server.readRecording(product_id, extension)
+        if body is None:
+            details = generate_product(product_id)
+            if extension == "json":
+                body = json.dumps(details).encode('utf-8')
+            else:
+                body = PRODUCT_PAGE.format(
+                    product_name=details['productName'],
+                    set_name=details['setName'],
+                    price="${:,.2f}".format(details['marketPrice']),
+                    product_id=product_id,
+                ).encode('utf-8')
+        self.sendBody(200, body, content_type)
+
+    def sendBody(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeTCGPlayerServer(ThreadingHTTPServer):
+    """Local HTTP server standing in for TCGPlayer, run on a background thread."""
+
+    daemon_threads = True
+
+    def __init__(self, delay=DEFAULT_SERVER_DELAY, recordings=None):
+        super().__init__(("127.0.0.1", 0), FakeTCGPlayerHandler)
+        self.delay = delay
+        self.recordings = recordings
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}".format(self.server_port)
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+        self.server_close()
+        return False
+
+    def count(self):
+        with self._lock:
+            self.requests += 1
+
+    def readRecording(self, product_id, extension):
+        if not self.recordings:
+            return None
+        path = os.path.join(self.recordings, "{}.{}".format(product_id, extension))
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as file:
+            return file.read()
+
+
+class TimedSession(requests.Session):
+    """Session recording how long every request took."""
+
+    def __init__(self):
+        super().__init__()
+        self.latencies = []
+        self._lock = threading.Lock()
+
+    def request(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().request(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.latencies.append(elapsed)
+
+
+def generate_product(product_id):
+    """(dict): Returns made up product details for a product ID"""
+    generator = random.Random(int(product_id))
+    return {
+        'productName': "Benchmark Card {}".format(product_id),
+        'setName': "Benchmark Set {}".format(int(product_id) % 40),
+        'marketPrice': round(generator.uniform(0.1, 200), 2),
+    }
+
+
+def build_inventory(rows, duplicate_ratio=DEFAULT_DUPLICATE_RATIO, seed=0):
+    """Builds an inventory where about ``duplicate_ratio`` of the rows repeat a product.
+
+    Returns:
+        list<dict>: The records
+    """
+    generator = random.Random(seed)
+    records = []
+    product_ids = []
+    for index in range(rows):
+        if product_ids and generator.random() < duplicate_ratio:
+            product_id = generator.choice(product_ids)
+        else:
+            product_id = 100000 + index
+            product_ids.append(product_id)
+        game = "Pokemon Single" if index % 3 else "Pokemon Sealed"
+        records.append({
+            "Game": game,
+            "Series": "",
+            "Product Name": "",
+            "Number": generator.randint(1, 4),
+            "TCG Product ID": product_id,
+            "TCG Link": "",
+            "Current Price (per unit)": "",
+            "Total Value": "",
+        })
+    return records
+
+
+def peak_rss_mb():
+    """(float): Returns the peak resident memory of this process in MB, if known"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    if os.uname().sysname == "Darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def run_benchmark(rows, delay=DEFAULT_SERVER_DELAY, concurrency=DEFAULT_CONCURRENCY,
+                  recordings=None, duplicate_ratio=DEFAULT_DUPLICATE_RATIO, price_source="http"):
+    """Runs one refresh of a generated inventory against the fake site.
+
+    ``price_source`` is "http" to price from the details JSON or "html" to
+    parse the product pages.
+
+    Returns:
+        dict: The measurements
+    """
+    # Imported here so spawned benchmark processes only pay for it once
+    from tcgplayer_tracker import TCGPlayerSheetManager
+
+    class BenchmarkSheetManager(TCGPlayerSheetManager):
+
+        def __init__(self, worksheet):
+            self.worksheet = worksheet
+            super().__init__("benchmark", 0)
+
+        def load(self):
+            return self.worksheet
+
+    worksheet = InMemoryWorksheet(HEADERS, build_inventory(rows, duplicate_ratio=duplicate_ratio))
+    manager = BenchmarkSheetManager(worksheet)
+    session = TimedSession()
+    session.headers.update(HTTP_HEADERS)
+    session.mount('http://', HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency))
+
+    with FakeTCGPlayerServer(delay=delay, recordings=recordings) as server:
+        if price_source == "html":
+            source = HtmlPriceSource(
+                base_url=server.url + "/product",
+                workers=concurrency,
+                session=session,
+                rate_limit=BENCHMARK_RATE_LIMIT,
+            )
+        else:
+            source = HttpPriceSource(
+                base_url=server.url,
+                workers=concurrency,
+                session=session,
+                rate_limit=BENCHMARK_RATE_LIMIT,
+            )
+        start = time.perf_counter()
+        with source:
+            manager.updatePricing(price_source=source)
+        elapsed = time.perf_counter() - start
+        network_requests = server.requests
+
+    latencies = session.latencies
+    return {
+        'rows': rows,
+        'price_source': price_source,
+        'seconds': round(elapsed, 3),
+        'rows_per_second': round(rows / elapsed, 1) if elapsed else None,
+        'sheet_api_calls': worksheet.api_calls,
+        'sheet_api_calls_per_row': round(worksheet.api_calls / rows, 4),
+        'network_requests_per_row': round(network_requests / rows, 4),
+        'cells_written': worksheet.cells_written,
+        'p50_latency_ms': round(percentile(latencies, 0.5) * 1000, 2) if latencies else None,
+        'p95_latency_ms': round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run_isolated(rows, **kwargs):
+    """Runs a benchmark in a fresh process so peak RSS belongs to that size alone."""
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(run_benchmark, rows, **kwargs).result()
+
+
+def print_report(results):
+    columns = [
+        ('rows', "Rows"),
+        ('rows_per_second', "Rows/s"),
+        ('sheet_api_calls_per_row', "Sheet calls/row"),
+        ('network_requests_per_row', "Requests/row"),
+        ('p50_latency_ms', "p50 ms"),
+        ('p95_latency_ms', "p95 ms"),
+        ('peak_rss_mb', "Peak RSS MB"),
+    ]
+    print(" | ".join("{:>15}".format(title) for (key, title) in columns))
+    for result in results:
+        values = []
+        for (key, title) in columns:
+            value = result[key]
+            if isinstance(value, float):
+                value = "{:.2f}".format(value)
+            values.append("{:>15}".format("-" if value is None else value))
+        print(" | ".join(values))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark a pricing refresh against a local fake TCGPlayer site')
+
+    parser.add_argument(
+        '--rows',
+        type=int,
+        nargs='+',
+        default=DEFAULT_ROWS,
+        help='Inventory sizes to benchmark (default: {})'.format(" ".join(str(rows) for rows in DEFAULT_ROWS)),
+    )
+
+    parser.add_argument(
+        '--delay-ms',
+        type=float,
+        default=DEFAULT_SERVER_DELAY * 1000,
+        help='Latency the fake site adds to every response (default: {:g})'.format(DEFAULT_SERVER_DELAY * 1000),
+    )
+
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help='Maximum requests in flight (default: {})'.format(DEFAULT_CONCURRENCY),
+    )
+
+    parser.add_argument(
+        '--price-source',
+        choices=PRICE_SOURCES,
+        default='http',
+        help='Price from the details JSON or by parsing product pages (default: http)',
+    )
+
+    parser.add_argument(
+        '--recordings',
+        default=None,
+        help='Directory of recorded <product id>.json / .html responses to serve',
+    )
+
+    parser.add_argument(
+        '--output',
+        default=None,
+        help='JSON file to write the results to',
+    )
+
+    args = parser.parse_args()
+
+    results = []
+    for rows in args.rows:
+        print("Benchmarking {} rows".format(rows))
+        results.append(run_isolated(
+            rows,
+            delay=args.delay_ms / 1000,
+            concurrency=args.concurrency,
+            recordings=args.recordings,
+            price_source=args.price_source,
+        ))
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+import base64
+import contextlib
+import json
+import logging
+import queue
+import threading
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.firefox.options import Options
+
+try:
+    import psutil
+except ImportError:
+    # Without psutil drivers are recycled on a page count only
+    psutil = None
+
+
+# Close a driver after this many pages to avoid memory issues, when its memory can't be measured
+DEFAULT_MAX_PAGES = 30
+# Recycle a driver once the browser grew this much past its size after the first page
+DEFAULT_MAX_RSS_GROWTH = 300 * 1024 * 1024
+# Upper bound on pages per driver even when its memory stays flat
+DEFAULT_MEASURED_MAX_PAGES = 500
+DEFAULT_POOL_SIZE = 1
+
+ORDER_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:91.0) Gecko/20100101 Firefox/91.0"
+
+IMAGES_ALL = "all"
+# Only the site and its images, no fonts, media or third party hosts
+IMAGES_ONLY = "only"
+IMAGES_OFF = "off"
+
+# Requests are sent to this closed port to block them
+BLOCKED_PROXY = "PROXY 127.0.0.1:9"
+
+# Analytics, ads and web fonts that product pages load but scraping never needs
+BLOCKED_HOSTS = [
+    "*google-analytics.com",
+    "*googletagmanager.com",
+    "*googleadservices.com",
+    "*googlesyndication.com",
+    "*doubleclick.net",
+    "*facebook.net",
+    "*facebook.com",
+    "*hotjar.com",
+    "*clarity.ms",
+    "*bing.com",
+    "*segment.io",
+    "*segment.com",
+    "*nr-data.net",
+    "*newrelic.com",
+    "*optimizely.com",
+    "*criteo.com",
+    "*adnxs.com",
+    "*amazon-adsystem.com",
+    "*scorecardresearch.com",
+    "*quantserve.com",
+    "*tiktok.com",
+    "*pinterest.com",
+    "*redditstatic.com",
+    "*fonts.googleapis.com",
+    "*fonts.gstatic.com",
+    "*typekit.net",
+]
+SITE_HOSTS = [
+    "tcgplayer.com",
+    "*.tcgplayer.com",
+    "localhost",
+    "127.0.0.1",
+]
+
+# Small caches, one content process and nothing loaded ahead of time
+LEAN_PREFERENCES = {
+    "browser.cache.disk.enable": False,
+    "browser.cache.memory.enable": True,
+    "browser.cache.memory.capacity": 65536,
+    "browser.sessionhistory.max_entries": 2,
+    "browser.sessionhistory.max_total_viewers": 0,
+    "dom.ipc.processCount": 1,
+    "fission.autostart": False,
+    "gfx.downloadable_fonts.enabled": False,
+    "browser.display.use_document_fonts": 0,
+    "media.autoplay.default": 5,
+    "network.prefetch-next": False,
+    "network.dns.disablePrefetch": True,
+    "network.http.speculative-parallel-limit": 0,
+    "browser.shell.checkDefaultBrowser": False,
+    "datareporting.policy.dataSubmissionEnabled": False,
+    "toolkit.telemetry.enabled": False,
+}
+
+logger = logging.getLogger(__name__)
+
+
+class BrowserProfile(object):
+    """How Firefox is set up for one kind of page load.
+
+    ``images`` is IMAGES_ALL, IMAGES_ONLY or IMAGES_OFF.  Requests to hosts
+    matching ``blocked_hosts`` are dropped, and when ``allowed_hosts`` is set
+    every other host is dropped.  Hosts are matched with the shell patterns of
+    a proxy auto-config script, which only sees the host of HTTPS requests.
+    """
+
+    __slots__ = ("name", "images", "blocked_hosts", "allowed_hosts", "preferences", "width", "height")
+
+    def __init__(self, name, images=IMAGES_ALL, blocked_hosts=None, allowed_hosts=None,
+                 preferences=None, width=1920, height=1080):
+        self.name = name
+        self.images = images
+        self.blocked_hosts = list(blocked_hosts or [])
+        self.allowed_hosts = list(allowed_hosts or [])
+        self.preferences = dict(preferences or {})
+        self.width = width
+        self.height = height
+
+    def __repr__(self):
+        return "BrowserProfile({!r})".format(self.name)
+
+    def buildProxyScript(self):
+        """(str): Returns the proxy auto-config script doing the blocking, or None if nothing is blocked"""
+        if not self.blocked_hosts and not self.allowed_hosts:
+            return None
+        return (
+            "var blocked = {blocked};\n"
+            "var allowed = {allowed};\n"
+            "function matches(host, patterns) {{\n"
+            "    for (var i = 0; i < patterns.length; i++) {{\n"
+            "        if (shExpMatch(host, patterns[i])) return true;\n"
+            "    }}\n"
+            "    return false;\n"
+            "}}\n"
+            "function FindProxyForURL(url, host) {{\n"
+            "    if (matches(host, blocked)) return \"{proxy}\";\n"
+            "    if (allowed.length && !matches(host, allowed)) return \"{proxy}\";\n"
+            "    return \"DIRECT\";\n"
+            "}}\n"
+        ).format(
+            blocked=json.dumps(self.blocked_hosts),
+            allowed=json.dumps(self.allowed_hosts),
+            proxy=BLOCKED_PROXY,
+        )
+
+    def apply(self, options):
+        """Sets the window size, preferences and blocking on Firefox options."""
+        options.add_argument("--width={}".format(self.width))
+        options.add_argument("--height={}".format(self.height))
+        for (name, value) in self.preferences.items():
+            options.set_preference(name, value)
+        if self.images == IMAGES_OFF:
+            options.set_preference("permissions.default.image", 2)
+        if self.images == IMAGES_ONLY:
+            options.set_preference("media.autoplay.default", 5)
+            options.set_preference("media.mediasource.enabled", False)
+        script = self.buildProxyScript()
+        if script:
+            options.set_preference("network.proxy.type", 2)
+            options.set_preference(
+                "network.proxy.autoconfig_url",
+                "data:application/x-ns-proxy-autoconfig;base64," + base64.b64encode(script.encode()).decode(),
+            )
+
+
+# Price pages only need the text of the price guide
+PRICE_PROFILE = BrowserProfile(
+    "price",
+    images=IMAGES_OFF,
+    blocked_hosts=BLOCKED_HOSTS,
+    preferences=LEAN_PREFERENCES,
+    width=1280,
+    height=800,
+)
+# Order pages need the product image's lazy loaded source and nothing from other sites
+IMAGE_PROFILE = BrowserProfile(
+    "image",
+    images=IMAGES_ONLY,
+    blocked_hosts=BLOCKED_HOSTS,
+    allowed_hosts=SITE_HOSTS,
+    preferences=LEAN_PREFERENCES,
+    width=1280,
+    height=800,
+)
+# Everything a normal browser loads, for debugging pages that render differently
+FULL_PROFILE = BrowserProfile("full")
+
+PROFILES = {profile.name: profile for profile in (PRICE_PROFILE, IMAGE_PROFILE, FULL_PROFILE)}
+
+
+def create_firefox_driver(user_agent=None, profile=PRICE_PROFILE):
+    """Creates a headless Firefox driver.
+
+    Args:
+        user_agent(str): Optional user agent to send instead of Firefox's own
+        profile(BrowserProfile): What the browser loads and blocks
+
+    Returns:
+        webdriver.Firefox: The driver
+    """
+    # Setup Firefox options
+    firefox_options = Options()
+    firefox_options.add_argument("--headless")  # Run in background
+    firefox_options.add_argument("--no-sandbox")
+    firefox_options.add_argument("--disable-dev-shm-usage")
+    profile.apply(firefox_options)
+
+    if user_agent:
+        firefox_options.set_preference("general.useragent.override", user_agent)
+
+    return webdriver.Firefox(options=firefox_options)
+
+
+def driver_memory(driver):
+    """
+    Measures the resident memory of a driver's browser
+
+    Returns:
+        int: The bytes used by Firefox and its content processes, or None if
+            it can't be measured
+    """
+    if psutil is None:
+        return None
+    pid = (getattr(driver, "capabilities", None) or {}).get("moz:processID")
+    if not pid:
+        return None
+    try:
+        browser = psutil.Process(pid)
+        processes = [browser] + browser.children(recursive=True)
+    except psutil.Error:
+        return None
+    total = 0
+    for process in processes:
+        try:
+            total += process.memory_info().rss
+        except psutil.Error:
+            # Content processes come and go between pages
+            continue
+    return total
+
+
+class BrowserSession(object):
+    """A warm web driver that is recycled once it has grown too much.
+
+    The browser's memory is measured before every page.  The driver is
+    recycled when it grew ``max_rss_growth`` bytes past its size after the
+    first page, or after ``measured_max_pages`` pages.  When memory can't be
+    measured it is recycled every ``max_pages`` pages instead.
+    """
+
+    def __init__(self, factory=create_firefox_driver, max_pages=DEFAULT_MAX_PAGES,
+                 max_rss_growth=DEFAULT_MAX_RSS_GROWTH, measured_max_pages=DEFAULT_MEASURED_MAX_PAGES,
+                 driver=None):
+        self.factory = factory
+        self.max_pages = max_pages
+        self.max_rss_growth = max_rss_growth
+        self.measured_max_pages = measured_max_pages
+        self.pages = 0
+        self.restarts = 0
+        self.baseline_rss = None
+        self.rss_growth = 0
+        self._driver = driver
+
+    @property
+    def driver(self):
+        """(WebDriver): Returns the driver, starting one if needed"""
+        if self._driver is None:
+            self._driver = self.factory()
+        return self._driver
+
+    def get(self, url):
+        """Loads the url, first recycling the driver if it is over its page budget.
+
+        Returns:
+            WebDriver: The driver showing the page
+        """
+        driver = self.nextDriver()
+        driver.get(url)
+        return driver
+
+    def nextDriver(self):
+        """Returns the driver for the next page load and counts the page.
+
+        The driver is recycled first if it is over its page budget.
+        """
+        if self._driver is not None and self.isOverBudget():
+            self.restart()
+        driver = self.driver
+        self.pages += 1
+        return driver
+
+    def isOverBudget(self):
+        """(bool): Returns if the driver should be recycled before the next page"""
+        rss = None
+        if self.max_rss_growth and self.pages:
+            rss = driver_memory(self._driver)
+        if rss is None:
+            if self.pages >= self.max_pages:
+                logger.info("Closing web driver to avoid memory issues after %s pages", self.pages)
+                return True
+            return False
+        if self.baseline_rss is None:
+            self.baseline_rss = rss
+        self.rss_growth = rss - self.baseline_rss
+        if self.rss_growth >= self.max_rss_growth:
+            logger.info("Closing web driver after it grew %.0f MB over %s pages",
+                        self.rss_growth / (1024 * 1024), self.pages)
+            return True
+        if self.pages >= self.measured_max_pages:
+            logger.info("Closing web driver after %s pages", self.pages)
+            return True
+        return False
+
+    def restart(self):
+        """Quits the driver so the next page starts a fresh one."""
+        self.quit()
+        self.restarts += 1
+
+    def quit(self):
+        if self._driver is not None:
+            try:
+                self._driver.quit()
+            except WebDriverException as e:
+                logger.warning("Failed to quit web driver: %s", e)
+        self._driver = None
+        self.pages = 0
+        self.baseline_rss = None
+        self.rss_growth = 0
+
+
+class BrowserPool(object):
+    """A small pool of warm browser sessions shared between threads.
+
+    Sessions are started lazily, up to ``size`` of them.  ``session()``
+    blocks until one is free.  A session whose driver raised a
+    ``WebDriverException`` is restarted before it goes back in the pool.
+    """
+
+    _INSTANCE = None
+    _INSTANCE_LOCK = threading.Lock()
+
+    def __init__(self, size=DEFAULT_POOL_SIZE, factory=create_firefox_driver, max_pages=DEFAULT_MAX_PAGES):
+        self.size = size
+        self.factory = factory
+        self.max_pages = max_pages
+        self._idle = queue.LifoQueue()
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared_instance(cls, size=DEFAULT_POOL_SIZE, factory=create_firefox_driver):
+        with cls._INSTANCE_LOCK:
+            if cls._INSTANCE is None:
+                cls._INSTANCE = cls(size=size, factory=factory)
+            return cls._INSTANCE
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if len(self._sessions) < self.size:
+                browser = BrowserSession(self.factory, max_pages=self.max_pages)
+                self._sessions.append(browser)
+                return browser
+        return self._idle.get()
+
+    @contextlib.contextmanager
+    def session(self):
+        """Checks out a BrowserSession for the duration of the block."""
+        browser = self._checkout()
+        try:
+            yield browser
+        except WebDriverException:
+            # The browser may have crashed, don't hand it to anyone else
+            browser.restart()
+            raise
+        finally:
+            self._idle.put(browser)
+
+    def close(self):
+        """Quits every driver in the pool."""
+        with self._lock:
+            for browser in self._sessions:
+                browser.quit()
@@ -1,211 +1,226 @@
-from collections import OrderedDict
-import re
-import time
+import base64
+import logging
+import threading
 
-import PyPDF2
 from PySide6 import QtWidgets, QtCore, QtGui
 
-from bs4 import BeautifulSoup
 import requests
 
-from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.firefox.options import Options
 
-def get_lazy_loaded_content_selenium(url, wait_time=10):
+from tcgplayer_async_fetch import AsyncFetcher
+from tcgplayer_browser import IMAGE_PROFILE, ORDER_USER_AGENT, BrowserPool, create_firefox_driver
+from tcgplayer_image_cache import ICON, TOOLTIP, ImageCache
+from tcgplayer_order_pdf import count_order_products, get_product_catalog_id
+from tcgplayer_page_parser import IMAGE_SELECTORS, find_image_url, parse_html
+from tcgplayer_pick_list import InventoryIndex, build_pick_list, decrement_inventory, write_pick_list_csv
+from tcgplayer_run_metrics import configure_logging
+
+
+# Each loader thread drives its own browser, so keep this small
+ORDER_LOADER_THREADS = 3
+
+logger = logging.getLogger(__name__)
+
+
+def get_order_browser_pool():
+    """Returns the pool of warm browsers shared by every order page load"""
+    return BrowserPool.shared_instance(
+        size=ORDER_LOADER_THREADS,
+        factory=lambda: create_firefox_driver(user_agent=ORDER_USER_AGENT, profile=IMAGE_PROFILE),
+    )
+
+
+def product_image_loaded(driver):
     """
-    Use Selenium to wait for lazy-loaded content, then parse with BeautifulSoup
+    Wait condition for the product image once its lazy loaded source is set
+
+    Returns:
+        WebElement: The image element, or False while it is still loading
     """
-    # Setup Firefox options
-    firefox_options = Options()
-    firefox_options.add_argument("--headless")  # Run in background
-    firefox_options.add_argument("--no-sandbox")
-    firefox_options.add_argument("--disable-dev-shm-usage")
-    firefox_options.add_argument("--width=1920")
-    firefox_options.add_argument("--height=1080")
-    
-    # Optional: Set custom user agent
-    firefox_options.set_preference("general.useragent.override", 
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:91.0) Gecko/20100101 Firefox/91.0")
-    
-    # Optional: Disable images for faster loading (if you don't need them)
-    # firefox_options.set_preference("permissions.default.image", 2)
-    
-    driver = webdriver.Firefox(options=firefox_options)
+    for element in driver.find_elements(By.CSS_SELECTOR, ", ".join(IMAGE_SELECTORS)):
+        if element.get_attribute("srcset") or element.get_attribute("src"):
+            return element
+    return False
 
-    try:
+
+def get_lazy_loaded_content_selenium(url, wait_time=10, browser_pool=None):
+    """
+    Use Selenium to wait for lazy-loaded content, then parse with BeautifulSoup
+
+    Pages are loaded in a warm browser from the shared pool instead of
+    starting Firefox for every URL.
+    """
+    browser_pool = browser_pool or get_order_browser_pool()
+    with browser_pool.session() as browser:
         # Load the page
-        driver.get(url)
-        
-        # Wait for specific elements to load (adjust selector as needed)
-        wait = WebDriverWait(driver, wait_time)
+        driver = browser.get(url)
         
-        # Example: Wait for images to load
-        wait.until(EC.presence_of_element_located((By.TAG_NAME, "img")))
-        
-        # Additional wait for lazy loading
-        time.sleep(2)
+        # Wait for the product image to get its lazy loaded source
+        try:
+            WebDriverWait(driver, wait_time).until(product_image_loaded)
+        except TimeoutException:
+            logger.warning("Timed out waiting for the product image on %s", url)
         
         # Get the final HTML after all content is loaded
         html = driver.page_source
         
-        # Parse with BeautifulSoup
-        soup = BeautifulSoup(html, 'html.parser')
-        return soup
-        
-    finally:
-        driver.quit()
+    # Parse with BeautifulSoup
+    soup = parse_html(html)
+    return soup
+
+# Request headers to avoid blocking
+IMAGE_REQUEST_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+}
+
+def find_tcgplayer_image_url(soup):
+    """
+    Find the product image URL on a TCGPlayer product page
+
+    Args:
+        soup (BeautifulSoup): Parsed product page
+
+    Returns:
+        str: Absolute URL of the largest product image, or None if not found
+    """
+    image_url = find_image_url(soup)
+    if not image_url:
+        logger.info("No product image found on the page")
+        return None
+    return image_url
+
+
+def pixmap_from_image_data(data):
+    """
+    Create a QPixmap from downloaded image bytes
+
+    Returns:
+        QPixmap: Image as QPixmap, or None if the data isn't an image
+    """
+    pixmap = QtGui.QPixmap()
+    success = pixmap.loadFromData(data)
+
+    if success:
+        return pixmap
+    else:
+        logger.warning("Failed to create QPixmap from image data")
+        return None
+
 
 def fetch_tcgplayer_image(soup):
     """
     Fetch product image from TCGPlayer URL and return as QPixmap
     
     Args:
-        product_url (str): TCGPlayer product URL
+        soup (BeautifulSoup): Parsed product page
         
     Returns:
         QPixmap: Image as QPixmap, or None if failed
     """
     try:
-        # Request headers to avoid blocking
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1',
-        }
-        
-        # Get the product page
-        # response = requests.get(product_url, headers=headers, timeout=10)
-        # response.raise_for_status()
-        
-        # # Parse the HTML
-        # soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # TCGPlayer image selectors (try multiple approaches)
-        image_url = None
-        
-        # Method 1: Look for specific TCGPlayer image classes
-        selectors = [
-            'img.product-image__image',
-            'img[data-testid="product-image"]',
-            '.product-image img',
-            '.product-details img',
-            'img[alt*="Product Image"]',
-            '.primary-image img',
-            'lazy-image__wrapper',
-        ]
-        
-        for selector in selectors:
-            # print(f"Trying selector: {selector}")
-            img_tag = soup.select_one(selector)
-            if img_tag:
-                srcset = img_tag.get('srcset')
-                pattern = r'(https://[^\s]+1000x1000\.jpg)\s+1000w'
-                match = re.search(pattern, srcset)
-                if match:
-                    image_url = match.group(1)
-                else:
-                    # Fallback to src or data-src
-                    image_url = img_tag.get('src') or img_tag.get('data-src')
-                if image_url:
-                    break
-        
-        # Method 2: Fallback - look for any image with product-like characteristics
-        # if not image_url:
-        #     for img in soup.find_all('img'):
-        #         src = img.get('src') or img.get('data-src', '')
-        #         alt = img.get('alt', '').lower()
-                
-        #         # Look for images that are likely product images
-        #         if (any(keyword in src for keyword in ['product', 'card', 'image']) or
-        #             any(keyword in alt for keyword in ['product', 'card', 'image']) or
-        #             any(ext in src for ext in ['.jpg', '.jpeg', '.png', '.webp'])):
-                    
-        #             if 'tcgplayer' in src or src.startswith('/'):
-        #                 image_url = src
-        #                 break
-        
+        image_url = find_tcgplayer_image_url(soup)
         if not image_url:
-            print("No product image found on the page")
             return None
         
-        # Convert relative URL to absolute
-        if image_url.startswith('//'):
-            image_url = 'https:' + image_url
-        elif image_url.startswith('/'):
-            image_url = 'https://www.tcgplayer.com' + image_url
-        
-        print(f"Found image URL: {image_url}")
-        
         # Download the image
-        img_response = requests.get(image_url, headers=headers, timeout=10)
+        img_response = requests.get(image_url, headers=IMAGE_REQUEST_HEADERS, timeout=10)
         img_response.raise_for_status()
         
         # Create QPixmap from image data
-        pixmap = QtGui.QPixmap()
-        success = pixmap.loadFromData(img_response.content)
-        
-        if success:
-            print(f"Successfully loaded image: {pixmap.width()}x{pixmap.height()}")
-            return pixmap
-        else:
-            print("Failed to create QPixmap from image data")
-            return None
+        return pixmap_from_image_data(img_response.content)
             
     except requests.exceptions.RequestException as e:
-        print(f"Network error: {e}")
+        logger.warning("Network error: %s", e)
         return None
-    except Exception as e:
-        print(f"Error: {e}")
+    except Exception:
+        logger.exception("Failed to fetch the product image")
         return None
 
 
-def extract_order_details(pdf_path):
-    order_details = []
-    urls = OrderedDict()
-    
-    with open(pdf_path, 'rb') as file:
-        reader = PyPDF2.PdfReader(file)
-        for (page_num, page) in enumerate(reader.pages):
-            if '/Annots' in page:
-                annotations = page['/Annots']
-                
-                for annotation in annotations:
-                    annotation_obj = annotation.get_object()
-                    
-                    # Check if it's a link annotation
-                    if annotation_obj.get('/Subtype') == '/Link':
-                        # Check for URI action
-                        if '/A' in annotation_obj:
-                            action = annotation_obj['/A']
-                            if '/URI' in action:
-                                url = action['/URI']
-                                # TODO, replace this with the actual text content if possible
-                                urls[url] = url
-                    if annotation_obj.get('/Subtype') == "/Text":
-                        print(annotation_obj["/Contents"])
-        print("Extracted URLs:")
-        urls = [url for url in urls if 'productCatalog' in url]
-        for url in urls:
-            print(f"{url}")
-        return urls
+class ProductLoadSignals(QtCore.QObject):
+    """Signals emitted from a ProductLoadTask back to the GUI thread"""
+    # index, url, image variants (or None)
+    loaded = QtCore.Signal(int, str, object)
+    # index, url, error message
+    failed = QtCore.Signal(int, str, str)
+
+
+class ProductLoadTask(QtCore.QRunnable):
+    """Loads one product page and downloads its image off the GUI thread
+
+    The image is handed back as pre-scaled PNG bytes from the image cache
+    since a QPixmap can only be created on the GUI thread.  Products that
+    are already cached need neither the browser nor the network.
+    """
+
+    def __init__(self, index, url, cancel_event, fetcher, image_cache):
+        super().__init__()
+        self.index = index
+        self.url = url
+        self.cancel_event = cancel_event
+        self.fetcher = fetcher
+        self.image_cache = image_cache
+        self.signals = ProductLoadSignals()
+
+    def run(self):
+        if self.cancel_event.is_set():
+            return
+        try:
+            variants = self.load_image_variants()
+        except Exception as e:
+            if not self.cancel_event.is_set():
+                self.signals.failed.emit(self.index, self.url, str(e))
+            return
+        if not self.cancel_event.is_set():
+            self.signals.loaded.emit(self.index, self.url, variants)
+
+    def load_image_variants(self):
+        image_url = self.image_cache.getImageUrl(self.url)
+        if not image_url:
+            soup = get_lazy_loaded_content_selenium(self.url)
+            if self.cancel_event.is_set():
+                return None
+            image_url = find_tcgplayer_image_url(soup)
+            if not image_url:
+                return None
+            self.image_cache.putImageUrl(self.url, image_url)
+
+        variants = self.image_cache.getVariants(image_url)
+        if variants is not None:
+            return variants
+
+        (response,) = self.fetcher.fetchAllSync([image_url], headers=IMAGE_REQUEST_HEADERS)
+        if isinstance(response, Exception):
+            raise response
+        return self.image_cache.put(image_url, response.content)
+
 
 class OrderWindow(QtWidgets.QMainWindow):
     def __init__(self):
         super().__init__()
         self.urls = [] 
+        self.quantities = {}
+        self.unread = {}
+        self.pdf_file = None
+
+        self.thread_pool = QtCore.QThreadPool()
+        self.thread_pool.setMaxThreadCount(ORDER_LOADER_THREADS)
+        # Shared so every loader thread goes through the same rate limit
+        self.fetcher = AsyncFetcher()
+        self.image_cache = ImageCache()
+        self.cancel_event = threading.Event()
+        self.loaded_count = 0
 
         self.setWindowTitle("TCGPlayer Order Details")
         self.setGeometry(100, 100, 800, 600)
-        # TODO Add a QFileDialog to select the PDF file
-        # TODO Add a progress bar while loading images
-        # TODO Add some sort of checkbox to mark which items have been found
-        # TODO Add a button to save the order details to excel sheet
 
         self.setupUi()
 
@@ -227,12 +242,29 @@ class OrderWindow(QtWidgets.QMainWindow):
 
         # Process
         processLayout = QtWidgets.QHBoxLayout() 
-        processButton = QtWidgets.QPushButton("Process Order")
-        processButton.clicked.connect(self.process_order)
-        processLayout.addWidget(processButton)
+        self.processButton = QtWidgets.QPushButton("Process Order")
+        self.processButton.clicked.connect(self.process_order)
+        processLayout.addWidget(self.processButton)
+        self.pickListButton = QtWidgets.QPushButton("Save Pick List")
+        self.pickListButton.setEnabled(False)
+        self.pickListButton.clicked.connect(self.save_pick_list)
+        processLayout.addWidget(self.pickListButton)
         processLayout.setContentsMargins(10, 10, 10, 10)
         self.layout.addLayout(processLayout)
 
+        # Progress
+        progressLayout = QtWidgets.QHBoxLayout()
+        self.progressBar = QtWidgets.QProgressBar()
+        self.progressBar.setFormat("%v / %m")
+        self.progressBar.setValue(0)
+        progressLayout.addWidget(self.progressBar)
+        self.cancelButton = QtWidgets.QPushButton("Cancel")
+        self.cancelButton.setEnabled(False)
+        self.cancelButton.clicked.connect(self.cancel_loading)
+        progressLayout.addWidget(self.cancelButton)
+        progressLayout.setContentsMargins(10, 0, 10, 0)
+        self.layout.addLayout(progressLayout)
+
         self.order_list_widget = QtWidgets.QListWidget()
         self.order_list_widget.setIconSize(QtCore.QSize(200, 200))
         self.order_list_widget.setSpacing(10)
@@ -245,25 +277,74 @@ class OrderWindow(QtWidgets.QMainWindow):
         self.setCentralWidget(container)
 
     def populate_order_list(self):
+        """Start loading every product in the background
+
+        Items are added to the list as soon as their image arrives.
+        """
         self.order_list_widget.clear()
+        self.cancel_event = threading.Event()
+        self.loaded_count = 0
+        self.progressBar.setRange(0, len(self.urls))
+        self.progressBar.setValue(0)
+        self.processButton.setEnabled(False)
+        self.cancelButton.setEnabled(True)
         # Process the urls
-        for url in self.urls:
-            soup = get_lazy_loaded_content_selenium(url)
-
-            pixmap = fetch_tcgplayer_image(soup)
-            icon = QtGui.QIcon()
-            if pixmap:
-                icon = QtGui.QIcon(pixmap)
-            list_widget_item = QtWidgets.QListWidgetItem(icon, url)
-            if pixmap:
-                # Doesn't seem to be working on macos. Need to test on windows
-                tooltip = self.create_tooltip_with_large_icon(
-                        pixmap, 
-                        tooltip_text=url, 
-                        icon_size=(1000, 1000)
-                    )
-                list_widget_item.setToolTip(tooltip)
-            self.order_list_widget.addItem(QtWidgets.QListWidgetItem(icon, url))
+        for (index, url) in enumerate(self.urls):
+            task = ProductLoadTask(index, url, self.cancel_event, self.fetcher, self.image_cache)
+            task.signals.loaded.connect(self._on_product_loaded)
+            task.signals.failed.connect(self._on_product_failed)
+            self.thread_pool.start(task)
+
+    def add_order_item(self, url, variants):
+        icon = QtGui.QIcon()
+        pixmap = pixmap_from_image_data(variants[ICON]) if variants else None
+        if pixmap:
+            icon = QtGui.QIcon(pixmap)
+        list_widget_item = QtWidgets.QListWidgetItem(icon, "{} x{}".format(url, self.quantities.get(url) or "?"))
+        # Ticked off once the item has been found on the shelf
+        list_widget_item.setFlags(list_widget_item.flags() | QtCore.Qt.ItemIsUserCheckable)
+        list_widget_item.setCheckState(QtCore.Qt.Unchecked)
+        list_widget_item.setData(QtCore.Qt.UserRole, url)
+        if pixmap:
+            # Doesn't seem to be working on macos. Need to test on windows
+            tooltip = self.create_tooltip_from_png(variants[TOOLTIP], tooltip_text=url)
+            list_widget_item.setToolTip(tooltip)
+        self.order_list_widget.addItem(list_widget_item)
+        return list_widget_item
+
+    def _on_product_loaded(self, index, url, variants):
+        self.add_order_item(url, variants)
+        self._advance_progress()
+
+    def _on_product_failed(self, index, url, error):
+        logger.warning("Failed to load %s: %s", url, error)
+        self.add_order_item(url, None)
+        self._advance_progress()
+
+    def _advance_progress(self):
+        self.loaded_count += 1
+        self.progressBar.setValue(self.loaded_count)
+        if self.loaded_count >= len(self.urls):
+            self._finish_loading()
+
+    def _finish_loading(self):
+        self.processButton.setEnabled(True)
+        self.cancelButton.setEnabled(False)
+
+    def cancel_loading(self):
+        """Stop loading the remaining products"""
+        self.cancel_event.set()
+        # Drop the tasks that haven't started, running ones stop at their next check
+        self.thread_pool.clear()
+        self._finish_loading()
+
+    def closeEvent(self, event):
+        self.cancel_loading()
+        self.thread_pool.waitForDone()
+        self.fetcher.close()
+        get_order_browser_pool().close()
+        self.image_cache.close()
+        super().closeEvent(event)
 
     def _openPDFFile(self):
         """Open a file dialog to select the PDF file"""
@@ -280,12 +361,72 @@ class OrderWindow(QtWidgets.QMainWindow):
     def process_order(self):
         """Process the order by extracting details from the PDF"""
         pdf_path = self.pdf_file
-        self.urls = extract_order_details(pdf_path)
+        if not pdf_path:
+            QtWidgets.QMessageBox.warning(self, "No PDF Selected", "Select a TCGPlayer order PDF first.")
+            return
+        (self.quantities, self.unread) = count_order_products(pdf_path)
+        self.urls = list(dict.fromkeys(list(self.quantities) + list(self.unread)))
         if not self.urls:
             QtWidgets.QMessageBox.warning(self, "No URLs Found", "No TCGPlayer product URLs found in the PDF.")
             return
+        self.pickListButton.setEnabled(True)
         self.populate_order_list()
 
+    def found_product_ids(self):
+        """Returns the product IDs of the items ticked off as found"""
+        found = set()
+        for row in range(self.order_list_widget.count()):
+            item = self.order_list_widget.item(row)
+            if item.checkState() == QtCore.Qt.Checked:
+                found.add(get_product_catalog_id(item.data(QtCore.Qt.UserRole)))
+        return found
+
+    def save_pick_list(self):
+        """Match the order against the inventory sheet and save the pick list
+
+        The items ticked off as found can then be taken out of the sheet in
+        one batch update.  The sheet is left alone when the quantity of a
+        line item couldn't be read from the PDF.
+        """
+        file_path, _ = QtWidgets.QFileDialog.getSaveFileName(
+            self, "Save Pick List", "pick_list.csv", "CSV Files (*.csv);;All Files (*)"
+        )
+        if not file_path:
+            return
+        # Imported here so the order window can open without the sheet credentials
+        from tcgplayer_tracker import TCGPlayerSheetManager
+
+        manager = TCGPlayerSheetManager.shared_instance()
+        records = manager.loadRecords()
+        picks = build_pick_list(InventoryIndex(manager, records), self.quantities)
+        with open(file_path, 'w', newline='') as output:
+            write_pick_list_csv(picks, output)
+
+        unread = sum(self.unread.values())
+        if unread:
+            QtWidgets.QMessageBox.warning(
+                self, "Quantity Not Read",
+                "The quantity of {} line items couldn't be read from the PDF, "
+                "so the inventory sheet won't be updated.".format(unread))
+            return
+        found = self.found_product_ids()
+        in_stock = [pick for pick in picks if pick.record is not None and pick.product_id in found]
+        missing = sum(pick.quantity for pick in picks if pick.record is None)
+        not_found = sum(pick.quantity for pick in picks if pick.record is not None and pick.product_id not in found)
+        if not in_stock:
+            QtWidgets.QMessageBox.warning(
+                self, "Nothing To Take Out",
+                "None of the items ticked off as found are in the inventory sheet.")
+            return
+        message = "Take the {} picked items out of the inventory sheet?".format(sum(pick.quantity for pick in in_stock))
+        if not_found:
+            message += "\n{} items are not ticked off as found and stay in the sheet.".format(not_found)
+        if missing:
+            message += "\n{} items are not in the inventory.".format(missing)
+        answer = QtWidgets.QMessageBox.question(self, "Update Inventory", message)
+        if answer == QtWidgets.QMessageBox.Yes:
+            decrement_inventory(manager, in_stock)
+
     def create_tooltip_with_large_icon(self, icon_path, tooltip_text="", icon_size=(128, 128)):
         """Create HTML tooltip with enlarged icon"""
         # Load and scale the pixmap
@@ -295,12 +436,17 @@ class OrderWindow(QtWidgets.QMainWindow):
             QtCore.Qt.SmoothTransformation
         )
         
-        # Convert pixmap to base64 for HTML embedding
+        # Convert pixmap to PNG for HTML embedding
         buffer = QtCore.QBuffer()
         buffer.open(QtCore.QIODevice.WriteOnly)
         pixmap.save(buffer, "PNG")
-        image_data = buffer.data().toBase64().data().decode()
+        png_data = bytes(buffer.data())
         buffer.close()
+        return self.create_tooltip_from_png(png_data, tooltip_text=tooltip_text)
+
+    def create_tooltip_from_png(self, png_data, tooltip_text=""):
+        """Create HTML tooltip embedding PNG data that is already scaled"""
+        image_data = base64.b64encode(png_data).decode()
         
         # Create HTML tooltip
         html_tooltip = f'''
@@ -318,6 +464,7 @@ def main():
     # scaled_pixmap = pixmap.scaled(300, 400, Qt.KeepAspectRatio, Qt.SmoothTransformation)
     # label.setPixmap(scaled_pixmap)
     path = "/Users/stephenlu/Downloads/TCGplayer Seller Portal.pdf"
+    configure_logging()
     app = QtWidgets.QApplication([])
     window = OrderWindow()
     window.show()
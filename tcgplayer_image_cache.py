@@ -0,0 +1,208 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from PySide6 import QtCore, QtGui
+
+
+DEFAULT_IMAGE_CACHE_DIR = ".tcgplayer_image_cache"
+DEFAULT_IMAGE_CACHE_BYTES = 500 * 1024 * 1024
+
+ORIGINAL = "original"
+ICON = "icon"
+TOOLTIP = "tooltip"
+
+# Longest side in pixels of every pre-scaled variant
+VARIANT_SIZES = {
+    ICON: 200,
+    TOOLTIP: 1000,
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS images_last_used ON images (last_used);
+CREATE TABLE IF NOT EXISTS pages (
+    page_url TEXT PRIMARY KEY,
+    image_url TEXT NOT NULL
+);
+"""
+
+
+def image_key(image_url):
+    """Returns the cache key for an image URL"""
+    return hashlib.sha256(image_url.encode('utf-8')).hexdigest()
+
+
+def scale_image_data(data, size):
+    """
+    Scale image bytes so the longest side is at most ``size`` and encode as PNG
+
+    QImage is safe to use off the GUI thread, unlike QPixmap.
+
+    Returns:
+        bytes: The PNG data, or None if the data isn't an image
+    """
+    image = QtGui.QImage()
+    if not image.loadFromData(data):
+        return None
+    if image.width() > size or image.height() > size:
+        image = image.scaled(
+            size, size,
+            QtCore.Qt.KeepAspectRatio,
+            QtCore.Qt.SmoothTransformation
+        )
+    buffer = QtCore.QBuffer()
+    buffer.open(QtCore.QIODevice.WriteOnly)
+    image.save(buffer, "PNG")
+    png_data = bytes(buffer.data())
+    buffer.close()
+    return png_data
+
+
+class ImageCache(object):
+    """
+    On-disk cache of product images keyed by a hash of the image URL
+
+    Every image is stored as downloaded along with PNG variants pre-scaled
+    for the list icon and the tooltip, so showing a cached product needs no
+    network traffic and no rescaling.  The product page URL to image URL
+    lookup is cached too so a known product doesn't need a browser either.
+
+    Once the files take more than ``max_bytes`` the least recently used
+    images are evicted.  The cache can be shared between loader threads.
+    """
+
+    def __init__(self, path=DEFAULT_IMAGE_CACHE_DIR, max_bytes=DEFAULT_IMAGE_CACHE_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(os.path.join(path, "index.sqlite3"), check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+
+    def getFilePath(self, image_url, variant):
+        return os.path.join(self.path, "{}.{}".format(image_key(image_url), variant))
+
+    def getImageUrl(self, page_url):
+        """Returns the image URL found on the product page before, if any"""
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT image_url FROM pages WHERE page_url = ?", (page_url,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def putImageUrl(self, page_url, image_url):
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO pages (page_url, image_url) VALUES (?, ?)",
+                (page_url, image_url),
+            )
+            self.connection.commit()
+
+    def get(self, image_url, variant):
+        """
+        Returns the cached bytes of the image variant
+
+        Returns:
+            bytes: The data, or None if the image isn't cached
+        """
+        try:
+            with open(self.getFilePath(image_url, variant), 'rb') as file:
+                data = file.read()
+        except OSError:
+            return None
+        with self._lock:
+            self.connection.execute(
+                "UPDATE images SET last_used = ? WHERE key = ?",
+                (time.time(), image_key(image_url)),
+            )
+            self.connection.commit()
+        return data
+
+    def getVariants(self, image_url):
+        """
+        Returns the pre-scaled variants of a cached image
+
+        Returns:
+            dict<str, bytes>: The variant name mapped to its PNG data, or None
+                if any variant is missing
+        """
+        variants = {}
+        for variant in VARIANT_SIZES:
+            data = self.get(image_url, variant)
+            if data is None:
+                return None
+            variants[variant] = data
+        return variants
+
+    def put(self, image_url, data):
+        """
+        Stores the downloaded image along with its pre-scaled variants
+
+        Returns:
+            dict<str, bytes>: The variant name mapped to its PNG data, or None
+                if the data isn't an image
+        """
+        variants = {}
+        for (variant, size) in VARIANT_SIZES.items():
+            scaled = scale_image_data(data, size)
+            if scaled is None:
+                return None
+            variants[variant] = scaled
+
+        total = 0
+        for (variant, variant_data) in [(ORIGINAL, data)] + list(variants.items()):
+            file_path = self.getFilePath(image_url, variant)
+            temp_path = "{}.{}.tmp".format(file_path, threading.get_ident())
+            with open(temp_path, 'wb') as file:
+                file.write(variant_data)
+            os.replace(temp_path, file_path)
+            total += len(variant_data)
+
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO images (key, url, bytes, last_used) VALUES (?, ?, ?, ?)",
+                (image_key(image_url), image_url, total, time.time()),
+            )
+            self.connection.commit()
+        self.evict()
+        return variants
+
+    def evict(self):
+        """
+        Removes the least recently used images until the cache fits in max_bytes
+
+        Returns:
+            int: The number of images removed
+        """
+        with self._lock:
+            (used,) = self.connection.execute("SELECT COALESCE(SUM(bytes), 0) FROM images").fetchone()
+            if used <= self.max_bytes:
+                return 0
+            removed = []
+            for (key, url, size) in self.connection.execute(
+                    "SELECT key, url, bytes FROM images ORDER BY last_used ASC"):
+                if used <= self.max_bytes:
+                    break
+                removed.append((key, url))
+                used -= size
+            for (key, url) in removed:
+                for variant in [ORIGINAL] + list(VARIANT_SIZES):
+                    try:
+                        os.remove(self.getFilePath(url, variant))
+                    except OSError:
+                        pass
+            self.connection.executemany("DELETE FROM images WHERE key = ?", [(key,) for (key, url) in removed])
+            self.connection.commit()
+        return len(removed)
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
@@ -0,0 +1,513 @@
+"""Local SQLite working copy of the inventory sheet.
+
+Reads and writes go to the mirror.  ``pull`` merges the edits made on the
+sheet since the last sync and ``push`` sends only the cells changed locally.
+
+    python tcgplayer_inventory_mirror.py sync
+"""
+import argparse
+import json
+import logging
+import re
+import sqlite3
+import time
+
+import gspread
+from gspread.urls import DRIVE_FILES_API_V3_URL
+
+from tcgplayer_run_metrics import DEFAULT_LOG_LEVEL, LOG_LEVELS, configure_logging
+from tcgplayer_sheet_schema import column_number, record_row
+from tcgplayer_sheet_writer import SheetWriteBuffer
+
+
+DEFAULT_MIRROR_PATH = "tcgplayer_inventory.sqlite3"
+
+# Who wins when a cell was changed both locally and on the sheet
+PREFER_SHEET = "sheet"
+PREFER_LOCAL = "local"
+CONFLICT_POLICIES = [PREFER_SHEET, PREFER_LOCAL]
+
+# Columns that tell which product a row holds, the first one set on both
+# sides decides
+DEFAULT_KEY_HEADERS = ("TCG Product ID", "Product Name")
+
+RANGE_REGEX = re.compile(r"^([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rows (
+    row INTEGER PRIMARY KEY,
+    base TEXT NOT NULL,
+    local TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sync (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS conflicts (
+    row INTEGER NOT NULL,
+    header TEXT NOT NULL,
+    base TEXT,
+    local TEXT,
+    remote TEXT,
+    kept TEXT NOT NULL,
+    detected_at REAL NOT NULL
+);
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class MovedRowsError(ValueError):
+    """Raised when rows with unpushed local changes hold a different product on the sheet.
+
+    The merge goes by row number, so a row inserted or deleted above them
+    would move their local changes onto another product.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        super().__init__(
+            "Rows {} changed locally now hold other products on the sheet, rows were inserted or deleted. "
+            "Pull with discard_local to drop the local changes".format(", ".join(str(row) for row in rows)))
+
+
+class SyncConflict(object):
+    """A cell changed both in the mirror and on the sheet since the last sync."""
+
+    __slots__ = ("row", "header", "base", "local", "remote", "kept")
+
+    def __init__(self, row, header, base, local, remote, kept):
+        self.row = row
+        self.header = header
+        self.base = base
+        self.local = local
+        self.remote = remote
+        self.kept = kept
+
+    def __repr__(self):
+        return "SyncConflict(row {}, {!r}: local {!r}, sheet {!r}, kept {})".format(
+            self.row, self.header, self.local, self.remote, self.kept)
+
+
+class InventoryMirror(object):
+    """SQLite copy of the worksheet that stands in for it.
+
+    ``get_all_records`` and ``batch_update`` work like the gspread worksheet
+    methods but read and write the local copy, so the tracker can be pointed
+    at the mirror without changing how it reads and writes rows.
+
+    Every row keeps two versions: ``base`` is what the sheet held at the last
+    sync and ``local`` is the working copy.  Syncing is a three way merge
+    against ``base``:
+
+    - ``pull`` first asks Drive when the spreadsheet was last modified.  If
+      it hasn't changed since the last sync nothing is read.  Otherwise the
+      rows are read once and every cell edited on the sheet is taken, unless
+      it was also changed locally.  Those cells are conflicts, resolved by
+      ``conflicts`` and logged to the ``conflicts`` table.
+    - ``push`` sends only the cells where ``local`` differs from ``base``, in
+      one batch update with neighbouring cells coalesced into ranges.
+
+    The Sheets API has no change feed, so a sheet that was edited is read in
+    full, but an untouched sheet costs one metadata request and a push costs
+    as many cells as were changed.
+
+    Rows are matched by row number.  A pull that finds a row with local
+    changes holding another product on the sheet, by ``key_headers``, raises
+    MovedRowsError before merging anything, so the changes can't land on the
+    wrong product.
+    """
+
+    def __init__(self, sheet, path=DEFAULT_MIRROR_PATH, conflicts=PREFER_SHEET, label_row=1,
+                 key_headers=DEFAULT_KEY_HEADERS):
+        if conflicts not in CONFLICT_POLICIES:
+            raise ValueError("Unknown conflict policy {!r}, expected one of {}".format(
+                conflicts, ", ".join(CONFLICT_POLICIES)))
+        self.sheet = sheet
+        self.path = path
+        self.conflicts = conflicts
+        self.label_row = label_row
+        self.key_headers = key_headers
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    @property
+    def spreadsheet(self):
+        return self.sheet.spreadsheet
+
+    def getSetting(self, name):
+        row = self.connection.execute("SELECT value FROM sync WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def setSetting(self, name, value):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO sync (name, value) VALUES (?, ?)", (name, json.dumps(value)))
+
+    @property
+    def headers(self):
+        """(list<str>): The header row as it was at the last pull"""
+        return self.getSetting("headers") or []
+
+    def isEmpty(self):
+        (count,) = self.connection.execute("SELECT COUNT(*) FROM rows").fetchone()
+        return count == 0
+
+    def _rows(self):
+        """(dict<int, tuple<dict, dict>>): Returns the base and local version of every row"""
+        return {
+            row: (json.loads(base), json.loads(local))
+            for (row, base, local) in self.connection.execute("SELECT row, base, local FROM rows")
+        }
+
+    # Worksheet interface
+
+    def get_all_records(self, head=None):
+        """
+        Returns the working copy of every row, like ``Worksheet.get_all_records``
+
+        Args:
+            head(int): The header row, the mirror only holds the rows under
+                its label row
+
+        Returns:
+            list<dict>: The header mapped to the value of every row
+
+        Raises:
+            ValueError: When ``head`` isn't the mirror's label row
+        """
+        if head is not None and head != self.label_row:
+            raise ValueError("The mirror {} was pulled with row {} as the header, not {}".format(
+                self.path, self.label_row, head))
+        headers = self.headers
+        records = []
+        for (local,) in self.connection.execute("SELECT local FROM rows ORDER BY row"):
+            values = json.loads(local)
+            records.append({header: values.get(header, "") for header in headers})
+        return records
+
+    def row_values(self, row):
+        """
+        Returns the values of a row of the working copy, like ``Worksheet.row_values``
+
+        Returns:
+            list: The header row for the label row, otherwise the row's values
+                in header order
+        """
+        headers = self.headers
+        if row == self.label_row:
+            return list(headers)
+        stored = self.connection.execute("SELECT local FROM rows WHERE row = ?", (row,)).fetchone()
+        if stored is None:
+            return []
+        values = json.loads(stored[0])
+        return [values.get(header, "") for header in headers]
+
+    def batch_update(self, data, value_input_option=None):
+        """Writes ranges in A1 notation to the working copy.
+
+        The cells are sent to the sheet on the next ``push``.
+
+        Raises:
+            ValueError: When the mirror has not been pulled yet, or a range
+                is outside the rows and columns it holds
+        """
+        headers = self.headers
+        if not headers:
+            raise ValueError("The mirror {} holds no sheet yet, pull it first".format(self.path))
+        rows = {}
+        for entry in data:
+            match = RANGE_REGEX.match(entry['range'])
+            if match is None:
+                raise ValueError("Unsupported range {!r}".format(entry['range']))
+            start_column = column_number(match.group(1))
+            start_row = int(match.group(2))
+            for (offset, values) in enumerate(entry['values']):
+                row = start_row + offset
+                if row not in rows:
+                    stored = self.connection.execute(
+                        "SELECT local FROM rows WHERE row = ?", (row,)).fetchone()
+                    if stored is None:
+                        raise ValueError("Row {} is not in the mirror".format(row))
+                    rows[row] = json.loads(stored[0])
+                if start_column + len(values) - 1 > len(headers):
+                    raise ValueError("Range {!r} is past the {} columns of the mirror".format(
+                        entry['range'], len(headers)))
+                for (index, value) in enumerate(values):
+                    rows[row][headers[start_column + index - 1]] = value
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE rows SET local = ? WHERE row = ?",
+                [(json.dumps(values), row) for (row, values) in rows.items()],
+            )
+        return {'updatedRows': len(rows)}
+
+    # Syncing
+
+    def remoteModifiedTime(self):
+        """(str): Returns when Drive last saw the spreadsheet change, or None if unknown"""
+        try:
+            spreadsheet = self.sheet.spreadsheet
+            response = spreadsheet.client.request(
+                "get",
+                "{}/{}".format(DRIVE_FILES_API_V3_URL, spreadsheet.id),
+                params={"fields": "modifiedTime", "supportsAllDrives": True},
+            )
+            return response.json().get("modifiedTime")
+        except (AttributeError, gspread.exceptions.APIError) as e:
+            logger.debug("Could not read the modified time of the spreadsheet: %s", e)
+            return None
+
+    def isSameProduct(self, base, remote):
+        """(bool): Returns if two versions of a row hold the same product"""
+        for header in self.key_headers:
+            (before, after) = (base.get(header, ""), remote.get(header, ""))
+            if before != "" and after != "":
+                return str(before) == str(after)
+        return True
+
+    def dirtyRows(self):
+        """(list<int>): Returns the rows with local changes that weren't pushed yet"""
+        return [row for (row, (base, local)) in sorted(self._rows().items()) if base != local]
+
+    def pull(self, force=False, discard_local=False):
+        """
+        Merges the changes made on the sheet since the last sync
+
+        Args:
+            force(bool): Read the rows even if Drive says nothing changed
+            discard_local(bool): Replace the rows that moved on the sheet
+                with the sheet's version, dropping their local changes
+
+        Returns:
+            list<SyncConflict>: The cells changed on both sides
+
+        Raises:
+            MovedRowsError: When rows with local changes hold other products
+                on the sheet
+        """
+        modified = self.remoteModifiedTime()
+        if not force and modified is not None and not self.isEmpty() \
+                and modified == self.getSetting("modified_time"):
+            logger.info("The sheet hasn't changed since the last sync")
+            return []
+
+        logger.info("Reading the sheet")
+        records = self.sheet.get_all_records(head=self.label_row)
+        headers = list(records[0].keys()) if records else self.headers
+        stored = self._rows()
+        moved = []
+        for (index, remote) in enumerate(records):
+            row = record_row(index, self.label_row)
+            if row in stored:
+                (base, local) = stored[row]
+                if base != local and not self.isSameProduct(base, remote):
+                    moved.append(row)
+        if moved and not discard_local:
+            raise MovedRowsError(moved)
+        conflicts = []
+        changed = 0
+        updates = []
+        for (index, remote) in enumerate(records):
+            row = record_row(index, self.label_row)
+            if row not in stored:
+                updates.append((row, remote, remote))
+                changed += 1
+                continue
+            (base, local) = stored.pop(row)
+            if remote == base:
+                continue
+            changed += 1
+            if row in moved:
+                logger.warning("Row %s holds another product on the sheet, dropping its local changes", row)
+                updates.append((row, remote, remote))
+                continue
+            merged = dict(local)
+            for header in headers:
+                remote_value = remote.get(header, "")
+                base_value = base.get(header, "")
+                local_value = local.get(header, "")
+                if remote_value == base_value or remote_value == local_value:
+                    continue
+                if local_value == base_value:
+                    merged[header] = remote_value
+                    continue
+                kept = self.conflicts
+                if kept == PREFER_SHEET:
+                    merged[header] = remote_value
+                conflicts.append(SyncConflict(row, header, base_value, local_value, remote_value, kept))
+            updates.append((row, remote, merged))
+
+        detected_at = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO rows (row, base, local) VALUES (?, ?, ?)",
+                [(row, json.dumps(base), json.dumps(local)) for (row, base, local) in updates],
+            )
+            # Rows deleted from the sheet are dropped, along with anything changed in them locally
+            for (row, (base, local)) in stored.items():
+                if base != local:
+                    logger.warning("Row %s was removed from the sheet, dropping its local changes", row)
+            self.connection.executemany("DELETE FROM rows WHERE row = ?", [(row,) for row in stored])
+            self.connection.executemany(
+                "INSERT INTO conflicts (row, header, base, local, remote, kept, detected_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (conflict.row, conflict.header, json.dumps(conflict.base), json.dumps(conflict.local),
+                     json.dumps(conflict.remote), conflict.kept, detected_at)
+                    for conflict in conflicts
+                ],
+            )
+            self.setSetting("headers", headers)
+            self.setSetting("modified_time", modified)
+
+        for conflict in conflicts:
+            logger.warning("Conflict in row %s, %s: local %r, sheet %r, kept the %s value",
+                           conflict.row, conflict.header, conflict.local, conflict.remote, conflict.kept)
+        logger.info("Pulled %s changed rows, %s removed, %s conflicts", changed, len(stored), len(conflicts))
+        return conflicts
+
+    def push(self, value_input_option='USER_ENTERED'):
+        """
+        Sends the cells changed locally to the sheet in one batch update
+
+        Returns:
+            int: The number of cells sent
+        """
+        headers = self.headers
+        writer = SheetWriteBuffer(
+            self.sheet,
+            flush_rows=float('inf'),
+            flush_seconds=float('inf'),
+            value_input_option=value_input_option,
+        )
+        cells = 0
+        pushed = []
+        for (row, (base, local)) in sorted(self._rows().items()):
+            if base == local:
+                continue
+            for (column, header) in enumerate(headers, 1):
+                if local.get(header, "") != base.get(header, ""):
+                    writer.stageCell(row, column, local.get(header, ""))
+                    cells += 1
+            pushed.append(row)
+        if not cells:
+            logger.info("Nothing to push")
+            return 0
+
+        writer.flush()
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE rows SET base = local WHERE row = ?", [(row,) for row in pushed])
+            # Our own write changed the modified time, only later edits need a pull
+            modified = self.remoteModifiedTime()
+            if modified is not None:
+                self.setSetting("modified_time", modified)
+        logger.info("Pushed %s cells in %s rows", cells, len(pushed))
+        return cells
+
+    def sync(self, force=False, discard_local=False):
+        """
+        Pulls the sheet's changes then pushes the local ones
+
+        Returns:
+            tuple<list<SyncConflict>, int>: The conflicts and the number of cells pushed
+        """
+        conflicts = self.pull(force=force, discard_local=discard_local)
+        return (conflicts, self.push())
+
+    def recentConflicts(self, limit=20):
+        """
+        Returns the last conflicts found
+
+        Returns:
+            list<SyncConflict>: The conflicts, newest first
+        """
+        rows = self.connection.execute(
+            "SELECT row, header, base, local, remote, kept FROM conflicts ORDER BY detected_at DESC, rowid DESC LIMIT ?",
+            (limit,),
+        )
+        return [
+            SyncConflict(row, header, json.loads(base), json.loads(local), json.loads(remote), kept)
+            for (row, header, base, local, remote, kept) in rows
+        ]
+
+    def close(self):
+        self.connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sync the local inventory mirror with the sheet')
+
+    parser.add_argument(
+        'command',
+        choices=['sync', 'pull', 'push', 'status', 'conflicts'],
+        help='sync pulls then pushes, status lists the rows not pushed yet',
+    )
+
+    parser.add_argument(
+        '--path',
+        default=DEFAULT_MIRROR_PATH,
+        help='SQLite file holding the mirror (default: {})'.format(DEFAULT_MIRROR_PATH),
+    )
+
+    parser.add_argument(
+        '--conflicts',
+        choices=CONFLICT_POLICIES,
+        default=PREFER_SHEET,
+        help='Which value to keep when a cell changed on both sides (default: {})'.format(PREFER_SHEET),
+    )
+
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Read the sheet even if Drive says it hasn\'t changed (default: False)',
+    )
+
+    parser.add_argument(
+        '--discard-local',
+        action='store_true',
+        help='Drop the local changes of rows that hold another product on the sheet after rows were '
+             'inserted or deleted (default: False)',
+    )
+
+    parser.add_argument(
+        '--log-level',
+        choices=LOG_LEVELS,
+        default=DEFAULT_LOG_LEVEL,
+        help='Only log messages at this level or above (default: {})'.format(DEFAULT_LOG_LEVEL),
+    )
+
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+
+    # Imported here so the mirror itself doesn't need the tracker's dependencies
+    from tcgplayer_tracker import TCGPlayerSheetManager
+
+    manager = TCGPlayerSheetManager.shared_instance()
+    with InventoryMirror(manager.sheet, path=args.path, conflicts=args.conflicts) as mirror:
+        if args.command == 'status':
+            rows = mirror.dirtyRows()
+            print("{} rows with changes not pushed yet{}".format(
+                len(rows), ": " + " ".join(str(row) for row in rows) if rows else ""))
+        elif args.command == 'conflicts':
+            for conflict in mirror.recentConflicts():
+                print("Row {:<6} {:<28} local {!r:<16} sheet {!r:<16} kept {}".format(
+                    conflict.row, conflict.header, conflict.local, conflict.remote, conflict.kept))
+        elif args.command == 'pull':
+            mirror.pull(force=args.force, discard_local=args.discard_local)
+        elif args.command == 'push':
+            mirror.push()
+        else:
+            mirror.sync(force=args.force, discard_local=args.discard_local)
+
+
+if __name__ == "__main__":
+    main()
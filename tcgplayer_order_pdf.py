@@ -0,0 +1,305 @@
+import argparse
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import logging
+import os
+import re
+import sys
+
+import PyPDF2
+
+
+PRODUCT_CATALOG_MARKER = 'productCatalog'
+PRODUCT_CATALOG_ID_REGEX = r"productCatalog\S*?/(\d+)"
+# Header of the quantity column of the line items
+QUANTITY_HEADER_REGEX = r"^(qty|quantity)\.?$"
+# Points a quantity can be above or below its product's link and still be on its line
+LINE_TOLERANCE = 3
+# Points a quantity can be left or right of its column header
+COLUMN_TOLERANCE = 30
+
+logger = logging.getLogger(__name__)
+
+
+def get_product_catalog_id(url):
+    """
+    Returns the product ID from a seller portal product catalog URL
+
+    Returns:
+        str: The product ID, or None if the URL doesn't have one
+    """
+    match = re.search(PRODUCT_CATALOG_ID_REGEX, url, re.IGNORECASE)
+    if not match:
+        return None
+    return match.group(1)
+
+
+def iter_page_links(page):
+    """
+    Yields the URI of every link annotation on a PDF page
+    """
+    for (uri, rect) in iter_page_link_rects(page):
+        yield uri
+
+
+def iter_page_link_rects(page):
+    """
+    Yields the URI of every link annotation on a PDF page with the area it covers
+
+    Yields:
+        tuple<str, tuple<float>>: The URI and its left, bottom, right and top
+            edges in points
+    """
+    if '/Annots' not in page:
+        return
+    annotations = page['/Annots']
+
+    for annotation in annotations:
+        annotation_obj = annotation.get_object()
+
+        # Check if it's a link annotation
+        if annotation_obj.get('/Subtype') == '/Link':
+            # Check for URI action
+            if '/A' in annotation_obj:
+                action = annotation_obj['/A']
+                if '/URI' in action:
+                    # TODO, replace this with the actual text content if possible
+                    (x1, y1, x2, y2) = [float(value) for value in annotation_obj.get('/Rect', (0, 0, 0, 0))]
+                    yield (action['/URI'], (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)))
+        if annotation_obj.get('/Subtype') == "/Text":
+            logger.debug("Note on the page: %s", annotation_obj.get("/Contents"))
+
+
+def get_page_text(page):
+    """
+    Returns every piece of text drawn on a PDF page with where it starts
+
+    Returns:
+        list<tuple<float, float, str>>: The x and y in points and the text
+    """
+    fragments = []
+
+    def visit(text, cm, tm, font_dict, font_size):
+        text = text.strip()
+        if not text:
+            return
+        # Text space to page space
+        x = tm[4] * cm[0] + tm[5] * cm[2] + cm[4]
+        y = tm[4] * cm[1] + tm[5] * cm[3] + cm[5]
+        fragments.append((x, y, text))
+
+    page.extract_text(visitor_text=visit)
+    return fragments
+
+
+def find_quantity_column(fragments):
+    """
+    Returns where the quantity column of the order's line items is
+
+    Returns:
+        float: The x of the "Qty" or "Quantity" header, or None if the page
+            has no such header
+    """
+    for (x, y, text) in fragments:
+        if re.match(QUANTITY_HEADER_REGEX, text, re.IGNORECASE):
+            return x
+    return None
+
+
+def read_line_quantity(fragments, rect, column):
+    """
+    Reads the quantity of the line item a link is on
+
+    Returns:
+        int: The number in the quantity column on the same line as the link,
+            or None if there isn't one
+    """
+    (left, bottom, right, top) = rect
+    candidates = [
+        (abs(x - column), int(text))
+        for (x, y, text) in fragments
+        if bottom - LINE_TOLERANCE <= y <= top + LINE_TOLERANCE
+        and abs(x - column) <= COLUMN_TOLERANCE
+        and text.isdigit()
+    ]
+    if not candidates:
+        return None
+    return min(candidates)[1]
+
+
+def iter_order_lines(pdf_path):
+    """
+    Stream the line items of an order PDF page by page with their quantity
+
+    The quantity is the number in the "Qty" or "Quantity" column on the same
+    line as the product's link.  A page without the header uses the column
+    of the page before it.  Links to the same product on the same line, e.g.
+    its image and its name, are one line item.
+
+    Yields:
+        tuple<int, str, int>: The page number, the product catalog URL and
+            the quantity, None when it couldn't be read
+    """
+    column = None
+    with open(pdf_path, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        for page_num in range(len(reader.pages)):
+            page = reader.pages[page_num]
+            links = [
+                (url, rect) for (url, rect) in iter_page_link_rects(page)
+                if PRODUCT_CATALOG_MARKER in url
+            ]
+            if not links:
+                continue
+            fragments = get_page_text(page)
+            header = find_quantity_column(fragments)
+            if header is not None:
+                column = header
+            lines = []
+            for (url, rect) in links:
+                if any(url == other and rect[1] <= other_rect[3] and other_rect[1] <= rect[3]
+                       for (other, other_rect) in lines):
+                    continue
+                lines.append((url, rect))
+                quantity = None
+                if column is not None:
+                    quantity = read_line_quantity(fragments, rect, column)
+                yield (page_num, url, quantity)
+
+
+def iter_order_urls(pdf_path):
+    """
+    Stream the product catalog URLs out of an order PDF page by page
+
+    Pages are only parsed when they are reached, so the first URLs are
+    available before a multi-hundred-page export has been read.  Every link
+    is yielded, including repeats.  ``iter_order_lines`` also reads the
+    quantity of each line item.
+
+    Yields:
+        tuple<int, str>: The page number and the product catalog URL
+    """
+    with open(pdf_path, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        for page_num in range(len(reader.pages)):
+            for url in iter_page_links(reader.pages[page_num]):
+                if PRODUCT_CATALOG_MARKER in url:
+                    yield (page_num, url)
+
+
+def extract_order_details(pdf_path):
+    """
+    Returns the unique product catalog URLs of an order PDF in the order they appear
+    """
+    urls = OrderedDict()
+    for (page_num, url) in iter_order_urls(pdf_path):
+        urls[url] = url
+    urls = list(urls)
+    logger.debug("Extracted %s URLs from %s: %s", len(urls), pdf_path, urls)
+    return urls
+
+
+def count_order_products(pdf_path):
+    """
+    Count how many of every product an order PDF lists
+
+    Returns:
+        tuple<Counter, Counter>: The product catalog URL mapped to the
+            quantity sold, and to the number of line items whose quantity
+            couldn't be read and isn't counted in it
+    """
+    quantities = Counter()
+    unread = Counter()
+    for (page_num, url, quantity) in iter_order_lines(pdf_path):
+        if quantity is None:
+            unread[url] += 1
+        else:
+            quantities[url] += quantity
+    return (quantities, unread)
+
+
+def find_order_pdfs(directory):
+    """
+    Returns the PDF files in a directory sorted by name
+    """
+    return [
+        os.path.join(directory, name)
+        for name in sorted(os.listdir(directory))
+        if name.lower().endswith('.pdf')
+    ]
+
+
+def count_orders_products(pdf_paths, processes=None):
+    """
+    Count the products of many order PDFs across a process pool
+
+    Args:
+        pdf_paths (list<str>): The order PDFs
+        processes (int): Number of worker processes, defaults to the CPU count
+
+    Returns:
+        list<tuple<str, str, int, int>>: The product catalog URL, its product
+            ID, the total quantity over every order and the number of line
+            items whose quantity couldn't be read, in the order first seen
+    """
+    totals = Counter()
+    unread = Counter()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        # map keeps the order of the files so the first-seen order is stable
+        for (pdf_path, (quantities, lines)) in zip(pdf_paths, executor.map(count_order_products, pdf_paths)):
+            # Keep stdout free for the CSV
+            products = len(set(quantities) | set(lines))
+            print(f"{pdf_path}: {sum(quantities.values())} items, {products} products", file=sys.stderr)
+            if lines:
+                print(f"{pdf_path}: no quantity found for {sum(lines.values())} line items", file=sys.stderr)
+            for url in list(quantities) + list(lines):
+                totals.setdefault(url, 0)
+            totals.update(quantities)
+            unread.update(lines)
+    return [(url, get_product_catalog_id(url), quantity, unread[url]) for (url, quantity) in totals.items()]
+
+
+def write_quantities_csv(rows, output):
+    writer = csv.writer(output)
+    writer.writerow(["Product Catalog URL", "Product ID", "Quantity", "Lines Without Quantity"])
+    writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Count the products in a directory of TCGPlayer order PDFs')
+
+    parser.add_argument(
+        'directory',
+        help='Directory of order PDFs to process',
+    )
+
+    parser.add_argument(
+        '--processes',
+        type=int,
+        default=None,
+        help='Number of worker processes (default: number of CPUs)',
+    )
+
+    parser.add_argument(
+        '--output',
+        default=None,
+        help='CSV file to write the quantities to (default: print to stdout)',
+    )
+
+    args = parser.parse_args()
+
+    pdf_paths = find_order_pdfs(args.directory)
+    if not pdf_paths:
+        print(f"No PDF files found in {args.directory}", file=sys.stderr)
+        return
+    rows = count_orders_products(pdf_paths, processes=args.processes)
+    if args.output:
+        with open(args.output, 'w', newline='') as output:
+            write_quantities_csv(rows, output)
+    else:
+        write_quantities_csv(rows, sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
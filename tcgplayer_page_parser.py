@@ -0,0 +1,141 @@
+import re
+
+from bs4 import BeautifulSoup
+import soupsieve
+
+
+SITE_ROOT = "https://www.tcgplayer.com"
+
+# TCGPlayer image selectors (try multiple approaches)
+IMAGE_SELECTORS = [
+    'img.product-image__image',
+    'img[data-testid="product-image"]',
+    '.product-image img',
+    '.product-details img',
+    'img[alt*="Product Image"]',
+    '.primary-image img',
+    'lazy-image__wrapper',
+]
+
+# Compiled once, every page is matched against the same selectors
+PRICE_SELECTOR = soupsieve.compile('.price-guide__points .price-points__upper__price')
+PRICE_ROW_SELECTOR = soupsieve.compile('.price-guide__points tr')
+PRICE_CELL_SELECTOR = soupsieve.compile('[class*="__price"]')
+PRODUCT_NAME_SELECTOR = soupsieve.compile('.product-details__header .product-details__name')
+SET_NAME_SELECTOR = soupsieve.compile('[data-testid="lblProductDetailsSetName"]')
+IMAGE_SELECTOR_PATTERNS = [soupsieve.compile(selector) for selector in IMAGE_SELECTORS]
+LARGE_IMAGE_REGEX = re.compile(r'(https://[^\s]+1000x1000\.jpg)\s+1000w')
+
+
+class ProductPage(object):
+    """Fields read from a rendered product page.
+
+    ``price`` is the market price shown first in the price guide.
+    ``price_points`` maps every label of the price guide, such as
+    "Market Price" or "Most Recent Sale", to its price.
+    """
+
+    __slots__ = ("price", "price_points", "product_name", "set_name", "image_url", "url")
+
+    def __init__(self, price=None, price_points=None, product_name=None, set_name=None,
+                 image_url=None, url=None):
+        self.price = price
+        self.price_points = price_points or {}
+        self.product_name = product_name
+        self.set_name = set_name
+        self.image_url = image_url
+        self.url = url
+
+    def __repr__(self):
+        return "ProductPage({!r}, {!r}, {!r})".format(self.product_name, self.set_name, self.price)
+
+    def hasPrice(self):
+        """(bool): Returns if the price guide was rendered into the page"""
+        return self.price is not None
+
+
+def parse_html(html):
+    """(BeautifulSoup): Returns the parsed page"""
+    return BeautifulSoup(html, 'html.parser')
+
+
+def _text(element):
+    if element is None:
+        return None
+    return element.get_text(strip=True) or None
+
+
+def absolute_url(url):
+    """Returns the URL with a scheme and host, as pages often use relative links"""
+    if url.startswith('//'):
+        return 'https:' + url
+    if url.startswith('/'):
+        return SITE_ROOT + url
+    return url
+
+
+def find_image_url(soup):
+    """
+    Find the product image URL on a parsed product page
+
+    Prefers the 1000px image from the ``srcset`` and falls back to ``src``
+    or ``data-src``.
+
+    Returns:
+        str: Absolute URL of the largest product image, or None if not found
+    """
+    for selector in IMAGE_SELECTOR_PATTERNS:
+        img_tag = selector.select_one(soup)
+        if not img_tag:
+            continue
+        match = LARGE_IMAGE_REGEX.search(img_tag.get('srcset') or '')
+        if match:
+            return absolute_url(match.group(1))
+        image_url = img_tag.get('src') or img_tag.get('data-src')
+        if image_url:
+            return absolute_url(image_url)
+    return None
+
+
+def find_price_points(soup):
+    """
+    Reads every row of the price guide
+
+    Returns:
+        dict<str, str>: The label, without its colon, mapped to the price text
+    """
+    points = {}
+    for row in PRICE_ROW_SELECTOR.select(soup):
+        price = _text(PRICE_CELL_SELECTOR.select_one(row))
+        cells = row.find_all(['td', 'th'])
+        if price is None or not cells:
+            continue
+        label = _text(cells[0])
+        if label:
+            points[label.rstrip(':').strip()] = price
+    return points
+
+
+def parse_product_soup(soup, url=None):
+    """(ProductPage): Reads every field the tools use out of a parsed product page"""
+    return ProductPage(
+        price=_text(PRICE_SELECTOR.select_one(soup)),
+        price_points=find_price_points(soup),
+        product_name=_text(PRODUCT_NAME_SELECTOR.select_one(soup)),
+        set_name=_text(SET_NAME_SELECTOR.select_one(soup)),
+        image_url=find_image_url(soup),
+        url=url,
+    )
+
+
+def parse_product_page(html, url=None):
+    """
+    Parses a product page once and reads every field out of it
+
+    Works on ``driver.page_source`` as well as HTML fetched over plain HTTP,
+    so a page costs one WebDriver round trip instead of one per field.
+
+    Returns:
+        ProductPage: The fields found, missing fields are None
+    """
+    return parse_product_soup(parse_html(html), url=url)
@@ -0,0 +1,264 @@
+import argparse
+from collections import Counter
+import csv
+import logging
+import os
+import sys
+
+from tcgplayer_order_pdf import count_orders_products, find_order_pdfs, get_product_catalog_id
+from tcgplayer_price_source import parse_price
+from tcgplayer_run_metrics import DEFAULT_LOG_LEVEL, LOG_LEVELS, configure_logging
+from tcgplayer_sheet_writer import SheetWriteBuffer
+
+
+PICK_LIST_HEADERS = [
+    "Game",
+    "Series",
+    "Product Name",
+    "Product ID",
+    "Pick",
+    "In Stock",
+    "Sheet Row",
+    "Product Catalog URL",
+]
+
+logger = logging.getLogger(__name__)
+
+
+class InventoryIndex(object):
+    """The rows of the inventory sheet indexed by product ID.
+
+    Built in one pass over the records already read from the sheet, so
+    matching an order is a dict lookup per product instead of a search of
+    the sheet.  The ID comes from the link when the row has none.
+    """
+
+    def __init__(self, manager, records):
+        self.manager = manager
+        # {product_id: [(row, record)]}
+        self._rows = {}
+        for (i, record) in enumerate(records):
+            product_id = record[manager.TCG_PRODUCT_ID_COLUMN] or manager.getProductIDFromLink(record)
+            if product_id:
+                self._rows.setdefault(str(product_id), []).append((manager.getRow(i), record))
+
+    def __len__(self):
+        return len(self._rows)
+
+    def getRows(self, product_id):
+        """
+        Returns the rows holding a product in sheet order
+
+        Returns:
+            list<tuple<int, SheetRow>>: The row and its record
+        """
+        return self._rows.get(str(product_id), [])
+
+    def getStock(self, record):
+        """(int): Returns how many of the row's product are in stock, 0 when the Number is blank"""
+        try:
+            return max(self.manager.getQuantity(record), 0)
+        except (TypeError, ValueError):
+            return 0
+
+
+class PickItem(object):
+    """What to take from one row of the sheet for an order.
+
+    Items with no row are the part of the order the sheet has no stock for.
+    """
+
+    __slots__ = ("product_id", "url", "quantity", "row", "record", "in_stock")
+
+    def __init__(self, product_id, url, quantity, row=None, record=None, in_stock=0):
+        self.product_id = product_id
+        self.url = url
+        self.quantity = quantity
+        self.row = row
+        self.record = record
+        self.in_stock = in_stock
+
+    def __repr__(self):
+        return "PickItem({!r}, quantity={!r}, row={!r})".format(self.product_id, self.quantity, self.row)
+
+    def sortKey(self):
+        """Items in the sheet come first by game, series and name, the missing ones last."""
+        if self.record is None:
+            return (1, "", "", "", self.product_id or "")
+        return (0, str(self.record["Game"]).lower(), str(self.record["Series"]).lower(),
+                str(self.record["Product Name"]).lower(), self.row)
+
+
+def build_pick_list(index, quantities):
+    """
+    Matches the products of an order against the inventory
+
+    The quantity of a product is taken from its rows in sheet order.
+    Whatever the rows can't cover is listed as an item without a row.
+    Products sold with a quantity of 0 are left out.
+
+    Args:
+        index(InventoryIndex): The inventory sheet
+        quantities(dict<str, int>): The product catalog URL of every product
+            sold mapped to its quantity, as counted from the order PDFs
+
+    Returns:
+        list<PickItem>: The items sorted for picking
+    """
+    # Several catalog URLs can point at the same product
+    totals = Counter()
+    urls = {}
+    for (url, quantity) in quantities.items():
+        product_id = get_product_catalog_id(url)
+        totals[product_id] += quantity
+        urls.setdefault(product_id, url)
+
+    picks = []
+    for (product_id, quantity) in totals.items():
+        if quantity <= 0:
+            continue
+        remaining = quantity
+        for (row, record) in index.getRows(product_id) if product_id else []:
+            in_stock = index.getStock(record)
+            if not in_stock:
+                continue
+            taken = min(in_stock, remaining)
+            picks.append(PickItem(product_id, urls[product_id], taken, row=row, record=record, in_stock=in_stock))
+            remaining -= taken
+            if not remaining:
+                break
+        if remaining:
+            logger.warning("%s of product %s are not in the inventory", remaining, product_id or urls[product_id])
+            picks.append(PickItem(product_id, urls[product_id], remaining))
+    picks.sort(key=PickItem.sortKey)
+    return picks
+
+
+def decrement_inventory(manager, picks, dry_run=False):
+    """
+    Takes the picked items out of the Number of their rows
+
+    The total value of each row is updated to the new Number, and every
+    change is written to the sheet in a single batch update.
+
+    Args:
+        manager(TCGPlayerSheetManager): The sheet manager
+        picks(list<PickItem>): The pick list, its records are updated in place
+        dry_run(bool): Log the changes instead of writing them
+
+    Returns:
+        int: The number of rows changed
+    """
+    writer = SheetWriteBuffer(manager.sheet, flush_rows=float('inf'), flush_seconds=float('inf'))
+    count = 0
+    for pick in picks:
+        if pick.record is None:
+            continue
+        record = pick.record
+        original = record.copy()
+        record[manager.NUMBER_COLUMN] = pick.in_stock - pick.quantity
+        price = parse_price(record[manager.UNIT_PRICE_COLUM])
+        if price is not None:
+            record[manager.TOTAL_PRICE_COLUMN] = manager.getTotalValue(price, record)
+        logger.debug("Row %s of product %s goes from %s to %s", pick.row, pick.product_id,
+                     pick.in_stock, record[manager.NUMBER_COLUMN])
+        writer.stageRecord(pick.row, record, original)
+        count += 1
+    if not dry_run:
+        writer.flush()
+    picked = sum(pick.quantity for pick in picks if pick.record is not None)
+    logger.info("Took %s picked items out of %s rows", picked, count)
+    return count
+
+
+def write_pick_list_csv(picks, output):
+    writer = csv.writer(output)
+    writer.writerow(PICK_LIST_HEADERS)
+    for pick in picks:
+        record = pick.record
+        writer.writerow([
+            record["Game"] if record is not None else "",
+            record["Series"] if record is not None else "",
+            record["Product Name"] if record is not None else "Not in inventory",
+            pick.product_id or "",
+            pick.quantity,
+            pick.in_stock if record is not None else 0,
+            pick.row or "",
+            pick.url,
+        ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a pick list of TCGPlayer orders matched against the inventory sheet')
+
+    parser.add_argument(
+        'orders',
+        nargs='+',
+        help='Order PDFs, or directories of them',
+    )
+
+    parser.add_argument(
+        '--output',
+        default=None,
+        help='CSV file to write the pick list to (default: print to stdout)',
+    )
+
+    parser.add_argument(
+        '--decrement',
+        action='store_true',
+        help='Take the picked items out of the Number column of the sheet (default: False)',
+    )
+
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Log the Number changes without writing them (default: False)',
+    )
+
+    parser.add_argument(
+        '--processes',
+        type=int,
+        default=None,
+        help='Number of worker processes reading the PDFs (default: number of CPUs)',
+    )
+
+    parser.add_argument(
+        '--log-level',
+        choices=LOG_LEVELS,
+        default=DEFAULT_LOG_LEVEL,
+        help='Only log messages at this level or above (default: {})'.format(DEFAULT_LOG_LEVEL),
+    )
+
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+
+    pdf_paths = []
+    for path in args.orders:
+        pdf_paths.extend(find_order_pdfs(path) if os.path.isdir(path) else [path])
+    if not pdf_paths:
+        logger.error("No order PDFs found in %s", ", ".join(args.orders))
+        return
+    rows = count_orders_products(pdf_paths, processes=args.processes)
+    quantities = {url: quantity for (url, product_id, quantity, unread) in rows if quantity}
+    unread = sum(unread for (url, product_id, quantity, unread) in rows)
+
+    # Imported here so the order PDFs can be read without the tracker's dependencies
+    from tcgplayer_tracker import TCGPlayerSheetManager
+
+    manager = TCGPlayerSheetManager.shared_instance()
+    records = manager.loadRecords()
+    picks = build_pick_list(InventoryIndex(manager, records), quantities)
+    if args.output:
+        with open(args.output, 'w', newline='') as output:
+            write_pick_list_csv(picks, output)
+    else:
+        write_pick_list_csv(picks, sys.stdout)
+    if args.decrement and unread:
+        # The pick list can be short of what was sold, so the Number would be left too high
+        logger.error("Not updating the sheet: the quantity of %s line items could not be read", unread)
+    elif args.decrement:
+        decrement_inventory(manager, picks, dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import sqlite3
+import time
+
+from tcgplayer_price_source import PriceQuote
+
+
+DEFAULT_CACHE_PATH = "tcgplayer_price_cache.sqlite3"
+DEFAULT_CACHE_TTL = 6 * 60 * 60
+DEFAULT_CACHE_SIZE = 50000
+
+# Run the LRU eviction after this many writes
+EVICT_EVERY = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS prices (
+    product_id TEXT NOT NULL,
+    condition TEXT NOT NULL,
+    price TEXT,
+    product_name TEXT,
+    set_name TEXT,
+    url TEXT,
+    fetched_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (product_id, condition)
+);
+CREATE INDEX IF NOT EXISTS prices_last_used ON prices (last_used);
+CREATE TABLE IF NOT EXISTS product_urls (
+    product_id TEXT NOT NULL,
+    condition TEXT NOT NULL,
+    url TEXT NOT NULL,
+    PRIMARY KEY (product_id, condition)
+);
+"""
+
+
+def filters_key(filters):
+    """Returns a stable string for the product filters, e.g. "Condition=Near Mint".
+
+    Args:
+        filters(dict): Product filters, or None
+
+    Returns:
+        str: The filters joined in key order, or an empty string
+    """
+    if not filters:
+        return ""
+    return "&".join("{}={}".format(key, filters[key]) for key in sorted(filters))
+
+
+class PriceCache(object):
+    """SQLite cache of price quotes keyed by product ID and condition filter.
+
+    Entries older than ``ttl`` seconds are treated as misses.  Once the cache
+    holds more than ``max_entries`` products, the least recently used ones
+    are evicted.
+
+    The filtered URL each product page settled on is kept separately and
+    never expires, since it doesn't change with the price.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_CACHE_TTL, max_entries=DEFAULT_CACHE_SIZE):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def get(self, product_id, filters=None):
+        """Returns the cached PriceQuote, or None if it is missing or expired."""
+        product_id = str(product_id)
+        condition = filters_key(filters)
+        row = self.connection.execute(
+            "SELECT price, product_name, set_name, url, fetched_at FROM prices "
+            "WHERE product_id = ? AND condition = ?",
+            (product_id, condition),
+        ).fetchone()
+        now = time.time()
+        if row is None or now - row[4] > self.ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.connection.execute(
+            "UPDATE prices SET last_used = ? WHERE product_id = ? AND condition = ?",
+            (now, product_id, condition),
+        )
+        self.connection.commit()
+        return PriceQuote(product_id, row[0], row[1], row[2], row[3])
+
+    def put(self, quote, filters=None):
+        """Stores the quote as freshly fetched."""
+        now = time.time()
+        self.connection.execute(
+            "INSERT OR REPLACE INTO prices "
+            "(product_id, condition, price, product_name, set_name, url, fetched_at, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (quote.product_id, filters_key(filters), quote.price, quote.product_name,
+             quote.set_name, quote.url, now, now),
+        )
+        self.connection.commit()
+        self._writes += 1
+        if self._writes % EVICT_EVERY == 0:
+            self.evict()
+
+    def getUrls(self):
+        """
+        Returns every remembered product page URL
+
+        Returns:
+            dict<tuple<str, str>, str>: The product ID and condition filter
+                mapped to the URL
+        """
+        rows = self.connection.execute("SELECT product_id, condition, url FROM product_urls")
+        return {(product_id, condition): url for (product_id, condition, url) in rows}
+
+    def putUrl(self, product_id, url, filters=None):
+        """Remembers the URL the product page loads from with its filters."""
+        self.connection.execute(
+            "INSERT OR REPLACE INTO product_urls (product_id, condition, url) VALUES (?, ?, ?)",
+            (str(product_id), filters_key(filters), url),
+        )
+        self.connection.commit()
+
+    def evict(self):
+        """Removes the least recently used entries beyond the size cap.
+
+        Returns:
+            int: The number of entries removed
+        """
+        (count,) = self.connection.execute("SELECT COUNT(*) FROM prices").fetchone()
+        excess = count - self.max_entries
+        if excess <= 0:
+            return 0
+        self.connection.execute(
+            "DELETE FROM prices WHERE rowid IN "
+            "(SELECT rowid FROM prices ORDER BY last_used ASC LIMIT ?)",
+            (excess,),
+        )
+        self.connection.commit()
+        return excess
+
+    def close(self):
+        self.evict()
+        self.connection.close()
+
+
+class QuoteMemo(object):
+    """Keeps every quote of a run in memory in front of an optional PriceCache.
+
+    A product shared by several sheets refreshed in the same run is only
+    fetched for the first one, even when the cache is turned off or the
+    quote is older than its ttl by the time a later sheet is priced.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache
+        self._quotes = {}
+
+    def get(self, product_id, filters=None):
+        """Returns the quote fetched earlier in the run, or the cached one."""
+        quote = self._quotes.get((str(product_id), filters_key(filters)))
+        if quote is None and self.cache is not None:
+            quote = self.cache.get(product_id, filters)
+        return quote
+
+    def put(self, quote, filters=None):
+        self._quotes[(str(quote.product_id), filters_key(filters))] = quote
+        if self.cache is not None:
+            self.cache.put(quote, filters)
+
+    def getUrls(self):
+        return self.cache.getUrls() if self.cache is not None else {}
+
+    def putUrl(self, product_id, url, filters=None):
+        if self.cache is not None:
+            self.cache.putUrl(product_id, url, filters)
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
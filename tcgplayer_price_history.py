@@ -0,0 +1,372 @@
+import argparse
+import datetime
+import sqlite3
+import time
+from urllib.parse import parse_qsl
+
+from tcgplayer_price_cache import filters_key
+from tcgplayer_price_source import format_price, parse_price
+
+
+DEFAULT_HISTORY_PATH = "tcgplayer_price_history.sqlite3"
+DEFAULT_MOVER_DAYS = 7
+DEFAULT_MOVER_LIMIT = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS prices (
+    product_id TEXT NOT NULL,
+    condition TEXT NOT NULL,
+    price REAL,
+    product_name TEXT,
+    set_name TEXT,
+    fetched_at REAL NOT NULL,
+    day TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS prices_product ON prices (product_id, condition, fetched_at);
+CREATE INDEX IF NOT EXISTS prices_day ON prices (day);
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    finished_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS positions (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    row INTEGER NOT NULL,
+    product_id TEXT NOT NULL,
+    condition TEXT NOT NULL,
+    game TEXT,
+    series TEXT,
+    product_name TEXT,
+    quantity INTEGER NOT NULL,
+    price REAL
+);
+CREATE INDEX IF NOT EXISTS positions_run ON positions (run_id);
+"""
+
+
+def day_of(timestamp):
+    """(str): Returns the local date of a timestamp as YYYY-MM-DD"""
+    return datetime.date.fromtimestamp(timestamp).isoformat()
+
+
+def format_time(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M")
+
+
+class PriceHistory(object):
+    """Append-only SQLite history of every price fetched and every portfolio
+    the tracker wrote.
+
+    Each fetched quote is added to ``prices``, indexed by product and date.
+    At the end of a refresh the rows of the sheet are stored as a run of
+    ``positions`` with their quantity and unit price, so the portfolio can be
+    valued at any past run.  Rows are never updated or deleted.
+
+    Quotes are held in memory and written in one transaction by ``flush``,
+    which ``recordRun``, ``close`` and the price queries call too, so a
+    refresh commits once per sheet write instead of once per product.
+    """
+
+    def __init__(self, path=DEFAULT_HISTORY_PATH):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        # Quotes recorded since the last flush
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def recordQuote(self, quote, filters=None, fetched_at=None):
+        """Appends a freshly fetched quote, written on the next ``flush``."""
+        fetched_at = fetched_at or time.time()
+        self._pending.append((str(quote.product_id), filters_key(filters), parse_price(quote.price),
+                              quote.product_name, quote.set_name, fetched_at, day_of(fetched_at)))
+
+    def flush(self):
+        """Writes the quotes recorded since the last flush in one transaction."""
+        if not self._pending:
+            return
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO prices (product_id, condition, price, product_name, set_name, fetched_at, day) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                self._pending,
+            )
+        self._pending = []
+
+    def recordRun(self, positions, finished_at=None):
+        """Stores the rows of the sheet as they stand after a refresh.
+
+        Args:
+            positions(list<tuple>): The row, product ID, condition filter,
+                game, series, product name, quantity and unit price text of
+                every row
+
+        Returns:
+            int: The ID of the run
+        """
+        finished_at = finished_at or time.time()
+        self.flush()
+        with self.connection:
+            cursor = self.connection.execute("INSERT INTO runs (finished_at) VALUES (?)", (finished_at,))
+            run_id = cursor.lastrowid
+            self.connection.executemany(
+                "INSERT INTO positions "
+                "(run_id, row, product_id, condition, game, series, product_name, quantity, price) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (run_id, row, str(product_id), condition, game, series, name, quantity, parse_price(price))
+                    for (row, product_id, condition, game, series, name, quantity, price) in positions
+                ],
+            )
+        return run_id
+
+    def latestRun(self):
+        """(int): Returns the ID of the last run, or None if nothing was recorded"""
+        (run_id,) = self.connection.execute("SELECT MAX(run_id) FROM runs").fetchone()
+        return run_id
+
+    def previousRun(self, run_id):
+        """(int): Returns the ID of the run before ``run_id``, or None if it was the first"""
+        (previous,) = self.connection.execute(
+            "SELECT MAX(run_id) FROM runs WHERE run_id < ?", (run_id,)
+        ).fetchone()
+        return previous
+
+    def runPositions(self, run_id):
+        """
+        Returns what every row held in a run
+
+        Returns:
+            list<tuple>: The row, product ID, condition filter, game, series,
+                product name, quantity and unit price of every row
+        """
+        return self.connection.execute(
+            "SELECT row, product_id, condition, game, series, product_name, quantity, price "
+            "FROM positions WHERE run_id = ? ORDER BY row",
+            (run_id,),
+        ).fetchall()
+
+    def lastFetched(self):
+        """
+        Returns when every product was last fetched
+
+        Returns:
+            dict<tuple<str, str>, float>: The product ID and condition filter
+                mapped to the time
+        """
+        self.flush()
+        rows = self.connection.execute(
+            "SELECT product_id, condition, MAX(fetched_at) FROM prices GROUP BY product_id, condition")
+        return {(product_id, condition): fetched_at for (product_id, condition, fetched_at) in rows}
+
+    def latestPrices(self):
+        """
+        Returns the last price fetched for every product
+
+        Returns:
+            dict<tuple<str, str>, tuple<float, float>>: The product ID and
+                condition filter mapped to the price and when it was fetched
+        """
+        self.flush()
+        rows = self.connection.execute(
+            "SELECT prices.product_id, prices.condition, prices.price, prices.fetched_at FROM prices "
+            "JOIN (SELECT product_id, condition, MAX(fetched_at) AS fetched_at FROM prices "
+            "GROUP BY product_id, condition) AS latest "
+            "ON prices.product_id = latest.product_id AND prices.condition = latest.condition "
+            "AND prices.fetched_at = latest.fetched_at")
+        return {(product_id, condition): (price, fetched_at) for (product_id, condition, price, fetched_at) in rows}
+
+    def volatility(self, days=DEFAULT_MOVER_DAYS, now=None):
+        """
+        Returns how much every product's price moved over the last ``days``
+
+        Returns:
+            dict<tuple<str, str>, float>: The product ID and condition filter
+                mapped to the standard deviation of its price divided by its
+                mean, for products fetched at least twice
+        """
+        since = (now or time.time()) - days * 24 * 60 * 60
+        self.flush()
+        rows = self.connection.execute(
+            "SELECT product_id, condition, COUNT(price), AVG(price), AVG(price * price) FROM prices "
+            "WHERE fetched_at >= ? AND price IS NOT NULL GROUP BY product_id, condition",
+            (since,),
+        )
+        volatility = {}
+        for (product_id, condition, count, mean, mean_square) in rows:
+            if count < 2 or not mean:
+                continue
+            variance = max(mean_square - mean * mean, 0.0)
+            volatility[(product_id, condition)] = variance ** 0.5 / mean
+        return volatility
+
+    def productHistory(self, product_id, filters=None, since=None):
+        """
+        Returns every price stored for a product
+
+        Returns:
+            list<tuple<float, float>>: The time it was fetched and the price
+        """
+        self.flush()
+        return self.connection.execute(
+            "SELECT fetched_at, price FROM prices "
+            "WHERE product_id = ? AND condition = ? AND fetched_at >= ? ORDER BY fetched_at",
+            (str(product_id), filters_key(filters), since or 0),
+        ).fetchall()
+
+    def portfolioValue(self, since=None):
+        """
+        Returns the value of the portfolio after every run
+
+        Returns:
+            list<tuple<int, float, float, int>>: The run ID, when it finished,
+                the total value and the number of items
+        """
+        return self.connection.execute(
+            "SELECT runs.run_id, runs.finished_at, "
+            "COALESCE(SUM(positions.quantity * positions.price), 0), COALESCE(SUM(positions.quantity), 0) "
+            "FROM runs LEFT JOIN positions ON positions.run_id = runs.run_id "
+            "WHERE runs.finished_at >= ? GROUP BY runs.run_id ORDER BY runs.finished_at",
+            (since or 0,),
+        ).fetchall()
+
+    def seriesTotals(self, run_id=None):
+        """
+        Returns the value of every series in a run, the last one by default
+
+        Returns:
+            list<tuple<str, str, int, float>>: The game, the series, the
+                number of items and their value, most valuable first
+        """
+        run_id = run_id or self.latestRun()
+        return self.connection.execute(
+            "SELECT game, series, SUM(quantity), COALESCE(SUM(quantity * price), 0) AS value "
+            "FROM positions WHERE run_id = ? GROUP BY game, series ORDER BY value DESC",
+            (run_id,),
+        ).fetchall()
+
+    def movers(self, days=DEFAULT_MOVER_DAYS, limit=DEFAULT_MOVER_LIMIT, now=None):
+        """
+        Returns the products whose price moved the most over the last ``days``
+
+        The first and last price fetched in the window are compared.
+
+        Returns:
+            list<tuple>: The product ID, condition, product name, first
+                price, last price, change and percent change, biggest
+                percent change first
+        """
+        since = (now or time.time()) - days * 24 * 60 * 60
+        self.flush()
+        rows = self.connection.execute(
+            "SELECT product_id, condition, product_name, price FROM prices "
+            "WHERE fetched_at >= ? AND price IS NOT NULL ORDER BY fetched_at",
+            (since,),
+        )
+        ranges = {}
+        for (product_id, condition, name, price) in rows:
+            key = (product_id, condition)
+            if key in ranges:
+                ranges[key][1] = price
+                ranges[key][2] = name or ranges[key][2]
+            else:
+                ranges[key] = [price, price, name]
+        movers = []
+        for ((product_id, condition), (first, last, name)) in ranges.items():
+            if first == last:
+                continue
+            percent = (last - first) / first * 100 if first else None
+            movers.append((product_id, condition, name, first, last, last - first, percent))
+        movers.sort(key=lambda mover: abs(mover[6]) if mover[6] is not None else float('inf'), reverse=True)
+        return movers[:limit]
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+
+def print_portfolio_value(history, args):
+    since = time.time() - args.days * 24 * 60 * 60 if args.days else None
+    print("{:<17} {:>14} {:>8}".format("Run", "Value", "Items"))
+    for (run_id, finished_at, value, items) in history.portfolioValue(since=since):
+        print("{:<17} {:>14} {:>8}".format(format_time(finished_at), format_price(value), items))
+
+
+def print_movers(history, args):
+    print("{:<10} {:<40} {:>10} {:>10} {:>10} {:>8}".format("Product", "Name", "From", "To", "Change", "%"))
+    for (product_id, condition, name, first, last, change, percent) in history.movers(days=args.days, limit=args.limit):
+        print("{:<10} {:<40} {:>10} {:>10} {:>10} {:>8}".format(
+            product_id,
+            (name or "")[:40],
+            format_price(first),
+            format_price(last),
+            "{}{}".format("-" if change < 0 else "+", format_price(abs(change))),
+            "-" if percent is None else "{:+.1f}".format(percent),
+        ))
+
+
+def print_series_totals(history, args):
+    print("{:<20} {:<40} {:>8} {:>14}".format("Game", "Series", "Items", "Value"))
+    for (game, series, items, value) in history.seriesTotals(run_id=args.run):
+        print("{:<20} {:<40} {:>8} {:>14}".format((game or "")[:20], (series or "")[:40], items, format_price(value)))
+
+
+def print_product_history(history, args):
+    filters = dict(parse_qsl(args.condition)) if args.condition else None
+    for (fetched_at, price) in history.productHistory(args.product_id, filters=filters):
+        print("{:<17} {:>10}".format(format_time(fetched_at), format_price(price)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the local TCGPlayer price history without fetching anything')
+
+    parser.add_argument(
+        '--path',
+        default=DEFAULT_HISTORY_PATH,
+        help='SQLite file the tracker records prices in (default: {})'.format(DEFAULT_HISTORY_PATH),
+    )
+
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    value = commands.add_parser('value', help='Portfolio value after every refresh')
+    value.add_argument('--days', type=float, default=None, help='Only show the last N days (default: all)')
+    value.set_defaults(handler=print_portfolio_value)
+
+    movers = commands.add_parser('movers', help='Products whose price moved the most')
+    movers.add_argument(
+        '--days',
+        type=float,
+        default=DEFAULT_MOVER_DAYS,
+        help='Window to compare prices over (default: {})'.format(DEFAULT_MOVER_DAYS),
+    )
+    movers.add_argument(
+        '--limit',
+        type=int,
+        default=DEFAULT_MOVER_LIMIT,
+        help='Number of products to show (default: {})'.format(DEFAULT_MOVER_LIMIT),
+    )
+    movers.set_defaults(handler=print_movers)
+
+    series = commands.add_parser('series', help='Value of every series')
+    series.add_argument('--run', type=int, default=None, help='Run ID to total (default: the last run)')
+    series.set_defaults(handler=print_series_totals)
+
+    product = commands.add_parser('product', help='Every price stored for one product')
+    product.add_argument('product_id', help='TCGPlayer product ID')
+    product.add_argument('--condition', default=None, help='Condition filter, e.g. "Condition=Near Mint"')
+    product.set_defaults(handler=print_product_history)
+
+    args = parser.parse_args()
+
+    with PriceHistory(args.path) as history:
+        args.handler(history, args)
+
+
+if __name__ == "__main__":
+    main()
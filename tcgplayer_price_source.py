@@ -0,0 +1,255 @@
+import logging
+from urllib.parse import urlencode
+
+import requests
+
+from tcgplayer_async_fetch import DEFAULT_CONCURRENCY, DEFAULT_RATE_LIMIT, AsyncFetcher
+from tcgplayer_page_parser import parse_product_page
+
+
+BASE_SITE = "https://www.tcgplayer.com/product/"
+DEFAULT_API_URL = "https://mp-search-api.tcgplayer.com"
+PRODUCT_DETAILS_PATH = "/v2/product/{product_id}/details"
+
+DEFAULT_HTTP_WORKERS = DEFAULT_CONCURRENCY
+DEFAULT_HTTP_TIMEOUT = 10
+
+HTTP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'application/json',
+    'Accept-Encoding': 'gzip, deflate',
+    'Connection': 'keep-alive',
+}
+HTML_ACCEPT = 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8'
+
+logger = logging.getLogger(__name__)
+
+
+def format_price(value):
+    """Formats a price the same way the product page shows it.
+
+    Args:
+        value(float): Price in dollars, or None when there are no sales
+
+    Returns:
+        str: The price as "$1,234.56" or '-' when there is no price
+    """
+    if value is None:
+        return '-'
+    return "${:,.2f}".format(float(value))
+
+
+def parse_price(text):
+    """Reads a price shown as "$1,234.56" back into dollars.
+
+    Args:
+        text(str): The price text, '-' when there are no sales
+
+    Returns:
+        float: The price, or None when there is no price
+    """
+    if text is None:
+        return None
+    text = str(text).replace("$", "").replace(",", "").strip()
+    if not text or text == '-':
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+class PriceQuote(object):
+    """Price and naming information for a single product."""
+
+    __slots__ = ("product_id", "price", "product_name", "set_name", "url")
+
+    def __init__(self, product_id, price, product_name, set_name, url):
+        self.product_id = str(product_id)
+        self.price = price
+        self.product_name = product_name
+        self.set_name = set_name
+        self.url = url
+
+    def __repr__(self):
+        return "PriceQuote({!r}, {!r}, {!r}, {!r})".format(
+            self.product_id, self.price, self.product_name, self.set_name)
+
+
+class PriceSource(object):
+    """Interface for anything that can price products.
+
+    Subclasses implement ``fetch``.  ``fetchMany`` can be overridden when a
+    backend is able to price many products at once.
+    """
+
+    name = ""
+    # Number of network requests made so far
+    request_count = 0
+    # Products this source can't price are retried with a new web driver
+    fallback_to_browser = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def fetch(self, product_id, filters=None):
+        """Returns the PriceQuote for a product.
+
+        Args:
+            product_id(str): The TCGPlayer product ID
+            filters(dict): Extra product filters such as the condition
+
+        Returns:
+            PriceQuote: The quote, or None if the product could not be priced
+        """
+        raise NotImplementedError
+
+    def fetchMany(self, product_ids, filters=None):
+        """Returns a dict of product ID to PriceQuote.
+
+        Products that could not be priced are left out of the result.
+        """
+        quotes = {}
+        for product_id in product_ids:
+            quote = self.fetch(product_id, filters=filters)
+            if quote is not None:
+                quotes[quote.product_id] = quote
+        return quotes
+
+    def close(self):
+        pass
+
+
+class HttpPriceSource(PriceSource):
+    """Prices products from the TCGPlayer JSON endpoint without a browser.
+
+    A single pooled ``requests.Session`` keeps connections alive between
+    products and accepts gzip responses.  ``fetchMany`` prices many products
+    concurrently over that pool through an ``AsyncFetcher``, which limits the
+    request rate and backs off when throttled.  ``base_url`` can point at a
+    local stand-in server.
+    """
+
+    name = "http"
+
+    def __init__(self, base_url=DEFAULT_API_URL, workers=DEFAULT_HTTP_WORKERS,
+                 timeout=DEFAULT_HTTP_TIMEOUT, session=None, rate_limit=DEFAULT_RATE_LIMIT):
+        self.base_url = base_url.rstrip('/')
+        self.workers = workers
+        self.timeout = timeout
+        self.session = session or self.createSession(workers)
+        self.fetcher = AsyncFetcher(
+            session=self.session,
+            concurrency=workers,
+            rate_limit=rate_limit,
+            timeout=timeout,
+        )
+        self._fetch_count = 0
+
+    @property
+    def request_count(self):
+        return self._fetch_count + self.fetcher.request_count
+
+    @staticmethod
+    def createSession(pool_size):
+        """Creates a keep-alive session with a connection pool sized for the workers."""
+        session = AsyncFetcher.createSession(pool_size)
+        session.headers.update(HTTP_HEADERS)
+        return session
+
+    def getDetailsUrl(self, product_id, filters=None):
+        url = self.base_url + PRODUCT_DETAILS_PATH.format(product_id=product_id)
+        if filters:
+            url = "{}?{}".format(url, urlencode(filters))
+        return url
+
+    def parseDetails(self, product_id, details):
+        """Builds a PriceQuote out of the product details JSON, or None if it has no price."""
+        price = details.get('marketPrice')
+        if price is None:
+            logger.info("Product %s has no market price", product_id)
+            return None
+        return PriceQuote(
+            product_id,
+            format_price(price),
+            details.get('productName'),
+            details.get('setName'),
+            "{site}{product_id}".format(site=BASE_SITE, product_id=product_id),
+        )
+
+    def parseResponse(self, product_id, response):
+        """Returns the PriceQuote in a response, or None if it has no price.
+
+        Raises:
+            ValueError: If the response can't be read or isn't a JSON object
+        """
+        details = response.json()
+        if not isinstance(details, dict):
+            raise ValueError("Expected a JSON object, got {}".format(type(details).__name__))
+        return self.parseDetails(product_id, details)
+
+    def fetch(self, product_id, filters=None):
+        url = self.getDetailsUrl(product_id, filters=filters)
+        try:
+            self._fetch_count += 1
+            response = self.session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+            return self.parseResponse(product_id, response)
+        except (requests.exceptions.RequestException, ValueError, TypeError) as e:
+            logger.warning("Failed to fetch product %s: %s", product_id, e)
+            return None
+
+    def fetchMany(self, product_ids, filters=None):
+        product_ids = list(dict.fromkeys(str(product_id) for product_id in product_ids))
+        urls = [self.getDetailsUrl(product_id, filters=filters) for product_id in product_ids]
+        responses = self.fetcher.fetchAllSync(urls)
+        quotes = {}
+        for (product_id, response) in zip(product_ids, responses):
+            if isinstance(response, Exception):
+                logger.warning("Failed to fetch product %s: %s", product_id, response)
+                continue
+            try:
+                quote = self.parseResponse(product_id, response)
+            except (ValueError, TypeError) as e:
+                logger.warning("Failed to read product %s: %s", product_id, e)
+                continue
+            if quote is not None:
+                quotes[product_id] = quote
+        return quotes
+
+    def close(self):
+        self.session.close()
+
+
+class HtmlPriceSource(HttpPriceSource):
+    """Prices products from product pages fetched over plain HTTP.
+
+    Only works for pages that render the price guide server side.  Pages
+    that need JavaScript come back without a price and are left out of the
+    result, so the caller falls back to the web driver for them.
+    """
+
+    name = "html"
+
+    def __init__(self, base_url=BASE_SITE, workers=DEFAULT_HTTP_WORKERS,
+                 timeout=DEFAULT_HTTP_TIMEOUT, session=None, rate_limit=DEFAULT_RATE_LIMIT):
+        super().__init__(base_url=base_url, workers=workers, timeout=timeout,
+                         session=session, rate_limit=rate_limit)
+        self.session.headers['Accept'] = HTML_ACCEPT
+
+    def getDetailsUrl(self, product_id, filters=None):
+        url = "{}/{}".format(self.base_url, product_id)
+        if filters:
+            url = "{}?{}".format(url, urlencode(filters))
+        return url
+
+    def parseResponse(self, product_id, response):
+        page = parse_product_page(response.text, url=response.url)
+        if not page.hasPrice():
+            logger.info("Product %s is not rendered server side", product_id)
+            return None
+        return PriceQuote(product_id, page.price, page.product_name, page.set_name, response.url)
@@ -0,0 +1,464 @@
+"""Finds the TCGPlayer product ID of rows that only have a name.
+
+Rows without a ``TCG Product ID`` or a link are matched by their game,
+series and product name, first against a local index of every product seen
+so far and then through TCGPlayer search.
+
+    python tcgplayer_product_resolver.py [--dry-run]
+"""
+import argparse
+import difflib
+import logging
+import re
+import sqlite3
+import time
+from urllib.parse import urlencode
+
+from tcgplayer_async_fetch import DEFAULT_CONCURRENCY, DEFAULT_RATE_LIMIT, AsyncFetcher
+from tcgplayer_price_source import DEFAULT_API_URL, HTTP_HEADERS
+from tcgplayer_run_metrics import DEFAULT_LOG_LEVEL, LOG_LEVELS, configure_logging
+from tcgplayer_sheet_writer import SheetWriteBuffer
+
+
+DEFAULT_INDEX_PATH = "tcgplayer_product_index.sqlite3"
+SEARCH_PATH = "/v1/search/request"
+DEFAULT_SEARCH_RESULTS = 24
+# Score a local match needs to skip the search
+DEFAULT_LOCAL_SCORE = 0.9
+# Score a search result needs to be used at all
+DEFAULT_MIN_SCORE = 0.6
+# Weight of the product name against the set name in a match score
+NAME_WEIGHT = 0.75
+# Seconds before a name that matched nothing is searched for again
+UNMATCHED_RETRY = 7 * 24 * 60 * 60
+
+WORD_REGEX = re.compile(r"[a-z0-9]+")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    product_id TEXT PRIMARY KEY,
+    product_name TEXT NOT NULL,
+    set_name TEXT,
+    product_line TEXT,
+    seen_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS lookups (
+    query TEXT PRIMARY KEY,
+    product_id TEXT,
+    score REAL,
+    resolved_at REAL NOT NULL
+);
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(text):
+    """(str): Returns the lowercase words of the text joined by single spaces"""
+    return " ".join(WORD_REGEX.findall(str(text or "").lower()))
+
+
+def similarity(first, second):
+    """(float): Returns how alike two normalized strings are, from 0 to 1"""
+    if not first or not second:
+        return 0.0
+    if first == second:
+        return 1.0
+    return difflib.SequenceMatcher(None, first, second).ratio()
+
+
+class ProductName(object):
+    """The game, series and product name of a row, normalized for matching."""
+
+    __slots__ = ("game", "series", "name")
+
+    def __init__(self, game, series, name):
+        self.game = normalize(game)
+        self.series = normalize(series)
+        self.name = normalize(name)
+
+    @property
+    def key(self):
+        """(str): Identifies the lookup in the index"""
+        return "{}|{}|{}".format(self.game, self.series, self.name)
+
+    @property
+    def query(self):
+        """(str): The text to search TCGPlayer for"""
+        return self.name
+
+    def score(self, product_name, set_name=None, product_line=None):
+        """
+        Scores how well a product matches the name
+
+        The product line has to share a word with the game, when both are
+        known, so a Pokemon row never resolves to a Magic card of the same
+        name.
+
+        Returns:
+            float: 0 for no match up to 1 for the same name and set
+        """
+        product_line = normalize(product_line)
+        if self.game and product_line and not set(product_line.split()) & set(self.game.split()):
+            return 0.0
+        name_score = similarity(self.name, normalize(product_name))
+        if not self.series:
+            return name_score
+        return NAME_WEIGHT * name_score + (1 - NAME_WEIGHT) * similarity(self.series, normalize(set_name))
+
+    def __repr__(self):
+        return "ProductName({!r}, {!r}, {!r})".format(self.game, self.series, self.name)
+
+
+class ProductIndex(object):
+    """SQLite index of every product seen in a search and every lookup made.
+
+    A lookup that was resolved before is answered from ``lookups`` without
+    scoring anything.  New names are fuzzy matched against the products
+    sharing a word with them, found through an inverted index of the words
+    in every product name that is kept in memory.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        # {product_id: (product_name, set_name, product_line)}
+        self._products = {}
+        # {word: set<product_id>}
+        self._words = {}
+        for (product_id, product_name, set_name, product_line) in self.connection.execute(
+                "SELECT product_id, product_name, set_name, product_line FROM products"):
+            self._add(product_id, product_name, set_name, product_line)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def __len__(self):
+        return len(self._products)
+
+    def _add(self, product_id, product_name, set_name, product_line):
+        self._products[product_id] = (product_name, set_name, product_line)
+        for word in normalize(product_name).split():
+            self._words.setdefault(word, set()).add(product_id)
+
+    def addProducts(self, products):
+        """Adds search results to the index.
+
+        Args:
+            products(list<tuple>): The product ID, product name, set name and
+                product line of every product
+        """
+        now = time.time()
+        products = [(str(product_id), name, set_name, line) for (product_id, name, set_name, line) in products]
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO products (product_id, product_name, set_name, product_line, seen_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [product + (now,) for product in products],
+            )
+        for product in products:
+            self._add(*product)
+
+    def getLookup(self, name):
+        """
+        Returns the result of an earlier lookup of the name
+
+        Returns:
+            tuple<str, float, float>: The product ID, None if nothing matched,
+                the score and when it was looked up, or None if it never was
+        """
+        return self.connection.execute(
+            "SELECT product_id, score, resolved_at FROM lookups WHERE query = ?", (name.key,)).fetchone()
+
+    def putLookups(self, lookups):
+        """Remembers resolved names.
+
+        Args:
+            lookups(list<tuple<ProductName, str, float>>): The name, the
+                product ID it resolved to and the match score
+        """
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO lookups (query, product_id, score, resolved_at) VALUES (?, ?, ?, ?)",
+                [(name.key, product_id, score, now) for (name, product_id, score) in lookups],
+            )
+
+    def bestMatch(self, name, candidates=None):
+        """
+        Finds the product closest to the name
+
+        Args:
+            name(ProductName): The name to match
+            candidates(list<str>): Only consider these product IDs, by default
+                every product sharing a word with the name
+
+        Returns:
+            tuple<str, float>: The product ID and its score, or (None, 0)
+        """
+        if candidates is None:
+            candidates = set()
+            for word in name.name.split():
+                candidates.update(self._words.get(word, ()))
+        best = (None, 0.0)
+        for product_id in candidates:
+            (product_name, set_name, product_line) = self._products[product_id]
+            score = name.score(product_name, set_name, product_line)
+            if score > best[1]:
+                best = (product_id, score)
+        return best
+
+    def close(self):
+        self.connection.close()
+
+
+class ProductResolver(object):
+    """Resolves many product names to product IDs in one pass.
+
+    Names are deduplicated, then matched against the ``ProductIndex``.  The
+    ones left are searched on TCGPlayer concurrently through an
+    ``AsyncFetcher``, every result is added to the index and the best one
+    scoring at least ``min_score`` is used.
+    """
+
+    def __init__(self, index, base_url=DEFAULT_API_URL, concurrency=DEFAULT_CONCURRENCY,
+                 rate_limit=DEFAULT_RATE_LIMIT, local_score=DEFAULT_LOCAL_SCORE,
+                 min_score=DEFAULT_MIN_SCORE, results=DEFAULT_SEARCH_RESULTS, fetcher=None):
+        self.index = index
+        self.base_url = base_url.rstrip('/')
+        self.local_score = local_score
+        self.min_score = min_score
+        self.results = results
+        self.fetcher = fetcher or AsyncFetcher(concurrency=concurrency, rate_limit=rate_limit)
+        self.fetcher.session.headers.update(HTTP_HEADERS)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def getSearchUrl(self, name):
+        return "{}{}?{}".format(self.base_url, SEARCH_PATH, urlencode({'q': name.query, 'isList': 'false'}))
+
+    def getSearchBody(self, name):
+        return {
+            'from': 0,
+            'size': self.results,
+            'filters': {'term': {}, 'range': {}, 'match': {}},
+            'settings': {'useFuzzySearch': True},
+            'sort': {},
+        }
+
+    @staticmethod
+    def parseSearch(response):
+        """
+        Reads the products out of a search response
+
+        Returns:
+            list<tuple>: The product ID, product name, set name and product
+                line of every result
+        """
+        products = []
+        for group in response.json().get('results', []):
+            for result in group.get('results', []):
+                product_id = result.get('productId')
+                if product_id is None or not result.get('productName'):
+                    continue
+                products.append((
+                    str(int(product_id)),
+                    result['productName'],
+                    result.get('setName'),
+                    result.get('productLineName'),
+                ))
+        return products
+
+    def resolve(self, names):
+        """
+        Finds the product ID of every name
+
+        Args:
+            names(list<ProductName>): The names to resolve
+
+        Returns:
+            dict<str, tuple<str, float>>: The key of every name mapped to the
+                product ID and match score, names that didn't match are left out
+        """
+        unique = {}
+        for name in names:
+            if name.name:
+                unique.setdefault(name.key, name)
+        resolved = {}
+        searches = []
+        local = []
+        skipped = 0
+        now = time.time()
+        for (key, name) in unique.items():
+            lookup = self.index.getLookup(name)
+            if lookup is not None:
+                (product_id, score, resolved_at) = lookup
+                if product_id is not None:
+                    resolved[key] = (product_id, score)
+                    continue
+                if now - resolved_at < UNMATCHED_RETRY:
+                    skipped += 1
+                    continue
+            (product_id, score) = self.index.bestMatch(name)
+            if product_id is not None and score >= self.local_score:
+                resolved[key] = (product_id, score)
+                local.append((name, product_id, score))
+                continue
+            searches.append(name)
+        logger.info("Resolved %s of %s names from the index, %s matched nothing recently, searching for %s",
+                    len(resolved), len(unique), skipped, len(searches))
+
+        lookups = list(local)
+        if searches:
+            responses = self.fetcher.fetchAllSync(
+                [self.getSearchUrl(name) for name in searches],
+                bodies=[self.getSearchBody(name) for name in searches],
+            )
+            for (name, response) in zip(searches, responses):
+                if isinstance(response, Exception):
+                    logger.warning("Failed to search for %r: %s", name.query, response)
+                    continue
+                try:
+                    products = self.parseSearch(response)
+                except ValueError as e:
+                    logger.warning("Failed to read the search for %r: %s", name.query, e)
+                    continue
+                self.index.addProducts(products)
+                (product_id, score) = self.index.bestMatch(name, [product[0] for product in products])
+                if product_id is None or score < self.min_score:
+                    logger.warning("No product matches %r closely enough", name.query)
+                    # Remembered so the same name isn't searched again on every run
+                    lookups.append((name, None, score))
+                    continue
+                resolved[name.key] = (product_id, score)
+                lookups.append((name, product_id, score))
+        self.index.putLookups(lookups)
+        return resolved
+
+    def close(self):
+        self.fetcher.close()
+
+
+def resolve_missing_ids(manager, records, resolver, dry_run=False):
+    """
+    Fills in the product ID of every row that has no ID or link
+
+    The IDs found are written back to the sheet in a single batch update.
+
+    Args:
+        manager(TCGPlayerSheetManager): The sheet manager
+        records(list<SheetRow>): The rows of the sheet, updated in place
+        resolver(ProductResolver): Resolves the names
+        dry_run(bool): Log the IDs found instead of writing them
+
+    Returns:
+        int: The number of rows resolved
+    """
+    unresolved = []
+    for (i, record) in enumerate(records):
+        if record[manager.TCG_PRODUCT_ID_COLUMN] or manager.getProductIDFromLink(record):
+            continue
+        name = ProductName(record['Game'], record['Series'], record['Product Name'])
+        if name.name:
+            unresolved.append((manager.getRow(i), record, name))
+    if not unresolved:
+        return 0
+    logger.info("Resolving %s rows without a product ID", len(unresolved))
+
+    resolved = resolver.resolve([name for (row, record, name) in unresolved])
+    writer = SheetWriteBuffer(manager.sheet, flush_rows=float('inf'), flush_seconds=float('inf'))
+    count = 0
+    for (row, record, name) in unresolved:
+        if name.key not in resolved:
+            continue
+        (product_id, score) = resolved[name.key]
+        logger.debug("Row %s %r is product %s (score %.2f)", row, name.query, product_id, score)
+        original = record.copy()
+        record[manager.TCG_PRODUCT_ID_COLUMN] = product_id
+        writer.stageRecord(row, record, original)
+        count += 1
+    if not dry_run:
+        writer.flush()
+    logger.info("Resolved %s of %s rows", count, len(unresolved))
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Find the product ID of rows that only have a name')
+
+    parser.add_argument(
+        '--index-path',
+        default=DEFAULT_INDEX_PATH,
+        help='SQLite index of the products seen in searches (default: {})'.format(DEFAULT_INDEX_PATH),
+    )
+
+    parser.add_argument(
+        '--api-url',
+        default=DEFAULT_API_URL,
+        help='Base URL of the search endpoint (default: {})'.format(DEFAULT_API_URL),
+    )
+
+    parser.add_argument(
+        '--http-concurrency',
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help='Maximum searches in flight (default: {})'.format(DEFAULT_CONCURRENCY),
+    )
+
+    parser.add_argument(
+        '--requests-per-second',
+        type=float,
+        default=DEFAULT_RATE_LIMIT,
+        help='Maximum searches per second (default: {:g})'.format(DEFAULT_RATE_LIMIT),
+    )
+
+    parser.add_argument(
+        '--min-score',
+        type=float,
+        default=DEFAULT_MIN_SCORE,
+        help='Lowest match score, from 0 to 1, a search result is used at (default: {:g})'.format(DEFAULT_MIN_SCORE),
+    )
+
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Log the product IDs found without writing them (default: False)',
+    )
+
+    parser.add_argument(
+        '--log-level',
+        choices=LOG_LEVELS,
+        default=DEFAULT_LOG_LEVEL,
+        help='Only log messages at this level or above (default: {})'.format(DEFAULT_LOG_LEVEL),
+    )
+
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+
+    # Imported here so the index can be used without the tracker's dependencies
+    from tcgplayer_tracker import TCGPlayerSheetManager
+
+    manager = TCGPlayerSheetManager.shared_instance()
+    records = manager.loadRecords()
+    with ProductIndex(args.index_path) as index, ProductResolver(
+            index,
+            base_url=args.api_url,
+            concurrency=args.http_concurrency,
+            rate_limit=args.requests_per_second,
+            min_score=args.min_score) as resolver:
+        resolve_missing_ids(manager, records, resolver, dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+
+
+DEFAULT_STATE_PATH = "tcgplayer_refresh_state.sqlite3"
+DEFAULT_CHECKPOINT_PATH = "tcgplayer_refresh_checkpoint.json"
+DEFAULT_DEAD_LETTER_PATH = "tcgplayer_dead_letter.jsonl"
+DEFAULT_STALE_AFTER = 24 * 60 * 60
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rows (
+    row INTEGER PRIMARY KEY,
+    content_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS products (
+    product_id TEXT NOT NULL,
+    condition TEXT NOT NULL,
+    last_priced REAL NOT NULL,
+    PRIMARY KEY (product_id, condition)
+);
+"""
+
+
+def record_hash(record):
+    """Returns a hash of the record's contents.
+
+    Values are compared as strings since the sheet hands back numbers for
+    cells that were written as text.
+    """
+    content = json.dumps([[key, str(value)] for (key, value) in record.items()])
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class RefreshState(object):
+    """Remembers what every row looked like after it was last written and when
+    every product was last priced, so a refresh can skip rows that are
+    unchanged and still fresh.
+    """
+
+    def __init__(self, path=DEFAULT_STATE_PATH, stale_after=DEFAULT_STALE_AFTER):
+        self.path = path
+        self.stale_after = stale_after
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def needsRefresh(self, row, record, product_key):
+        """Returns True when the row is new, was edited or its product is stale.
+
+        Args:
+            row(int): The sheet row of the record
+            record(dict): The record as read from the sheet
+            product_key(tuple<str, str>): The product ID and condition filter
+        """
+        stored = self.connection.execute(
+            "SELECT content_hash FROM rows WHERE row = ?", (row,)
+        ).fetchone()
+        if stored is None or stored[0] != record_hash(record):
+            return True
+        priced = self.connection.execute(
+            "SELECT last_priced FROM products WHERE product_id = ? AND condition = ?",
+            product_key,
+        ).fetchone()
+        return priced is None or time.time() - priced[0] > self.stale_after
+
+    def filterPending(self, pending, get_product_key):
+        """Yields only the pending rows that need a refresh."""
+        skipped = 0
+        for (row, record, original) in pending:
+            if self.needsRefresh(row, original, get_product_key(record)):
+                yield (row, record, original)
+            else:
+                skipped += 1
+        logger.info("Skipped %s rows that are unchanged and still fresh", skipped)
+
+    def markWritten(self, staged, get_product_key):
+        """Records the rows that were written to the sheet.
+
+        Args:
+            staged(dict<int, dict>): The rows mapped to their records as written
+            get_product_key(callable): Returns the product key for a record
+        """
+        now = time.time()
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO rows (row, content_hash) VALUES (?, ?)",
+            [(row, record_hash(record)) for (row, record) in staged.items()],
+        )
+        products = set(get_product_key(record) for record in staged.values())
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO products (product_id, condition, last_priced) VALUES (?, ?, ?)",
+            [(product_id, condition, now) for (product_id, condition) in products],
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+class RefreshCheckpoint(object):
+    """JSON file of the rows an interrupted run already wrote.
+
+    Each row is stored with the hash of its contents after the write, so a
+    restarted run only skips rows that still look the way we left them.
+    The file is removed once a run finishes.
+    """
+
+    def __init__(self, path=DEFAULT_CHECKPOINT_PATH):
+        self.path = path
+        self.rows = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                self.rows = json.load(file).get('rows', {})
+            logger.info("Resuming from checkpoint %s with %s rows done", path, len(self.rows))
+
+    def filterPending(self, pending):
+        """Yields only the pending rows the interrupted run had not written."""
+        for (row, record, original) in pending:
+            if self.rows.get(str(row)) == record_hash(original):
+                continue
+            yield (row, record, original)
+
+    def markWritten(self, staged):
+        """Adds the written rows and saves the checkpoint file."""
+        for (row, record) in staged.items():
+            self.rows[str(row)] = record_hash(record)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w') as file:
+            json.dump({'rows': self.rows}, file)
+        os.replace(temp_path, self.path)
+
+    def clear(self):
+        """Removes the checkpoint once the run has finished."""
+        self.rows = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class DeadLetterFile(object):
+    """JSON lines file of the rows that failed, so they can be re-run on their own.
+
+    Every entry has the row, product ID, condition, product name, the error
+    and how many attempts were made.  Rows that succeed on a later run are
+    taken out again and the file is removed once it is empty.
+    """
+
+    def __init__(self, path=DEFAULT_DEAD_LETTER_PATH):
+        self.path = path
+        # {row: entry}
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                for line in file:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry['row']] = entry
+            logger.info("Loaded %s failed rows from %s", len(self.entries), path)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.save()
+        return False
+
+    def add(self, row, product_key, name, error, attempts=1):
+        """Records a row that failed."""
+        (product_id, condition) = product_key
+        self.entries[row] = {
+            'row': row,
+            'product_id': product_id,
+            'condition': condition,
+            'name': name,
+            'error': "{}: {}".format(type(error).__name__, error).strip(),
+            'attempts': attempts,
+            'failed_at': time.time(),
+        }
+
+    def remove(self, rows):
+        """Takes rows that went through out of the file."""
+        for row in rows:
+            self.entries.pop(row, None)
+
+    def filterPending(self, pending):
+        """Yields only the pending rows that failed before."""
+        for (row, record, original) in pending:
+            if row in self.entries:
+                yield (row, record, original)
+
+    def save(self):
+        """Writes the file, or removes it when no row failed."""
+        if not self.entries:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w') as file:
+            for row in sorted(self.entries):
+                file.write(json.dumps(self.entries[row]) + "\n")
+        os.replace(temp_path, self.path)
@@ -0,0 +1,247 @@
+import contextlib
+import csv
+import json
+import logging
+import sys
+import threading
+import time
+
+
+DEFAULT_LOG_LEVEL = "INFO"
+DEFAULT_LIVE_INTERVAL = 5.0
+
+LOG_LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR"]
+LOG_FORMATS = ["text", "json"]
+TEXT_LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# Attributes every LogRecord has, anything else was passed through ``extra``
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonLogFormatter(logging.Formatter):
+    """Formats every log record as one JSON object per line.
+
+    Values passed with ``extra`` become fields of the object so they can be
+    filtered on without parsing the message.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for (name, value) in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES:
+                entry[name] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=DEFAULT_LOG_LEVEL, log_format="text", stream=None):
+    """Sends log records at ``level`` and above to stderr.
+
+    Args:
+        level(str): One of DEBUG, INFO, WARNING or ERROR
+        log_format(str): "text" for readable lines or "json" for one JSON
+            object per line
+        stream(file): Where to write, defaults to stderr
+    """
+    handler = logging.StreamHandler(stream or sys.stderr)
+    if log_format == "json":
+        handler.setFormatter(JsonLogFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_LOG_FORMAT))
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+
+def percentile(values, fraction):
+    """Returns the value at ``fraction`` of the sorted values, or None if empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class RunMetrics(object):
+    """Times each stage of a refresh and counts its round trips.
+
+    ``stage(name, key)`` times a block.  Timings with a ``key`` are also
+    kept per product so the report shows where a slow product spent its
+    time.  ``count(name)`` tracks things like page loads, Sheets API calls
+    and driver restarts.  Stages can be timed from several threads at once.
+
+    When ``live`` is set a one line summary is written to ``stream`` at
+    most every ``live_interval`` seconds as rows complete.
+    """
+
+    def __init__(self, live=False, live_interval=DEFAULT_LIVE_INTERVAL, stream=None):
+        self.live = live
+        self.live_interval = live_interval
+        self.stream = stream or sys.stderr
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        # {stage: [seconds]}
+        self._stages = {}
+        # {name: int}
+        self._counters = {}
+        # {key: {stage: seconds}}
+        self._keys = {}
+        # {key: [row]}
+        self._rows = {}
+        self._last_live = self._start
+
+    @contextlib.contextmanager
+    def stage(self, name, key=None):
+        """Times the block as ``name``, attributed to ``key`` when given."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.addTime(name, time.perf_counter() - start, key=key)
+
+    def addTime(self, name, seconds, key=None):
+        with self._lock:
+            self._stages.setdefault(name, []).append(seconds)
+            if key is not None:
+                timings = self._keys.setdefault(key, {})
+                timings[name] = timings.get(name, 0.0) + seconds
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def getCount(self, name):
+        """(int): Returns the current value of a counter"""
+        return self._counters.get(name, 0)
+
+    def addRows(self, key, rows):
+        """Records which sheet rows a keyed product was written to."""
+        with self._lock:
+            self._rows.setdefault(key, []).extend(rows)
+
+    def rowDone(self, amount=1):
+        """Counts finished rows and writes the live summary when it is due."""
+        self.count("rows", amount)
+        if not self.live:
+            return
+        now = time.perf_counter()
+        if now - self._last_live < self.live_interval:
+            return
+        self._last_live = now
+        self.stream.write("\r" + self.summaryLine())
+        self.stream.flush()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    def summaryLine(self):
+        """(str): Returns a one line summary of the run so far"""
+        elapsed = self.elapsed
+        rows = self.getCount("rows")
+        with self._lock:
+            slowest = sorted(
+                ((sum(times), name) for (name, times) in self._stages.items()),
+                reverse=True,
+            )[:3]
+        parts = [
+            "{} rows in {:.1f}s".format(rows, elapsed),
+            "{:.1f} rows/s".format(rows / elapsed if elapsed else 0.0),
+        ]
+        parts.extend("{} {:.1f}s".format(name, total) for (total, name) in slowest)
+        return " | ".join(parts)
+
+    def summary(self):
+        """
+        Returns the totals for the run
+
+        Returns:
+            dict: The elapsed seconds, the counters and for every stage how
+                often it ran, its total, mean, p50, p95 and max seconds
+        """
+        with self._lock:
+            stages = {}
+            for (name, times) in self._stages.items():
+                total = sum(times)
+                stages[name] = {
+                    'count': len(times),
+                    'total': round(total, 4),
+                    'mean': round(total / len(times), 4),
+                    'p50': round(percentile(times, 0.5), 4),
+                    'p95': round(percentile(times, 0.95), 4),
+                    'max': round(max(times), 4),
+                }
+            counters = dict(self._counters)
+        return {
+            'started': self.started,
+            'elapsed': round(self.elapsed, 3),
+            'counters': counters,
+            'stages': stages,
+        }
+
+    def products(self):
+        """
+        Returns the timings kept per product
+
+        Returns:
+            list<dict>: The product key, the rows it was written to and the
+                seconds spent in every stage
+        """
+        with self._lock:
+            keys = list(self._keys)
+            keys.extend(key for key in self._rows if key not in self._keys)
+            return [
+                {
+                    'key': key,
+                    'rows': list(self._rows.get(key, [])),
+                    'stages': dict(self._keys.get(key, {})),
+                }
+                for key in keys
+            ]
+
+    def writeReport(self, path):
+        """Writes the run report.
+
+        A ``.csv`` path gets one line per product with a column per stage.
+        Anything else gets the summary and the products as JSON.
+        """
+        products = self.products()
+        if path.lower().endswith(".csv"):
+            stages = sorted(set(name for product in products for name in product['stages']))
+            with open(path, 'w', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(["Product ID", "Condition", "Rows"] + stages)
+                for product in products:
+                    (product_id, condition) = self._splitKey(product['key'])
+                    writer.writerow(
+                        [product_id, condition, " ".join(str(row) for row in product['rows'])]
+                        + [round(product['stages'].get(name, 0.0), 4) for name in stages]
+                    )
+            return
+        report = self.summary()
+        report['products'] = [
+            {
+                'product_id': self._splitKey(product['key'])[0],
+                'condition': self._splitKey(product['key'])[1],
+                'rows': product['rows'],
+                'stages': {name: round(seconds, 4) for (name, seconds) in product['stages'].items()},
+            }
+            for product in products
+        ]
+        with open(path, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    @staticmethod
+    def _splitKey(key):
+        if isinstance(key, tuple):
+            return key
+        return (key, "")
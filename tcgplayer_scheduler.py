@@ -0,0 +1,448 @@
+"""Long running refresh service.
+
+Keeps the Google auth, the sheet handle and a browser warm between
+refreshes and reprices products as they come due, most valuable and most
+volatile first, without going over a request budget per hour.
+
+    python tcgplayer_scheduler.py --budget-per-hour 600
+"""
+import argparse
+import collections
+import heapq
+import logging
+import threading
+import time
+
+from selenium.common.exceptions import WebDriverException
+
+from tcgplayer_async_fetch import DEFAULT_CONCURRENCY, DEFAULT_RATE_LIMIT
+from tcgplayer_browser import BrowserSession
+from tcgplayer_price_history import DEFAULT_HISTORY_PATH, PriceHistory
+from tcgplayer_price_source import DEFAULT_API_URL, HtmlPriceSource, HttpPriceSource, PriceSource, parse_price
+from tcgplayer_run_metrics import DEFAULT_LOG_LEVEL, LOG_FORMATS, LOG_LEVELS, RunMetrics, configure_logging
+
+
+HIGH = "high"
+MEDIUM = "medium"
+LOW = "low"
+
+# Seconds between refreshes of a product at each priority
+DEFAULT_INTERVALS = {
+    HIGH: 60 * 60,
+    MEDIUM: 6 * 60 * 60,
+    LOW: 24 * 60 * 60,
+}
+# Rows worth at least this much in total are high priority
+DEFAULT_HIGH_VALUE = 50.0
+DEFAULT_MEDIUM_VALUE = 5.0
+# Products whose price moves more than this (standard deviation over mean) are high priority
+DEFAULT_VOLATILITY = 0.10
+
+DEFAULT_BUDGET_PER_HOUR = 600
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_CYCLE_SECONDS = 60.0
+DEFAULT_SHEET_REFRESH = 15 * 60
+DEFAULT_SNAPSHOT_SECONDS = 60 * 60
+
+logger = logging.getLogger(__name__)
+
+
+class HourlyBudget(object):
+    """Sliding one hour window of the requests made."""
+
+    WINDOW = 60 * 60
+
+    def __init__(self, per_hour=DEFAULT_BUDGET_PER_HOUR, clock=time.time):
+        self.per_hour = per_hour
+        self.clock = clock
+        self._spent = collections.deque()
+
+    def _expire(self, now):
+        while self._spent and now - self._spent[0] >= self.WINDOW:
+            self._spent.popleft()
+
+    def available(self):
+        """(int): Returns how many requests can still be made this hour"""
+        self._expire(self.clock())
+        return max(self.per_hour - len(self._spent), 0)
+
+    def spend(self, amount=1):
+        now = self.clock()
+        self._spent.extend([now] * amount)
+
+    def secondsUntilAvailable(self):
+        """(float): Returns how long until at least one request is available"""
+        now = self.clock()
+        self._expire(now)
+        if len(self._spent) < self.per_hour:
+            return 0.0
+        return self._spent[len(self._spent) - self.per_hour] + self.WINDOW - now
+
+
+class BrowserPriceSource(PriceSource):
+    """Prices products one at a time in a browser that stays open between refreshes.
+
+    ``scrape(driver, product_id, filters)`` loads the page and returns the
+    PriceQuote.  The session recycles the driver after its page budget and
+    restarts it after a WebDriver error.
+    """
+
+    name = "selenium"
+    fallback_to_browser = False
+
+    def __init__(self, scrape, session=None):
+        self.scrape = scrape
+        self.session = session or BrowserSession()
+        self.request_count = 0
+
+    def fetch(self, product_id, filters=None):
+        self.request_count += 1
+        try:
+            return self.scrape(self.session.nextDriver(), product_id, filters=filters)
+        except WebDriverException as e:
+            logger.warning("Failed to price product %s: %s", product_id, e)
+            self.session.restart()
+            return None
+
+    def close(self):
+        self.session.quit()
+
+
+class RefreshScheduler(object):
+    """Reprices products from a priority queue ordered by when they are due.
+
+    Every product gets a priority from the value of its rows and from how
+    much its price moved in the price history.  Each priority has its own
+    refresh interval.  Every ``cycle_seconds`` the products that are due are
+    priced in one ``updatePricing`` call, up to ``batch_size`` and whatever
+    is left of the hourly budget, most valuable first.
+
+    The rows are read from the sheet again every ``sheet_refresh`` seconds
+    to pick up edits, and what every row holds is stored in the history
+    every ``snapshot_seconds``.
+
+    Products a price source falls back to the browser for are scraped in
+    ``session``, which stays warm between cycles until ``stop``.  Those
+    page loads count against the hourly budget too.
+    """
+
+    def __init__(self, manager, price_source, history=None, budget_per_hour=DEFAULT_BUDGET_PER_HOUR,
+                 batch_size=DEFAULT_BATCH_SIZE, cycle_seconds=DEFAULT_CYCLE_SECONDS,
+                 sheet_refresh=DEFAULT_SHEET_REFRESH, snapshot_seconds=DEFAULT_SNAPSHOT_SECONDS,
+                 intervals=None, high_value=DEFAULT_HIGH_VALUE, medium_value=DEFAULT_MEDIUM_VALUE,
+                 volatility=DEFAULT_VOLATILITY, clock=time.time, session=None):
+        self.manager = manager
+        self.price_source = price_source
+        self.session = session or BrowserSession(manager.createWebDriver)
+        self.history = history
+        self.budget = HourlyBudget(budget_per_hour, clock=clock)
+        self.batch_size = batch_size
+        self.cycle_seconds = cycle_seconds
+        self.sheet_refresh = sheet_refresh
+        self.snapshot_seconds = snapshot_seconds
+        self.intervals = dict(DEFAULT_INTERVALS, **(intervals or {}))
+        self.high_value = high_value
+        self.medium_value = medium_value
+        self.volatility = volatility
+        self.clock = clock
+        self.records = None
+        # heap of (due at, -value, product key)
+        self._queue = []
+        # {product key: (priority, value)}
+        self.products = {}
+        self._loaded_at = None
+        self._snapshot_at = clock()
+        self._stop = threading.Event()
+
+    def getPriority(self, value, volatility=None):
+        """(str): Returns HIGH, MEDIUM or LOW for a product"""
+        if value >= self.high_value or (volatility is not None and volatility >= self.volatility):
+            return HIGH
+        if value >= self.medium_value:
+            return MEDIUM
+        return LOW
+
+    def loadRecords(self):
+        """Reads the rows from the sheet and rebuilds the queue."""
+        if self.manager.mirror is not None:
+            self.manager.mirror.pull()
+        logger.info("Getting all records")
+        self.records = self.manager.loadRecords()
+        self._loaded_at = self.clock()
+        self.buildQueue()
+
+    def buildQueue(self):
+        """Works out the priority of every product and when it is next due.
+
+        Products never fetched before are due straight away.
+        """
+        values = {}
+        for (row, record, original) in self.manager.iterPendingRecords(self.records):
+            key = self.manager.getProductKey(record)
+            price = parse_price(record[self.manager.UNIT_PRICE_COLUM]) or 0.0
+            try:
+                quantity = self.manager.getQuantity(record)
+            except (TypeError, ValueError):
+                quantity = 0
+            values[key] = values.get(key, 0.0) + price * quantity
+
+        last_fetched = {}
+        volatility = {}
+        if self.history is not None:
+            last_fetched = self.history.lastFetched()
+            volatility = self.history.volatility()
+
+        self.products = {}
+        self._queue = []
+        for (key, value) in values.items():
+            priority = self.getPriority(value, volatility.get(key))
+            self.products[key] = (priority, value)
+            due = last_fetched.get(key, 0.0) + self.intervals[priority]
+            self._queue.append((due, -value, key))
+        heapq.heapify(self._queue)
+        logger.info(
+            "Scheduled %s products: %s",
+            len(self.products),
+            ", ".join("{} {}".format(
+                sum(1 for (priority, value) in self.products.values() if priority == name), name)
+                for name in (HIGH, MEDIUM, LOW)),
+        )
+
+    def popDue(self):
+        """
+        Takes the products that are due, within the batch size and budget
+
+        Returns:
+            list<tuple<str, str>>: The product keys, most overdue first
+        """
+        now = self.clock()
+        limit = min(self.batch_size, self.budget.available())
+        due = []
+        while self._queue and len(due) < limit and self._queue[0][0] <= now:
+            (due_at, value, key) = heapq.heappop(self._queue)
+            due.append(key)
+        return due
+
+    def runOnce(self):
+        """
+        Reprices the products that are due
+
+        Returns:
+            int: The number of products priced
+        """
+        now = self.clock()
+        if self.records is None or now - self._loaded_at >= self.sheet_refresh:
+            self.loadRecords()
+
+        keys = self.popDue()
+        if keys:
+            sent = self.price_source.request_count
+            metrics = self.manager.updatePricing(
+                records=self.records,
+                keys=set(keys),
+                price_source=self.price_source,
+                history=self.history,
+                snapshot=False,
+                metrics=RunMetrics(),
+                session=self.session,
+            )
+            requests = self.price_source.request_count - sent
+            if self.price_source.fallback_to_browser:
+                requests += metrics.getCount("page_loads")
+            self.budget.spend(max(len(keys), requests))
+            if self.manager.mirror is not None:
+                self.manager.mirror.push()
+            finished = self.clock()
+            for key in keys:
+                (priority, value) = self.products[key]
+                heapq.heappush(self._queue, (finished + self.intervals[priority], -value, key))
+            logger.info("Repriced %s products, %s left in this hour's budget: %s",
+                        len(keys), self.budget.available(), metrics.summaryLine())
+
+        if self.history is not None and self.clock() - self._snapshot_at >= self.snapshot_seconds:
+            self.history.recordRun(self.manager.getPositions(self.records))
+            self._snapshot_at = self.clock()
+        return len(keys)
+
+    def secondsUntilNext(self):
+        """(float): Returns how long to sleep before the next cycle"""
+        wait = self.cycle_seconds
+        if self._queue:
+            wait = max(wait, self._queue[0][0] - self.clock())
+        wait = max(wait, self.budget.secondsUntilAvailable())
+        # Wake up for the next sheet refresh even if nothing is due
+        if self._loaded_at is not None:
+            wait = min(wait, max(self._loaded_at + self.sheet_refresh - self.clock(), self.cycle_seconds))
+        return wait
+
+    def run(self):
+        """Runs cycles until ``stop`` is called."""
+        while not self._stop.is_set():
+            self.runOnce()
+            self._stop.wait(self.secondsUntilNext())
+
+    def stop(self):
+        self._stop.set()
+        self.session.quit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Keep the sheet priced in the background')
+
+    parser.add_argument(
+        '--price-source',
+        choices=['selenium', 'http', 'html'],
+        default='selenium',
+        help='Where to read prices from (default: selenium)',
+    )
+
+    parser.add_argument(
+        '--api-url',
+        default=DEFAULT_API_URL,
+        help='Base URL of the JSON endpoint used by the http price source (default: {})'.format(DEFAULT_API_URL),
+    )
+
+    parser.add_argument(
+        '--http-concurrency',
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help='Maximum requests in flight for the http and html price sources (default: {})'.format(DEFAULT_CONCURRENCY),
+    )
+
+    parser.add_argument(
+        '--requests-per-second',
+        type=float,
+        default=DEFAULT_RATE_LIMIT,
+        help='Maximum requests per second for the http and html price sources (default: {:g})'.format(DEFAULT_RATE_LIMIT),
+    )
+
+    parser.add_argument(
+        '--budget-per-hour',
+        type=int,
+        default=DEFAULT_BUDGET_PER_HOUR,
+        help='Maximum product requests in any hour (default: {})'.format(DEFAULT_BUDGET_PER_HOUR),
+    )
+
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help='Maximum products priced in one cycle (default: {})'.format(DEFAULT_BATCH_SIZE),
+    )
+
+    parser.add_argument(
+        '--cycle-seconds',
+        type=float,
+        default=DEFAULT_CYCLE_SECONDS,
+        help='Minimum seconds between cycles (default: {:g})'.format(DEFAULT_CYCLE_SECONDS),
+    )
+
+    parser.add_argument(
+        '--sheet-refresh-minutes',
+        type=float,
+        default=DEFAULT_SHEET_REFRESH / 60,
+        help='Minutes between reading the rows from the sheet again (default: {:g})'.format(DEFAULT_SHEET_REFRESH / 60),
+    )
+
+    for (priority, description) in [(HIGH, 'valuable or volatile'), (MEDIUM, 'mid value'), (LOW, 'bulk')]:
+        parser.add_argument(
+            '--{}-hours'.format(priority),
+            type=float,
+            default=DEFAULT_INTERVALS[priority] / 3600,
+            help='Hours between refreshes of {} products (default: {:g})'.format(
+                description, DEFAULT_INTERVALS[priority] / 3600),
+        )
+
+    parser.add_argument(
+        '--high-value',
+        type=float,
+        default=DEFAULT_HIGH_VALUE,
+        help='Total value of a product\'s rows that makes it high priority (default: {:g})'.format(DEFAULT_HIGH_VALUE),
+    )
+
+    parser.add_argument(
+        '--medium-value',
+        type=float,
+        default=DEFAULT_MEDIUM_VALUE,
+        help='Total value of a product\'s rows that makes it medium priority (default: {:g})'.format(DEFAULT_MEDIUM_VALUE),
+    )
+
+    parser.add_argument(
+        '--volatility',
+        type=float,
+        default=DEFAULT_VOLATILITY,
+        help='Price deviation over mean in the last week that makes a product high priority (default: {:g})'.format(DEFAULT_VOLATILITY),
+    )
+
+    parser.add_argument(
+        '--history-path',
+        default=DEFAULT_HISTORY_PATH,
+        help='SQLite price history used for volatility and last refresh times (default: {})'.format(DEFAULT_HISTORY_PATH),
+    )
+
+    parser.add_argument(
+        '--mirror-path',
+        default=None,
+        help='Work on a local SQLite copy of the sheet and sync only the changed cells (default: off)',
+    )
+
+    parser.add_argument(
+        '--log-level',
+        choices=LOG_LEVELS,
+        default=DEFAULT_LOG_LEVEL,
+        help='Only log messages at this level or above (default: {})'.format(DEFAULT_LOG_LEVEL),
+    )
+
+    parser.add_argument(
+        '--log-format',
+        choices=LOG_FORMATS,
+        default='text',
+        help='Log readable lines or one JSON object per line (default: text)',
+    )
+
+    args = parser.parse_args()
+    configure_logging(args.log_level, log_format=args.log_format)
+
+    # Imported here so the tracker's Qt and Sheets imports only load in the service
+    from tcgplayer_tracker import TCGPlayerSheetManager
+
+    manager = TCGPlayerSheetManager.shared_instance()
+    if args.mirror_path:
+        manager.useMirror(args.mirror_path)
+    # One warm browser for the selenium source and the other sources' fallback
+    session = BrowserSession(manager.createWebDriver)
+    if args.price_source == "http":
+        source = HttpPriceSource(base_url=args.api_url, workers=args.http_concurrency,
+                                 rate_limit=args.requests_per_second)
+    elif args.price_source == "html":
+        source = HtmlPriceSource(workers=args.http_concurrency, rate_limit=args.requests_per_second)
+    else:
+        source = BrowserPriceSource(manager.getQuoteFromPage, session)
+
+    with source, PriceHistory(args.history_path) as history:
+        scheduler = RefreshScheduler(
+            manager,
+            source,
+            history=history,
+            budget_per_hour=args.budget_per_hour,
+            batch_size=args.batch_size,
+            cycle_seconds=args.cycle_seconds,
+            sheet_refresh=args.sheet_refresh_minutes * 60,
+            intervals={priority: getattr(args, '{}_hours'.format(priority)) * 3600
+                       for priority in (HIGH, MEDIUM, LOW)},
+            high_value=args.high_value,
+            medium_value=args.medium_value,
+            volatility=args.volatility,
+            session=session,
+        )
+        try:
+            scheduler.run()
+        except KeyboardInterrupt:
+            logger.info("Stopping")
+        finally:
+            scheduler.stop()
+            manager.closeMirror()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import logging
+from types import MappingProxyType
+
+
+logger = logging.getLogger(__name__)
+
+
+def column_letter(column):
+    """Converts a 1-indexed column number into its A1 letter name.
+
+    Args:
+        column(int): 1-indexed column number (1 -> A, 27 -> AA)
+
+    Returns:
+        str: The column letters
+    """
+    if column < 1:
+        raise ValueError("Column index must be 1 or greater, got {}".format(column))
+    letters = ""
+    while column:
+        column, remainder = divmod(column - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def column_number(letters):
+    """Converts A1 column letters into a 1-indexed column number.
+
+    Args:
+        letters(str): The column letters (A -> 1, AA -> 27)
+
+    Returns:
+        int: The column number
+    """
+    number = 0
+    for letter in letters:
+        number = number * 26 + ord(letter) - ord('A') + 1
+    return number
+
+
+def record_row(index, label_row=1):
+    """Returns the sheet row of a record read by ``get_all_records``.
+
+    Args:
+        index(int): 0-indexed position of the record in the records
+        label_row(int): 1-indexed row of the headers the records were read under
+
+    Returns:
+        int: The 1-indexed sheet row
+    """
+    return label_row + 1 + index
+
+
+class SheetSchemaError(ValueError):
+    """Raised when the header row is missing columns the tracker needs, or
+    has one of them more than once."""
+
+
+class SheetSchema(object):
+    """Immutable map of the sheet's header row to column positions.
+
+    Built once per run from the header row and shared by every row, so a
+    column lookup is a dict hit instead of a scan of the record's keys.
+    Column letters go past Z (AA, AB, ...).
+
+    Columns with a blank header, e.g. spacers or notes, keep their place in
+    the row but can't be looked up by name.  A name other than a required
+    one that heads more than one column refers to the first of them.
+    """
+
+    __slots__ = ("headers", "_positions", "_letters")
+
+    def __init__(self, headers, required=()):
+        headers = tuple(headers)
+        missing = [name for name in required if name not in headers]
+        if missing:
+            raise SheetSchemaError("The sheet is missing the columns: {}".format(", ".join(missing)))
+        positions = {}
+        blank = []
+        duplicated = set()
+        for (position, name) in enumerate(headers):
+            if not str(name).strip():
+                blank.append(column_letter(position + 1))
+            elif name in positions:
+                duplicated.add(name)
+            else:
+                positions[name] = position
+        if duplicated & set(required):
+            raise SheetSchemaError("The header row has more than one column named: {}".format(
+                ", ".join(sorted(duplicated & set(required)))))
+        if blank:
+            logger.debug("Ignoring the columns without a header: %s", ", ".join(blank))
+        if duplicated:
+            logger.warning("Only the first of the columns named %s is used", ", ".join(sorted(duplicated)))
+        object.__setattr__(self, "headers", headers)
+        object.__setattr__(self, "_positions", MappingProxyType(positions))
+        object.__setattr__(self, "_letters", tuple(
+            column_letter(position + 1) for position in range(len(headers))))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("SheetSchema is immutable")
+
+    def __len__(self):
+        return len(self.headers)
+
+    def __contains__(self, name):
+        return name in self._positions
+
+    def position(self, name):
+        """(int): Returns the 0-indexed position of the column"""
+        return self._positions[name]
+
+    def column(self, name):
+        """(int): Returns the 1-indexed column number, as gspread expects"""
+        return self._positions[name] + 1
+
+    def letter(self, name):
+        """(str): Returns the A1 letters of the column"""
+        return self._letters[self._positions[name]]
+
+    def cell(self, name, row):
+        """(str): Returns the A1 notation of the column's cell on the row"""
+        return "{}{}".format(self.letter(name), row)
+
+    def rowRange(self, row):
+        """(str): Returns the A1 range covering every column of the row"""
+        return "A{row}:{end}{row}".format(row=row, end=self._letters[-1])
+
+
+class SheetRow(object):
+    """Compact record for one row of the sheet.
+
+    Stores the cell values in a list next to the shared SheetSchema instead
+    of a dict per row.  It reads and writes like the dicts returned by
+    ``get_all_records`` so ``record['Game']`` keeps working.
+    """
+
+    __slots__ = ("schema", "cells")
+
+    def __init__(self, schema, cells):
+        self.schema = schema
+        self.cells = cells
+
+    @classmethod
+    def fromRecord(cls, schema, record):
+        return cls(schema, [record.get(name, "") for name in schema.headers])
+
+    def __getitem__(self, name):
+        return self.cells[self.schema.position(name)]
+
+    def __setitem__(self, name, value):
+        self.cells[self.schema.position(name)] = value
+
+    def __contains__(self, name):
+        return name in self.schema
+
+    def __iter__(self):
+        return iter(self.schema.headers)
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __repr__(self):
+        return "SheetRow({!r})".format(dict(self.items()))
+
+    def get(self, name, default=None):
+        if name not in self.schema:
+            return default
+        return self[name]
+
+    def keys(self):
+        return self.schema.headers
+
+    def values(self):
+        return list(self.cells)
+
+    def items(self):
+        return zip(self.schema.headers, self.cells)
+
+    def copy(self):
+        return SheetRow(self.schema, list(self.cells))
@@ -0,0 +1,156 @@
+import logging
+import time
+
+from tcgplayer_sheet_schema import SheetRow, column_letter
+
+
+DEFAULT_FLUSH_ROWS = 50
+DEFAULT_FLUSH_SECONDS = 30.0
+
+logger = logging.getLogger(__name__)
+
+
+def changed_columns(record, original):
+    """Returns the 1-indexed columns whose value differs from the original.
+
+    Args:
+        record(dict|SheetRow): The record after it has been updated
+        original(dict|SheetRow): A copy of the record as it was read from the sheet
+
+    Returns:
+        list<int>: Column numbers that need to be written
+    """
+    if isinstance(record, SheetRow) and isinstance(original, SheetRow):
+        return [
+            index + 1
+            for (index, (value, before)) in enumerate(zip(record.cells, original.cells))
+            if value != before
+        ]
+    columns = []
+    for (index, (key, value)) in enumerate(record.items()):
+        if key not in original or original[key] != value:
+            columns.append(index + 1)
+    return columns
+
+
+class SheetWriteBuffer(object):
+    """Collects dirty cells and writes them as a single multi-range batch update.
+
+    Only the cells that changed are sent.  Neighbouring dirty cells in the same
+    row are coalesced into one range.  The buffer is flushed once it holds
+    ``flush_rows`` rows or ``flush_seconds`` have passed since the last flush,
+    and always when used as a context manager exits, even on errors.
+
+    ``on_flush`` is called with the rows mapped to their records once the
+    sheet has accepted them, including rows that had nothing to change.
+
+    Each write is timed as the ``sheet_write`` stage of ``metrics`` when given.
+    """
+
+    def __init__(self, sheet, flush_rows=DEFAULT_FLUSH_ROWS,
+                 flush_seconds=DEFAULT_FLUSH_SECONDS,
+                 value_input_option='USER_ENTERED', on_flush=None, metrics=None):
+        self.sheet = sheet
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.value_input_option = value_input_option
+        self.on_flush = on_flush
+        self.metrics = metrics
+        # {row: {column: value}}
+        self._pending = {}
+        # {row: record}
+        self._staged = {}
+        self._last_flush = time.monotonic()
+        self.write_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+        return False
+
+    def __len__(self):
+        return len(self._staged)
+
+    def stageCell(self, row, column, value):
+        """Marks a single cell as dirty."""
+        self._pending.setdefault(row, {})[column] = value
+
+    def stageRecord(self, row, record, original):
+        """Stages the cells of the record that differ from the original.
+
+        Args:
+            row(int): The sheet row of the record
+            record(dict): The record after it has been updated
+            original(dict): A copy of the record as it was read from the sheet
+
+        Returns:
+            int: The number of cells staged
+        """
+        values = list(record.values())
+        columns = changed_columns(record, original)
+        for column in columns:
+            self.stageCell(row, column, values[column - 1])
+        self._staged[row] = record
+        self.flushIfNeeded()
+        return len(columns)
+
+    def flushIfNeeded(self):
+        """Flushes when the row or time threshold has been reached."""
+        if not self._staged and not self._pending:
+            return
+        rows = max(len(self._staged), len(self._pending))
+        elapsed = time.monotonic() - self._last_flush
+        if rows >= self.flush_rows or elapsed >= self.flush_seconds:
+            self.flush()
+
+    def buildRequests(self):
+        """Builds the ranges for a batch update out of the pending cells.
+
+        Returns:
+            list<dict>: Ranges in A1 notation with their values
+        """
+        requests = []
+        for row in sorted(self._pending):
+            cells = self._pending[row]
+            run = []
+            for column in sorted(cells):
+                if run and column != run[-1] + 1:
+                    requests.append(self._buildRange(row, run, cells))
+                    run = []
+                run.append(column)
+            if run:
+                requests.append(self._buildRange(row, run, cells))
+        return requests
+
+    def _buildRange(self, row, columns, cells):
+        start = column_letter(columns[0])
+        end = column_letter(columns[-1])
+        if start == end:
+            range_name = f"{start}{row}"
+        else:
+            range_name = f"{start}{row}:{end}{row}"
+        return {
+            'range': range_name,
+            'values': [[cells[column] for column in columns]],
+        }
+
+    def flush(self):
+        """Sends every pending cell to the sheet in one request."""
+        self._last_flush = time.monotonic()
+        if self._pending:
+            requests = self.buildRequests()
+            logger.info("Batch updating %s rows with %s ranges", len(self._pending), len(requests))
+            start = time.perf_counter()
+            self.sheet.batch_update(requests, value_input_option=self.value_input_option)
+            if self.metrics is not None:
+                self.metrics.addTime("sheet_write", time.perf_counter() - start)
+                self.metrics.count("sheet_api_calls")
+            # Only drop the cells once the sheet accepted them
+            self._pending = {}
+            self.write_count += 1
+        staged = self._staged
+        self._staged = {}
+        if staged and self.on_flush is not None:
+            self.on_flush(staged)
@@ -0,0 +1,361 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import shutil
+import time
+
+import numpy as np
+
+from tcgplayer_price_cache import filters_key
+from tcgplayer_price_history import DEFAULT_HISTORY_PATH, PriceHistory
+from tcgplayer_price_source import format_price, parse_price
+from tcgplayer_run_metrics import DEFAULT_LOG_LEVEL, LOG_LEVELS, configure_logging
+
+
+DEFAULT_SNAPSHOT_PATH = "tcgplayer_snapshot"
+SNAPSHOT_VERSION = 2
+
+ROWS_FILE = "rows.npy"
+STRINGS_FILE = "strings.npy"
+OFFSETS_FILE = "offsets.npy"
+META_FILE = "meta.json"
+
+# Stored in place of a product ID or quantity the sheet doesn't have
+MISSING = -1
+
+# Text columns hold codes into the snapshot's string table.  "sheet_product_id"
+# and "price_text" are the cells as written, "product_id" and "price" the
+# numbers read from them
+STRING_FIELDS = ("game", "series", "product_name", "condition", "link", "sheet_product_id", "price_text")
+ROW_DTYPE = np.dtype([
+    ("row", "<i4"),
+    ("product_id", "<i8"),
+    ("game", "<i4"),
+    ("series", "<i4"),
+    ("product_name", "<i4"),
+    ("condition", "<i4"),
+    ("link", "<i4"),
+    ("sheet_product_id", "<i4"),
+    ("price_text", "<i4"),
+    ("quantity", "<i4"),
+    ("price", "<f8"),
+    ("total", "<f8"),
+    ("market_price", "<f8"),
+    ("fetched_at", "<f8"),
+])
+
+logger = logging.getLogger(__name__)
+
+
+class StringTable(object):
+    """Interns the text of a snapshot so each distinct string is stored once.
+
+    Code 0 is the empty string.
+    """
+
+    def __init__(self):
+        self._codes = {"": 0}
+        self.strings = [""]
+
+    def __len__(self):
+        return len(self.strings)
+
+    def intern(self, value):
+        """(int): Returns the code of the value, adding it the first time it is seen"""
+        value = "" if value is None else str(value)
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.strings)
+            self.strings.append(value)
+        return code
+
+    def toArrays(self):
+        """
+        Packs the strings into one UTF-8 buffer
+
+        Returns:
+            tuple<np.ndarray, np.ndarray>: The bytes of every string one after
+                the other, and the offset each starts at with the end of the
+                buffer last
+        """
+        encoded = [value.encode("utf-8") for value in self.strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        return (np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets)
+
+
+def build_snapshot_rows(manager, records, latest_prices=None):
+    """
+    Converts the rows of the sheet into the snapshot's columns
+
+    Args:
+        manager(TCGPlayerSheetManager): The sheet manager
+        records(list<SheetRow>): The rows of the sheet
+        latest_prices(dict): The product ID and condition filter mapped to
+            the last price fetched and when, as from
+            ``PriceHistory.latestPrices``
+
+    Returns:
+        tuple<np.ndarray, StringTable>: One entry of ROW_DTYPE per row, and
+            the strings its codes refer to.  Rows without a TCG Product ID
+            take the ID in their link.
+    """
+    latest_prices = latest_prices or {}
+    strings = StringTable()
+    rows = np.zeros(len(records), dtype=ROW_DTYPE)
+    for (i, record) in enumerate(records):
+        sheet_product_id = record[manager.TCG_PRODUCT_ID_COLUMN]
+        product_id = sheet_product_id or manager.getProductIDFromLink(record)
+        condition = filters_key(manager.getProductFilters(record))
+        try:
+            quantity = manager.getQuantity(record)
+        except (TypeError, ValueError):
+            quantity = MISSING
+        (market_price, fetched_at) = latest_prices.get((str(product_id), condition), (None, None))
+        rows[i] = (
+            manager.getRow(i),
+            int(product_id) if str(product_id).isdigit() else MISSING,
+            strings.intern(record[manager.GAME_COLUMN]),
+            strings.intern(record[manager.SERIES_COLUMN]),
+            strings.intern(record[manager.PRODUCT_NAME_COLUMN]),
+            strings.intern(condition),
+            strings.intern(record[manager.TCG_LINK_COLUMN]),
+            strings.intern(sheet_product_id),
+            strings.intern(record[manager.UNIT_PRICE_COLUM]),
+            quantity,
+            _price(record[manager.UNIT_PRICE_COLUM]),
+            _price(record[manager.TOTAL_PRICE_COLUMN]),
+            np.nan if market_price is None else market_price,
+            np.nan if fetched_at is None else fetched_at,
+        )
+    return (rows, strings)
+
+
+def _price(text):
+    price = parse_price(text)
+    return np.nan if price is None else price
+
+
+def write_snapshot(path, manager, records, latest_prices=None):
+    """
+    Writes the rows of the sheet as a snapshot directory
+
+    The snapshot is written next to ``path`` and swapped in once complete,
+    so a reader never sees half of one.
+
+    Args:
+        path(str): The snapshot directory
+        manager(TCGPlayerSheetManager): The sheet manager
+        records(list<SheetRow>): The rows of the sheet
+        latest_prices(dict): The last price fetched for every product, see
+            ``build_snapshot_rows``
+
+    Returns:
+        int: The number of rows written
+    """
+    (rows, strings) = build_snapshot_rows(manager, records, latest_prices=latest_prices)
+    (buffer, offsets) = strings.toArrays()
+    staging = path + ".tmp"
+    if os.path.exists(staging):
+        shutil.rmtree(staging)
+    os.makedirs(staging)
+    np.save(os.path.join(staging, ROWS_FILE), rows)
+    np.save(os.path.join(staging, STRINGS_FILE), buffer)
+    np.save(os.path.join(staging, OFFSETS_FILE), offsets)
+    with open(os.path.join(staging, META_FILE), "w") as f:
+        json.dump({
+            "version": SNAPSHOT_VERSION,
+            "written_at": time.time(),
+            "rows": len(rows),
+            "strings": len(strings),
+            "headers": list(manager.schema.headers) if manager.schema is not None else [],
+        }, f, indent=2)
+
+    previous = path + ".old"
+    if os.path.exists(path):
+        os.replace(path, previous)
+    os.replace(staging, path)
+    if os.path.exists(previous):
+        shutil.rmtree(previous)
+    logger.info("Wrote %s rows and %s distinct strings to %s", len(rows), len(strings), path)
+    return len(rows)
+
+
+class InventorySnapshot(object):
+    """The inventory and latest prices as typed columns read from a snapshot.
+
+    ``rows`` is a structured array of ROW_DTYPE, memory mapped by default so
+    loading only reads the header and pages come in as columns are used.
+    Prices that are missing are NaN, product IDs and quantities -1.  Text
+    columns hold codes that ``string`` turns back into text.
+    """
+
+    def __init__(self, path=DEFAULT_SNAPSHOT_PATH, mmap=True):
+        self.path = path
+        mode = "r" if mmap else None
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != SNAPSHOT_VERSION:
+            raise ValueError("{} is a version {} snapshot, expected {}".format(
+                path, self.meta.get("version"), SNAPSHOT_VERSION))
+        self.rows = np.load(os.path.join(path, ROWS_FILE), mmap_mode=mode)
+        self._buffer = np.load(os.path.join(path, STRINGS_FILE), mmap_mode=mode)
+        self._offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode=mode)
+        # {code: str} for the strings decoded so far
+        self._strings = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def string(self, code):
+        """(str): Returns the text for a string code"""
+        code = int(code)
+        value = self._strings.get(code)
+        if value is None:
+            start = self._offsets[code]
+            end = self._offsets[code + 1]
+            value = self._strings[code] = self._buffer[start:end].tobytes().decode("utf-8")
+        return value
+
+    def strings(self, field):
+        """(list<str>): Returns the text of a string column for every row"""
+        return [self.string(code) for code in self.rows[field]]
+
+    def findProduct(self, product_id):
+        """(np.ndarray): Returns the indexes of the rows holding the product"""
+        return np.flatnonzero(self.rows["product_id"] == int(product_id))
+
+    def record(self, index):
+        """(dict): Returns the row at the index with its text decoded"""
+        row = self.rows[index]
+        record = {name: row[name].item() for name in ROW_DTYPE.names}
+        for name in STRING_FIELDS:
+            record[name] = self.string(row[name])
+        return record
+
+    def totalValue(self):
+        """(float): Returns the value of every row with a quantity and a price"""
+        held = (self.rows["quantity"] > 0) & ~np.isnan(self.rows["price"])
+        return float(np.dot(self.rows["quantity"][held], self.rows["price"][held]))
+
+    def getPositions(self):
+        """
+        Returns what every row holds, like ``TCGPlayerSheetManager.getPositions``
+
+        The same rows are kept: those with a TCG Product ID and a quantity.
+        Rows whose ID only comes from their link are left out here, as the
+        manager does, though ``findProduct`` finds them.  The product ID and
+        unit price are the text of their cells, where the manager has what
+        gspread read from them, e.g. an int for a numeric product ID.
+
+        Returns:
+            list<tuple>: The row, product ID, condition filter, game, series,
+                product name, quantity and unit price text of every row that
+                has a product and a quantity
+        """
+        held = np.flatnonzero((self.rows["sheet_product_id"] != 0) & (self.rows["quantity"] != MISSING))
+        positions = []
+        for row in self.rows[held]:
+            positions.append((
+                row["row"].item(),
+                self.string(row["sheet_product_id"]),
+                self.string(row["condition"]),
+                self.string(row["game"]),
+                self.string(row["series"]),
+                self.string(row["product_name"]),
+                row["quantity"].item(),
+                self.string(row["price_text"]),
+            ))
+        return positions
+
+    def sizeOnDisk(self):
+        """(int): Returns the bytes the snapshot takes"""
+        return sum(os.path.getsize(os.path.join(self.path, name)) for name in os.listdir(self.path))
+
+
+def print_info(snapshot, args):
+    written_at = datetime.datetime.fromtimestamp(snapshot.meta["written_at"]).strftime("%Y-%m-%d %H:%M")
+    products = np.unique(snapshot.rows["product_id"][snapshot.rows["product_id"] != MISSING])
+    print("Written:  {}".format(written_at))
+    print("Rows:     {}".format(len(snapshot)))
+    print("Products: {}".format(len(products)))
+    print("Strings:  {}".format(snapshot.meta["strings"]))
+    print("Value:    {}".format(format_price(snapshot.totalValue())))
+    print("Size:     {:.1f} KB ({:.0f} bytes per row)".format(
+        snapshot.sizeOnDisk() / 1024, snapshot.sizeOnDisk() / max(len(snapshot), 1)))
+
+
+def print_product(snapshot, args):
+    print("{:>6} {:<40} {:>6} {:>10} {:>10}".format("Row", "Name", "Number", "Price", "Market"))
+    for index in snapshot.findProduct(args.product_id):
+        record = snapshot.record(index)
+        print("{:>6} {:<40} {:>6} {:>10} {:>10}".format(
+            record["row"],
+            record["product_name"][:40],
+            "-" if record["quantity"] == MISSING else record["quantity"],
+            format_price(None if np.isnan(record["price"]) else record["price"]),
+            format_price(None if np.isnan(record["market_price"]) else record["market_price"]),
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write or read a compact columnar snapshot of the inventory')
+
+    parser.add_argument(
+        '--path',
+        default=DEFAULT_SNAPSHOT_PATH,
+        help='Directory of the snapshot (default: {})'.format(DEFAULT_SNAPSHOT_PATH),
+    )
+
+    parser.add_argument(
+        '--log-level',
+        choices=LOG_LEVELS,
+        default=DEFAULT_LOG_LEVEL,
+        help='Only log messages at this level or above (default: {})'.format(DEFAULT_LOG_LEVEL),
+    )
+
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    write = commands.add_parser('write', help='Read the sheet and write it as a snapshot')
+    write.add_argument(
+        '--history-path',
+        default=DEFAULT_HISTORY_PATH,
+        help='Price history to take the latest prices from (default: {})'.format(DEFAULT_HISTORY_PATH),
+    )
+    write.add_argument(
+        '--no-history',
+        action='store_true',
+        help='Leave the latest prices out of the snapshot (default: False)',
+    )
+
+    info = commands.add_parser('info', help='Summarize a snapshot')
+    info.set_defaults(handler=print_info)
+
+    product = commands.add_parser('product', help='Every row holding one product')
+    product.add_argument('product_id', help='TCGPlayer product ID')
+    product.set_defaults(handler=print_product)
+
+    args = parser.parse_args()
+    configure_logging(args.log_level)
+
+    if args.command != 'write':
+        args.handler(InventorySnapshot(args.path), args)
+        return
+
+    latest_prices = None
+    if not args.no_history:
+        with PriceHistory(args.history_path) as history:
+            latest_prices = history.latestPrices()
+
+    # Imported here so reading a snapshot doesn't need the tracker's dependencies
+    from tcgplayer_tracker import TCGPlayerSheetManager
+
+    manager = TCGPlayerSheetManager.shared_instance()
+    records = manager.loadRecords()
+    write_snapshot(args.path, manager, records, latest_prices=latest_prices)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import json
+import os
+import re
+
+
+DEFAULT_TARGETS_PATH = "tcgplayer_targets.json"
+
+
+class SheetTarget(object):
+    """A worksheet the tracker refreshes.
+
+    The worksheet is either its 0-indexed position in the spreadsheet or
+    its title.  Targets read from a config file are named after the
+    spreadsheet and worksheet unless the config names them, and the name
+    keeps their local state files apart.
+    """
+
+    __slots__ = ("spreadsheet", "worksheet", "label_row", "name")
+
+    def __init__(self, spreadsheet, worksheet, label_row=1, name=None):
+        self.spreadsheet = spreadsheet
+        self.worksheet = worksheet
+        self.label_row = label_row
+        self.name = name
+
+    def __repr__(self):
+        return "SheetTarget({!r}, {!r})".format(self.spreadsheet, self.worksheet)
+
+    def path(self, path):
+        """Returns the local file this target keeps in place of ``path``.
+
+        e.g. "tcgplayer_refresh_state.sqlite3" becomes
+        "tcgplayer_refresh_state.consignment-0.sqlite3" for a target named
+        "Consignment 0".  Unnamed targets use ``path`` as is.
+
+        Args:
+            path(str): Path of the file shared by every target, or None
+
+        Returns:
+            str: The path for this target
+        """
+        if not path or not self.name:
+            return path
+        (root, extension) = os.path.splitext(path)
+        return "{}.{}{}".format(root, slugify(self.name), extension)
+
+
+def slugify(name):
+    """(str): Returns the name in lower case with every run of other characters as a dash"""
+    return re.sub(r"[^a-z0-9]+", "-", str(name).lower()).strip("-")
+
+
+def load_targets(path=DEFAULT_TARGETS_PATH):
+    """Reads the worksheets to refresh from a JSON config.
+
+    e.g.
+        {"targets": [
+            {"spreadsheet": "TCG track", "worksheet": 1},
+            {"spreadsheet": "TCG track", "worksheet": "Pokemon"},
+            {"spreadsheet": "Consignment", "worksheet": 0, "name": "consignment"}
+        ]}
+
+    Args:
+        path(str): Path of the config
+
+    Returns:
+        list<SheetTarget>: The targets in the order they are listed
+
+    Raises:
+        ValueError: When a target is missing its spreadsheet or worksheet,
+            or two targets share a name
+    """
+    with open(path) as f:
+        config = json.load(f)
+    targets = []
+    names = set()
+    for (position, entry) in enumerate(config.get("targets", [])):
+        if "spreadsheet" not in entry or "worksheet" not in entry:
+            raise ValueError("Target {} in {} needs a spreadsheet and a worksheet".format(position, path))
+        name = entry.get("name") or "{} {}".format(entry["spreadsheet"], entry["worksheet"])
+        if slugify(name) in names:
+            raise ValueError("More than one target in {} is named {!r}".format(path, name))
+        names.add(slugify(name))
+        targets.append(SheetTarget(
+            entry["spreadsheet"],
+            entry["worksheet"],
+            label_row=entry.get("label_row", 1),
+            name=name,
+        ))
+    if not targets:
+        raise ValueError("{} lists no targets".format(path))
+    return targets
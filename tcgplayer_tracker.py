@@ -1,5 +1,6 @@
-
 import argparse
+import json
+import logging
 import os
 import re
 import sys
@@ -7,17 +8,62 @@ import time
 
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
-from selenium import webdriver
 from selenium.webdriver.common.by import By
-from selenium.webdriver.firefox.options import Options
 from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import ElementNotInteractableException
 
-from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
+from urllib.parse import urlparse, parse_qs, urlencode
 
 from PySide6 import QtWidgets, QtCore, QtGui
 
+from tcgplayer_async_fetch import DEFAULT_CONCURRENCY, DEFAULT_RATE_LIMIT
+from tcgplayer_browser import PRICE_PROFILE, PROFILES, BrowserSession, create_firefox_driver
+from tcgplayer_inventory_mirror import CONFLICT_POLICIES, DEFAULT_MIRROR_PATH, PREFER_SHEET, InventoryMirror
+from tcgplayer_price_cache import (
+    DEFAULT_CACHE_PATH,
+    DEFAULT_CACHE_SIZE,
+    DEFAULT_CACHE_TTL,
+    PriceCache,
+    QuoteMemo,
+    filters_key,
+)
+from tcgplayer_page_parser import parse_product_page
+from tcgplayer_price_history import DEFAULT_HISTORY_PATH, PriceHistory
+from tcgplayer_price_source import (
+    BASE_SITE,
+    DEFAULT_API_URL,
+    HtmlPriceSource,
+    HttpPriceSource,
+    PriceQuote,
+    parse_price,
+)
+from tcgplayer_product_resolver import DEFAULT_INDEX_PATH, ProductIndex, ProductResolver, resolve_missing_ids
+from tcgplayer_refresh_state import (
+    DEFAULT_CHECKPOINT_PATH,
+    DEFAULT_DEAD_LETTER_PATH,
+    DEFAULT_STALE_AFTER,
+    DEFAULT_STATE_PATH,
+    DeadLetterFile,
+    RefreshCheckpoint,
+    RefreshState,
+)
+from tcgplayer_run_metrics import (
+    DEFAULT_LIVE_INTERVAL,
+    DEFAULT_LOG_LEVEL,
+    LOG_FORMATS,
+    LOG_LEVELS,
+    RunMetrics,
+    configure_logging,
+)
+from tcgplayer_sheet_schema import SheetRow, SheetSchema, record_row
+from tcgplayer_sheet_writer import (
+    DEFAULT_FLUSH_ROWS,
+    DEFAULT_FLUSH_SECONDS,
+    SheetWriteBuffer,
+)
+from tcgplayer_targets import SheetTarget, load_targets
+from tcgplayer_worker_pool import DEFAULT_ATTEMPTS, RetryPolicy, ScrapeWorkerPool
 
 # GLOBALS
 CHROME_DRIVER_PATH = "C:\\chromedriver\\chromedriver.exe"
@@ -30,9 +76,13 @@ SHEETS_SCOPE = [
 ]
 
 
-BASE_SITE = "https://www.tcgplayer.com/product/"
 PRODUCT_ID_REGEX = r"product/(\d+)"
 
+# Number of products handed to a price source at once
+PRICE_SOURCE_BATCH_SIZE = 100
+
+logger = logging.getLogger(__name__)
+
 class BaseSheetDependencyInjectionManager(object):
 
     JSON_KEYFILE = ""
@@ -40,6 +90,11 @@ class BaseSheetDependencyInjectionManager(object):
     SHEET_ID = 0
 
     _INSTANCE = None
+    # Authorized once and shared by every sheet of the class
+    _CLIENT = None
+    _SPREADSHEETS = None
+
+    mirror = None
 
     def __init__(self, spreadsheet_name, sheet_id, label_row=1):
         self.spreadsheet_name = spreadsheet_name
@@ -62,18 +117,63 @@ class BaseSheetDependencyInjectionManager(object):
     def getColumnForValue(self):
         return 100
 
+    def useMirror(self, path=DEFAULT_MIRROR_PATH, conflicts=PREFER_SHEET):
+        """Reads and writes a local SQLite copy of the sheet from now on.
+
+        The sheet's changes are pulled into the mirror straight away.  Call
+        ``mirror.push()`` to send the local changes to the sheet.
+
+        Returns:
+            InventoryMirror: The mirror standing in for the sheet
+        """
+        if self.mirror is not None and self.mirror.path != path:
+            self.closeMirror()
+        if self.mirror is None:
+            self.mirror = InventoryMirror(self._sheet, path=path, conflicts=conflicts, label_row=self.label_row)
+            self._sheet = self.mirror
+        self.mirror.pull()
+        return self.mirror
+
+    def closeMirror(self):
+        """Closes the mirror and goes back to reading and writing the sheet itself."""
+        if self.mirror is None:
+            return
+        self._sheet = self.mirror.sheet
+        self.mirror.close()
+        self.mirror = None
+
     def load(self):
-        """Creates and authorizes a client and returns the google sheet.
+        """Returns the google sheet, authorizing the client the first time.
+
+        The sheet ID is the 0-indexed position of the worksheet, or its title.
         """
-        json_keyfile = self.findJSONKeyFile()
-        if not json_keyfile:
-            raise AttributeError("No JSON key file to load credentials with.")
-        creds = ServiceAccountCredentials.from_json_keyfile_name(json_keyfile, SHEETS_SCOPE)
-        client = gspread.authorize(creds)
-        sheet = client.open(self.spreadsheet_name).worksheets()[self.spreadsheet_id]
-        return sheet
+        spreadsheet = self.openSpreadsheet(self.spreadsheet_name)
+        if isinstance(self.spreadsheet_id, str):
+            return spreadsheet.worksheet(self.spreadsheet_id)
+        return spreadsheet.worksheets()[self.spreadsheet_id]
+
+    @classmethod
+    def getClient(cls):
+        """(gspread.Client): Returns the client, authorizing it the first time"""
+        if cls._CLIENT is None:
+            json_keyfile = cls.findJSONKeyFile()
+            if not json_keyfile:
+                raise AttributeError("No JSON key file to load credentials with.")
+            creds = ServiceAccountCredentials.from_json_keyfile_name(json_keyfile, SHEETS_SCOPE)
+            cls._CLIENT = gspread.authorize(creds)
+            cls._SPREADSHEETS = {}
+        return cls._CLIENT
+
+    @classmethod
+    def openSpreadsheet(cls, name):
+        """(gspread.Spreadsheet): Returns the spreadsheet, opening it once per run"""
+        client = cls.getClient()
+        if name not in cls._SPREADSHEETS:
+            cls._SPREADSHEETS[name] = client.open(name)
+        return cls._SPREADSHEETS[name]
     
-    def findJSONKeyFile(self):
+    @classmethod
+    def findJSONKeyFile(cls):
         """Finds the JSON key file for the service account.
 
         Returns:
@@ -82,7 +182,7 @@ class BaseSheetDependencyInjectionManager(object):
         files = os.listdir('.')
         for file in files:
             # print(f"File: {file}")
-            if re.match(self.JSON_KEYFILE, file):
+            if re.match(cls.JSON_KEYFILE, file):
                 return file
         return None
 
@@ -104,49 +204,126 @@ class TCGPlayerSheetManager(BaseSheetDependencyInjectionManager):
     PRODUCT_FILTERS = {
         "Condition": "Near Mint",
     }
+    # Filters used for every game whose name contains the key
+    GAME_FILTERS = {
+        "Single": PRODUCT_FILTERS,
+    }
+    # Optional column overriding the game filters for a row, e.g.
+    # "Condition=Lightly Played&Printing=Foil&Language=English"
+    FILTERS_COLUMN = "TCG Filters"
     COLUMN_OFFSET = 1  # Offset for the column index since gspread is 1-indexed
 
+    GAME_COLUMN = "Game"
+    NUMBER_COLUMN = "Number"
+    REQUIRED_COLUMNS = (
+        GAME_COLUMN,
+        SERIES_COLUMN,
+        PRODUCT_NAME_COLUMN,
+        NUMBER_COLUMN,
+        TCG_PRODUCT_ID_COLUMN,
+        TCG_LINK_COLUMN,
+        PRICE_COLUMN,
+        TOTAL_VALUE_COLUMN,
+    )
+
+    schema = None
+    metrics = None
+    browser_profile = PRICE_PROFILE
+    game_filters = None
+    # {(product_id, condition): url}
+    product_urls = None
+
+    def loadSchema(self, headers):
+        """Builds the column map from the header row and checks the required
+        columns are there.
+
+        Returns:
+            SheetSchema: The schema shared by every row
+        """
+        self.schema = SheetSchema(headers, required=self.REQUIRED_COLUMNS)
+        return self.schema
+
+    def loadRows(self, records):
+        """Converts the records from get_all_records into SheetRows sharing one schema.
+
+        The schema is built from the header row, read once per call, so the
+        required columns are checked even when the sheet has no rows.
+
+        Returns:
+            list<SheetRow>: One row per record
+
+        Raises:
+            SheetSchemaError: When the header row is missing a required
+                column or has one more than once
+        """
+        schema = self.loadSchema(self.sheet.row_values(self.label_row))
+        return [SheetRow.fromRecord(schema, record) for record in records]
+
+    def loadRecords(self):
+        """Reads every row under the label row into SheetRows.
+
+        Returns:
+            list<SheetRow>: One row per record, see ``getRow`` for its sheet row
+        """
+        return self.loadRows(self.sheet.get_all_records(head=self.label_row))
+
+    def getRow(self, index):
+        """(int): Returns the sheet row of the record at the index of the records"""
+        return record_row(index, self.label_row)
+
+    def getMetrics(self):
+        """(RunMetrics): Returns the metrics of the current run, starting them if needed"""
+        if self.metrics is None:
+            self.metrics = RunMetrics()
+        return self.metrics
+
+    def createWebDriver(self):
+        """(WebDriver): Starts a web driver with the browser profile of this run"""
+        return create_web_driver(profile=self.browser_profile)
+
+    def getSchema(self, record):
+        """(SheetSchema): Returns the schema for the record"""
+        if isinstance(record, SheetRow):
+            return record.schema
+        if self.schema is not None and tuple(record.keys()) == self.schema.headers:
+            return self.schema
+        return SheetSchema(record.keys())
+
     def getTCGLinkColumn(self, record):
         """(int): Returns the index for the column for where to update the TCG link"""
-        keys = list(record.keys())
-        return keys.index(self.TCG_LINK_COLUMN) + 1
+        return self.getSchema(record).column(self.TCG_LINK_COLUMN)
 
     def getSetNameColumn(self, record):
         """(int): Returns the index for the column for where to update the set name"""
-        keys = list(record.keys())
-        return keys.index(self.SERIES_COLUMN) + 1
+        return self.getSchema(record).column(self.SERIES_COLUMN)
     
     def getProductNameColumn(self, record): 
         """(int): Returns the index for the column for where to update the product name"""
-        keys = list(record.keys())
-        return keys.index(self.PRODUCT_NAME_COLUMN) + 1
+        return self.getSchema(record).column(self.PRODUCT_NAME_COLUMN)
 
     def getPriceColumn(self, record):
         """(int): Returns the index for the column for where to update the price"""
-        keys = list(record.keys())
-        return keys.index(self.PRICE_COLUMN) + 1
+        return self.getSchema(record).column(self.PRICE_COLUMN)
 
     def getTotalValueColumn(self, record):
-        keys = list(record.keys())
-        return keys.index(self.TOTAL_VALUE_COLUMN) + 1
+        return self.getSchema(record).column(self.TOTAL_VALUE_COLUMN)
     
     def getTCGProductIDColumn(self, record):
         """(int): Returns the index for the column for where to update the TCG Product ID"""
-        keys = list(record.keys())
-        return keys.index(self.TCG_PRODUCT_ID_COLUMN) + 1
+        return self.getSchema(record).column(self.TCG_PRODUCT_ID_COLUMN)
     
     def getProductIDFromLink(self, record):
         # If the ID doesn't exist, check if the link is already there
         # another way
         link = record['TCG Link']
-        print("Link: {}".format(link))
+        logger.debug("Link: %s", link)
         if not link:
             return None
         match = re.search(PRODUCT_ID_REGEX, link)
         if not match:
             return None
         product_id = match.group(1)
-        print("Found Product ID: {}".format(product_id))
+        logger.debug("Found Product ID: %s", product_id)
         return product_id
         # Update the product ID in the sheet
         # self.sheet.update_cell(row, self.getTCGProductIDColumn(record), product_id)
@@ -178,7 +355,7 @@ class TCGPlayerSheetManager(BaseSheetDependencyInjectionManager):
         return "product-details__name"
 
     def getPricing(self, driver):
-        section_name = TCGPlayerSheetManager.shared_instance().getPricingSection()
+        section_name = self.getPricingSection()
         price_point = driver.find_element(By.CLASS_NAME, section_name)
         # Get the first price as this is the market price
         # price_span_element = price_point.find_element(By.CLASS_NAME, "price")
@@ -189,18 +366,18 @@ class TCGPlayerSheetManager(BaseSheetDependencyInjectionManager):
     def getSetName(self, driver):
         # section_name = TCGPlayerSheetManager.shared_instance().getProductSubHeaderSection()
         # product_header = driver.find_element(By.CLASS_NAME, section_name)
-        # product_name_section = TCGPlayerSheetManager.shared_instance().getProductTitleSection()
+        # product_name_section = self.getProductTitleSection()
         # product_title_element = product_header.find_element(By.CLASS_NAME, product_name_section)
         span = driver.find_element(By.CSS_SELECTOR, '[data-testid="lblProductDetailsSetName"]')
         innerHTML = span.get_attribute('innerHTML')
         return innerHTML
 
     def getProductFullName(self, driver):
-        section_name = TCGPlayerSheetManager.shared_instance().getProductHeaderSection()
+        section_name = self.getProductHeaderSection()
         product_header = driver.find_element(By.CLASS_NAME, section_name)
         # Get the first price as this is the market price
         # price_span_element = price_point.find_element(By.CLASS_NAME, "price")
-        product_name_section = TCGPlayerSheetManager.shared_instance().getProductTitleSection()
+        product_name_section = self.getProductTitleSection()
         product_title_element = product_header.find_element(By.CLASS_NAME, product_name_section)
         price_text = product_title_element.get_attribute("innerHTML")
         return price_text 
@@ -219,46 +396,19 @@ class TCGPlayerSheetManager(BaseSheetDependencyInjectionManager):
         return "${:.2f}".format(price * self.getQuantity(record))
 
     def hasPricingElement(self, driver):
-        section_name = TCGPlayerSheetManager.shared_instance().getPricingSection()
+        section_name = self.getPricingSection()
         price_point = driver.find_element(By.CLASS_NAME, section_name)
         # Get the first price as this is the market price
         # price_span_element = price_point.find_element(By.CLASS_NAME, "price")
         price_span_element = price_point.find_element(By.CLASS_NAME, "price-points_upper__price")
         price_text = price_span_element.get_attribute("innerHTML")
     
-    def loadUrlWithAdditionalQueryParams(self, driver, url):
-        # Get the current URL after any redirects/changes
-        current_url = driver.current_url
-        print(f"Current URL: {current_url}")
-        
-        # Parse the URL
-        parsed = urlparse(current_url)
-        params = parse_qs(parsed.query)
-        
-        # Add new parameters
-        params.update(self.PRODUCT_FILTERS)
-        # Rebuild the URL
-        new_query = urlencode(params, doseq=True)
-        new_url = urlunparse((
-            parsed.scheme,
-            parsed.netloc,
-            parsed.path,
-            parsed.params,
-            new_query,
-            parsed.fragment
-        ))
-        print(f"Modified URL: {new_url}") 
-        # Navigate to the modified URL
-        driver.get(new_url)
-
     def batchUpdatePricing(self, record, row):
         requests = []
         values = list(record.values())
-        lengthValues = len(record.values())
         
         # Convert to A1 notation
-        end_col = chr(ord('A') + lengthValues - 1)
-        range_name = f"A{row}:{end_col}{row}"
+        range_name = self.getSchema(record).rowRange(row)
         
         requests.append({
             'range': range_name,
@@ -266,34 +416,93 @@ class TCGPlayerSheetManager(BaseSheetDependencyInjectionManager):
         })
         
         if requests:
-            print("Batch Updating with requests: {}".format(requests))
+            logger.debug("Batch Updating with requests: %s", requests)
             self.sheet.batch_update(requests, value_input_option='USER_ENTERED')
 
-    def updatePricing(self, driver, start_row=None):
-        print("Getting all records")
-        records = self.sheet.get_all_records()
-        # print("Records: {}".format(records))
+    def iterPendingRecords(self, records, start_row=None):
+        """Yields the records that have a product to price.
+
+        Fills in the product ID from the link when it is missing.
+
+        Yields:
+            tuple<int, dict, dict>: The row, the record and a copy of the record
+                as it was read from the sheet
+        """
         for (i, record) in enumerate(records):
-            # Skip the first record
-            # Row starts at 2
-            row = i + 2
+            row = self.getRow(i)
             if start_row and row < start_row:
-                print("Skipping row {} as it is before the start row {}".format(row, start_row))
+                logger.debug("Skipping row %s as it is before the start row %s", row, start_row)
                 continue
+            original = record.copy()
             # If the link doesn't exist, check if it exists in another column
             product_id = self.getProductIDFromLink(record)
             if not record['TCG Product ID']:
                 record['TCG Product ID'] = product_id
             link = self.getLinkToProduct(record, row)
             if not link:
+                logger.debug("Skipping row %s as it has no product ID or link", row)
                 continue
-            print("Getting price for {}".format(self.getProductName(record)))
-            driver.get(link)
-            if "Single" in record['Game']:
-                # Reload the url with additional options
-                self.loadUrlWithAdditionalQueryParams(driver, link)
+            yield (row, record, original)
+
+    def loadGameFilters(self, path):
+        """Reads the filters for each game from a JSON file, replacing GAME_FILTERS.
+
+        The file maps part of a game name to its filters, e.g.
+        ``{"Single": {"Condition": "Near Mint", "Language": "English"}}``.
+        """
+        with open(path) as file:
+            self.game_filters = json.load(file)
+        return self.game_filters
+
+    def getProductFilters(self, record):
+        """(dict): Returns the extra filters used when loading the product, if any"""
+        row_filters = record.get(self.FILTERS_COLUMN)
+        if row_filters:
+            return {name: values[-1] for (name, values) in parse_qs(row_filters).items()}
+        game_filters = self.GAME_FILTERS if self.game_filters is None else self.game_filters
+        for (game, filters) in game_filters.items():
+            if game in record['Game']:
+                return filters or None
+        return None
+
+    def getProductUrl(self, product_id, filters=None):
+        """Returns the URL that loads the product page with its filters applied.
+
+        The URL the page settled on in an earlier run is reused when known.
+        Otherwise the filters are added to the product link up front, so the
+        page is loaded once instead of being loaded and then reloaded with
+        the filters.
+        """
+        key = (str(product_id), filters_key(filters))
+        if self.product_urls and key in self.product_urls:
+            return self.product_urls[key]
+        link = "{site}{product_id}".format(site=BASE_SITE, product_id=str(product_id))
+        if filters:
+            link = "{}?{}".format(link, urlencode(filters))
+        return link
 
-            # Have the web driver wait until it loads the title
+    def hasFilters(self, url, filters):
+        """(bool): Returns if the URL's query has every filter set"""
+        params = parse_qs(urlparse(url).query)
+        return all(params.get(name, [None])[-1] == value for (name, value) in (filters or {}).items())
+
+    def getQuoteFromPage(self, driver, product_id, filters=None):
+        """Loads the product page and reads the price, product name and set name.
+
+        Once the price guide has rendered the page source is read once and
+        parsed offline, rather than asking the driver for each field.
+
+        Returns:
+            PriceQuote: The quote read from the page
+        """
+        metrics = self.getMetrics()
+        key = (str(product_id), filters_key(filters))
+        with metrics.stage("navigate", key):
+            driver.get(self.getProductUrl(product_id, filters=filters))
+        metrics.count("page_loads")
+
+        # Have the web driver wait until it loads the title
+        with metrics.stage("wait", key):
             element = WebDriverWait(driver, 20).until(
                 EC.all_of(
                     EC.presence_of_all_elements_located((By.CLASS_NAME, "price-points__upper__price"))
@@ -302,88 +511,560 @@ class TCGPlayerSheetManager(BaseSheetDependencyInjectionManager):
                     # EC.presence_of_all_elements_located((By.CLASS_NAME, "price"))
                 )
             )
-            if not record['TCG Link']:
-                record['TCG Link'] = driver.current_url
-                # self.sheet.update_cell(row, self.getTCGLinkColumn(record), driver.current_url)
-
-            product_name = self.getProductFullName(driver)
-            # print("Product Name: {}".format(product_name))
-            if record['Product Name'] != product_name:
-                record['Product Name'] = product_name
-                column = self.getProductNameColumn(record)
-                print("Updating product name: {} at row {} column {}".format(product_name, row, column))
-                # self.sheet.update_cell(row, column, product_name)
-
-            set_name = self.getSetName(driver)
-            if record['Series'] != set_name:
-                record['Series'] = set_name
-                column = self.getSetNameColumn(record)
-                print("Updating set name: {} at row {} column {}".format(set_name, row, column))
-                # self.sheet.update_cell(row, column, set_name)
-            # print("Set Name: {}".format(set_name))
-
-            price = self.getPricing(driver)
-            # If there are no sold price, set price to nothing
-            if price != '-':
-                priceFloat = float(price.replace("$", "").replace(",", ""))
-            # price = price.strip("$")
-            print("Updating price: {}".format(price))
-            column = self.getPriceColumn(record)
-            if record[self.UNIT_PRICE_COLUM] != price:
-                record[self.UNIT_PRICE_COLUM] = price
-                # Update the price in the sheet
-            # self.sheet.update_cell(row, column, price)
-            
-            # Get the total value
+        with metrics.stage("extract", key):
+            page = parse_product_page(driver.page_source, url=driver.current_url)
+            return PriceQuote(
+                product_id,
+                page.price,
+                page.product_name,
+                page.set_name,
+                page.url,
+            )
+
+    def applyQuote(self, record, quote):
+        """Updates the record in place with the product name, set name, price
+        and total value from the quote.
+        """
+        if not record['TCG Link']:
+            record['TCG Link'] = quote.url
+
+        product_name = quote.product_name
+        if product_name and record['Product Name'] != product_name:
+            record['Product Name'] = product_name
+            column = self.getProductNameColumn(record)
+            logger.debug("Updating product name: %s column %s", product_name, column)
+
+        set_name = quote.set_name
+        if set_name and record['Series'] != set_name:
+            record['Series'] = set_name
+            column = self.getSetNameColumn(record)
+            logger.debug("Updating set name: %s column %s", set_name, column)
+
+        price = quote.price or '-'
+        priceFloat = parse_price(price)
+        logger.debug("Updating price: %s", price)
+        if record[self.UNIT_PRICE_COLUM] != price:
+            record[self.UNIT_PRICE_COLUM] = price
+
+        # Get the total value, if there are no sold price there is no value either
+        if priceFloat is None:
+            totalValue = '-'
+        else:
             totalValue = self.getTotalValue(priceFloat, record)
-            # totalValue = totalValue.strip("$")
-            totalValueColumn = self.getTotalValueColumn(record)
-            if record[self.TOTAL_PRICE_COLUMN] != totalValue:
-                record[self.TOTAL_PRICE_COLUMN] = totalValue
+        if record[self.TOTAL_PRICE_COLUMN] != totalValue:
+            record[self.TOTAL_PRICE_COLUMN] = totalValue
+        return record
+
+    def scrapeQuote(self, driver, record):
+        """Loads the product page for the record and returns its PriceQuote."""
+        logger.info("Getting price for %s", self.getProductName(record))
+        return self.getQuoteFromPage(
+            driver,
+            record['TCG Product ID'],
+            filters=self.getProductFilters(record),
+        )
+
+    def getProductKey(self, record):
+        """(tuple<str, str>): Returns the product ID and condition filter for the record"""
+        return (str(record['TCG Product ID']), filters_key(self.getProductFilters(record)))
+
+    def getPositions(self, records):
+        """Returns what every row holds, for the price history.
+
+        Returns:
+            list<tuple>: The row, product ID, condition filter, game, series,
+                product name, quantity and unit price of every row that has
+                a product and a quantity
+        """
+        positions = []
+        for (i, record) in enumerate(records):
+            product_id = record[self.TCG_PRODUCT_ID_COLUMN]
+            if not product_id:
+                continue
+            try:
+                quantity = self.getQuantity(record)
+            except (TypeError, ValueError):
+                continue
+            positions.append((
+                self.getRow(i),
+                product_id,
+                filters_key(self.getProductFilters(record)),
+                record[self.GAME_COLUMN],
+                record[self.SERIES_COLUMN],
+                record[self.PRODUCT_NAME_COLUMN],
+                quantity,
+                record[self.UNIT_PRICE_COLUM],
+            ))
+        return positions
+
+    def groupPendingRecords(self, pending):
+        """Groups the pending rows by product so every product is fetched once.
+
+        Returns:
+            dict<tuple<str, str>, list<tuple>>: The product ID and condition
+                filter mapped to the rows for that product
+        """
+        groups = {}
+        for item in pending:
+            groups.setdefault(self.getProductKey(item[1]), []).append(item)
+        return groups
+
+    def updatePricing(self, driver=None, start_row=None, flush_rows=DEFAULT_FLUSH_ROWS,
+                      flush_seconds=DEFAULT_FLUSH_SECONDS, workers=1, price_source=None,
+                      cache=None, state=None, checkpoint=None, metrics=None, history=None,
+                      records=None, keys=None, snapshot=True, retry=None, dead_letter=None,
+                      retry_failed=False, session=None):
+        """Scrapes the price for every record and writes the changes back to the sheet.
+
+        Rows that share a product are fetched once.  Products found in the
+        cache are not fetched at all.
+
+        Args:
+            driver(WebDriver): Driver used when running with a single worker.
+                One is created when not given.
+            start_row(int): Row to start processing from
+            flush_rows(int): Number of dirty rows to buffer before writing
+            flush_seconds(float): Maximum seconds to buffer dirty rows
+            workers(int): Number of web drivers scraping at the same time
+            price_source(PriceSource): Prices products without a browser.
+                Products it can't price fall back to the web driver.
+            cache(PriceCache): Cache of recently fetched quotes
+            state(RefreshState): Only refresh rows that are new, edited or stale
+            checkpoint(RefreshCheckpoint): Skips rows an interrupted run already
+                wrote.  Cleared once every row has been written.
+            metrics(RunMetrics): Collects the stage timings and counters
+            history(PriceHistory): Appends every fetched price and, once the
+                sheet is written, what every row holds
+            records(list<SheetRow>): Rows already read from the sheet, they
+                are read again when not given
+            keys(set<tuple<str, str>>): Only refresh the rows of these
+                product keys
+            snapshot(bool): Store what every row holds in the history once
+                the sheet is written
+            retry(RetryPolicy): How often and how long to retry a product
+                before giving up on it
+            dead_letter(DeadLetterFile): Records the rows that failed, and
+                drops the ones that went through
+            retry_failed(bool): Only refresh the rows in the dead letter file
+            session(BrowserSession): Warm browser to scrape with instead of
+                the driver.  It is left open for the caller's next sheet.
+
+        A product that fails is logged and left out instead of stopping the
+        run.
+
+        Returns:
+            RunMetrics: The timings and counters of the run
+        """
+        self.metrics = metrics = metrics or RunMetrics()
+        retry = retry or RetryPolicy()
+        if records is None:
+            logger.info("Getting all records")
+            with metrics.stage("sheet_read"):
+                records = self.loadRecords()
+            # The records and the header row
+            metrics.count("sheet_api_calls", 2)
+        pending = self.iterPendingRecords(records, start_row=start_row)
+        if keys is not None:
+            pending = (item for item in pending if self.getProductKey(item[1]) in keys)
+        if retry_failed and dead_letter is not None:
+            pending = dead_letter.filterPending(pending)
+        if checkpoint is not None:
+            pending = checkpoint.filterPending(pending)
+        if state is not None:
+            pending = state.filterPending(pending, self.getProductKey)
+        groups = self.groupPendingRecords(pending)
+        self.product_urls = cache.getUrls() if cache is not None else {}
+        for (key, group) in groups.items():
+            metrics.addRows(key, [row for (row, record, original) in group])
+
+        def written(staged):
+            if state is not None:
+                state.markWritten(staged, self.getProductKey)
+            if checkpoint is not None:
+                checkpoint.markWritten(staged)
+            if dead_letter is not None:
+                dead_letter.remove(staged)
+            if history is not None:
+                history.flush()
+
+        writer = SheetWriteBuffer(
+            self.sheet,
+            flush_rows=flush_rows,
+            flush_seconds=flush_seconds,
+            on_flush=written,
+            metrics=metrics,
+        )
+
+        def fail(key, error, attempts=1, rows=None):
+            rows = rows or groups[key]
+            logger.error("Failed to price product %s for rows %s: %s", key[0],
+                         ", ".join(str(row) for (row, record, original) in rows), str(error).strip())
+            metrics.count("failed_rows", len(rows))
+            if dead_letter is not None:
+                for (row, record, original) in rows:
+                    dead_letter.add(row, key, self.getProductName(record), error, attempts=attempts)
+
+        def stage(key, quote):
+            with metrics.stage("apply", key):
+                for (row, record, original) in groups[key]:
+                    try:
+                        self.applyQuote(record, quote)
+                    except (KeyError, TypeError, ValueError) as e:
+                        fail(key, e, rows=[(row, record, original)])
+                        continue
+                    writer.stageRecord(row, record, original)
+            metrics.rowDone(len(groups[key]))
 
-            self.batchUpdatePricing(record, row)
-            # self.sheet.update_cell(row, totalValueColumn, totalValue)
+        def resolve(key, quote):
+            stage(key, quote)
+            filters = self.getProductFilters(groups[key][0][1])
+            if history is not None:
+                history.recordQuote(quote, filters)
+            if cache is not None:
+                cache.put(quote, filters)
+                # Remember where the filtered page settled for the next run
+                if (quote.url and quote.url != self.getProductUrl(key[0], filters)
+                        and self.hasFilters(quote.url, filters)):
+                    self.product_urls[key] = quote.url
+                    cache.putUrl(key[0], quote.url, filters)
 
-            # If we ran through 30 products, close the driver to avoid memory issues
-            if i % 30 == 0:
-                print("Closing web driver to avoid memory issues")
-                driver.quit()
-                print("Recreating web driver")
-                driver = create_web_driver()
+        # The writer flushes whatever is pending on exit, even if a row fails
+        with writer:
+            if cache is not None:
+                hits = 0
+                for key in list(groups):
+                    with metrics.stage("cache", key):
+                        quote = cache.get(key[0], self.getProductFilters(groups[key][0][1]))
+                    if quote is None:
+                        continue
+                    stage(key, quote)
+                    del groups[key]
+                    hits += 1
+                metrics.count("cache_hits", hits)
+                logger.info("Found %s products in the cache, %s to fetch", hits, len(groups))
 
-        # Quit the driver after all records are processed
-        driver.quit()
+            if not groups:
+                if driver is not None:
+                    driver.quit()
+            elif price_source is not None:
+                if driver is not None:
+                    driver.quit()
+                self._updatePricingWithSource(price_source, groups, resolve, fail, retry, session=session)
+            elif workers > 1:
+                if driver is not None:
+                    driver.quit()
+                self._updatePricingWithPool(groups, resolve, workers, fail, retry)
+            else:
+                self._updatePricingSequential(driver, groups, resolve, fail, retry, session=session)
+        metrics.count("retries", retry.retries)
+        if history is not None:
+            history.flush()
 
-def create_web_driver():
+        if checkpoint is not None:
+            checkpoint.clear()
+        if history is not None and snapshot:
+            with metrics.stage("history"):
+                history.recordRun(self.getPositions(records))
+        if metrics.live:
+            metrics.stream.write("\n")
+        logger.info(metrics.summaryLine())
+        return metrics
+
+    def _updatePricingSequential(self, driver, groups, resolve, fail, retry, session=None):
+        # The session recycles the driver once the browser has grown too much
+        owned = session is None
+        if owned:
+            session = BrowserSession(self.createWebDriver, driver=driver)
+        restarts = session.restarts
+        try:
+            for (key, group) in groups.items():
+                try:
+                    quote = retry.run(self.scrapeQuote, session, group[0][1], name="product {}".format(key[0]))
+                except Exception as e:
+                    fail(key, e, attempts=getattr(e, "attempts", 1))
+                    continue
+                resolve(key, quote)
+        finally:
+            self.getMetrics().count("driver_restarts", session.restarts - restarts)
+            # Quit the driver after all records are processed
+            if owned:
+                session.quit()
+
+    def _updatePricingWithSource(self, price_source, groups, resolve, fail, retry, session=None):
+        logger.info("Pricing with the %s price source", price_source.name)
+        metrics = self.getMetrics()
+        keys = list(groups)
+        fallback = {}
+        for start in range(0, len(keys), PRICE_SOURCE_BATCH_SIZE):
+            # Singles and sealed product are requested with different filters
+            by_condition = {}
+            for key in keys[start:start + PRICE_SOURCE_BATCH_SIZE]:
+                by_condition.setdefault(key[1], []).append(key)
+            for batch in by_condition.values():
+                filters = self.getProductFilters(groups[batch[0]][0][1])
+                sent = price_source.request_count
+                with metrics.stage("http_fetch"):
+                    quotes = price_source.fetchMany([key[0] for key in batch], filters=filters)
+                metrics.count("http_requests", price_source.request_count - sent)
+                for key in batch:
+                    quote = quotes.get(key[0])
+                    if quote is None:
+                        fallback[key] = groups[key]
+                        continue
+                    resolve(key, quote)
+
+        if fallback and not price_source.fallback_to_browser:
+            logger.warning("Could not price %s products", len(fallback))
+        elif fallback:
+            logger.warning("Falling back to the web driver for %s products", len(fallback))
+            self._updatePricingSequential(None, fallback, resolve, fail, retry, session=session)
+
+    def _updatePricingWithPool(self, groups, resolve, workers, fail, retry):
+        logger.info("Scraping with %s workers", workers)
+        jobs = ((key, group[0][1]) for (key, group) in groups.items())
+        pool = ScrapeWorkerPool(self.scrapeQuote, self.createWebDriver, workers=workers, retry=retry)
+        try:
+            with pool:
+                for result in pool.run(jobs):
+                    if result.error is not None:
+                        fail(result.key, result.error, attempts=getattr(result.error, "attempts", 1))
+                        continue
+                    resolve(result.key, result.value)
+        finally:
+            self.getMetrics().count("driver_restarts", pool.restarts)
+
+def create_web_driver(profile=PRICE_PROFILE):
     """Creates the web driver to run the script for searching the site."""
-    # Setup Firefox options
-    firefox_options = Options()
-    firefox_options.add_argument("--headless")  # Run in background
-    firefox_options.add_argument("--no-sandbox")
-    firefox_options.add_argument("--disable-dev-shm-usage")
-    firefox_options.add_argument("--width=1920")
-    firefox_options.add_argument("--height=1080")
- 
-    driver = webdriver.Firefox(options=firefox_options)
-    return driver
+    return create_firefox_driver(profile=profile)
 
 def update_sheet(sheet, row, col, val):
     sheet.update_cell(row, col, val)
 
-def update_sheet_records(start_row=None):
+def update_sheet_records(start_row=None, flush_rows=DEFAULT_FLUSH_ROWS,
+                         flush_seconds=DEFAULT_FLUSH_SECONDS, workers=1,
+                         price_source="selenium", api_url=DEFAULT_API_URL,
+                         http_concurrency=DEFAULT_CONCURRENCY, rate_limit=DEFAULT_RATE_LIMIT,
+                         cache_path=DEFAULT_CACHE_PATH, cache_ttl=DEFAULT_CACHE_TTL,
+                         cache_size=DEFAULT_CACHE_SIZE, incremental=False,
+                         stale_after=DEFAULT_STALE_AFTER, state_path=DEFAULT_STATE_PATH,
+                         checkpoint_path=DEFAULT_CHECKPOINT_PATH, report_path=None,
+                         live_summary=False, filters_path=None,
+                         history_path=DEFAULT_HISTORY_PATH, mirror_path=None,
+                         conflicts=PREFER_SHEET, resolve_ids=False,
+                         index_path=DEFAULT_INDEX_PATH, browser_profile=PRICE_PROFILE.name,
+                         attempts=DEFAULT_ATTEMPTS, dead_letter_path=DEFAULT_DEAD_LETTER_PATH,
+                         retry_failed=False, targets_path=None):
     """Iterates through the records finding any shoes we have and will retrieve
     the pricing from stock X to update.
 
     Args:
         rows(list<int>): List of rows to specifically check
+        flush_rows(int): Number of dirty rows to buffer before writing to the sheet
+        flush_seconds(float): Maximum seconds to hold dirty rows before writing
+        workers(int): Number of web drivers scraping at the same time
+        price_source(str): "selenium" to scrape product pages, "http" to use
+            the JSON endpoint or "html" to fetch product pages without a
+            browser.  Both fall back to the web driver.
+        api_url(str): Base URL of the JSON endpoint
+        http_concurrency(int): Maximum JSON requests in flight at once
+        rate_limit(float): Maximum JSON requests per second
+        cache_path(str): Path of the SQLite price cache, or None to always fetch
+        cache_ttl(float): Seconds a cached price stays fresh
+        cache_size(int): Maximum number of products kept in the cache
+        incremental(bool): Only refresh rows that are new, edited or stale
+        stale_after(float): Seconds before a product is priced again in
+            incremental mode
+        state_path(str): Path of the SQLite file for the incremental state
+        checkpoint_path(str): Path of the checkpoint file used to resume an
+            interrupted run, or None to always start over
+        report_path(str): Where to write the run report, as CSV when the
+            path ends in .csv and JSON otherwise
+        live_summary(bool): Keep a one line progress summary on stderr
+        filters_path(str): JSON file of the product filters for each game,
+            replacing the built in GAME_FILTERS
+        history_path(str): Path of the SQLite price history, or None to not
+            record one
+        mirror_path(str): Path of the local SQLite copy of the sheet to work
+            on, or None to read and write the sheet directly
+        conflicts(str): Whether the "sheet" or the "local" value is kept when
+            a cell changed on both sides since the last sync
+        resolve_ids(bool): Search for the product ID of rows that only have
+            a name before pricing
+        index_path(str): Path of the SQLite index of product names
+        browser_profile(str): Name of the BrowserProfile the web drivers use
+        attempts(int): Times a product is tried before it is given up on
+        dead_letter_path(str): JSON lines file of the rows that failed, or
+            None to only log them
+        retry_failed(bool): Only refresh the rows in the dead letter file
+        targets_path(str): JSON file of the worksheets to refresh, or None for
+            the default sheet.  A product on several of them is fetched
+            once, and each keeps its own state, checkpoint, mirror and
+            dead letter files.
     """
-    print("Loading web driver")
-    driver = create_web_driver()
-    print("Getting data from google sheet")
-    manager = TCGPlayerSheetManager.shared_instance()
-    manager.load()
+    if targets_path:
+        targets = load_targets(targets_path)
+    else:
+        targets = [SheetTarget(TCGPlayerSheetManager.SHEET_NAME, TCGPlayerSheetManager.SHEET_ID)]
+    history = None
+    if history_path:
+        history = PriceHistory(history_path)
+    cache = None
+    if cache_path:
+        cache = PriceCache(cache_path, ttl=cache_ttl, max_entries=cache_size)
+    if len(targets) > 1:
+        # A product on several sheets is fetched for the first one only
+        cache = QuoteMemo(cache)
+    source = None
+    driver = None
+    if price_source == "http":
+        source = HttpPriceSource(base_url=api_url, workers=http_concurrency, rate_limit=rate_limit)
+    elif price_source == "html":
+        source = HtmlPriceSource(workers=http_concurrency, rate_limit=rate_limit)
+    elif workers <= 1:
+        logger.info("Loading web driver")
+        driver = create_web_driver(profile=PROFILES[browser_profile])
+    # One warm browser carries over from sheet to sheet
+    session = BrowserSession(lambda: create_web_driver(profile=PROFILES[browser_profile]), driver=driver)
+    metrics = RunMetrics(live=live_summary, live_interval=DEFAULT_LIVE_INTERVAL)
+    positions = []
+    try:
+        for target in targets:
+            positions.extend(update_target_records(
+                target,
+                metrics,
+                session,
+                start_row=start_row,
+                flush_rows=flush_rows,
+                flush_seconds=flush_seconds,
+                workers=workers,
+                price_source=source,
+                cache=cache,
+                history=history,
+                snapshot=len(targets) == 1,
+                incremental=incremental,
+                stale_after=stale_after,
+                state_path=target.path(state_path),
+                checkpoint_path=target.path(checkpoint_path),
+                filters_path=filters_path,
+                mirror_path=target.path(mirror_path),
+                conflicts=conflicts,
+                resolve_ids=resolve_ids,
+                index_path=index_path,
+                api_url=api_url,
+                http_concurrency=http_concurrency,
+                rate_limit=rate_limit,
+                browser_profile=browser_profile,
+                attempts=attempts,
+                dead_letter_path=target.path(dead_letter_path),
+                retry_failed=retry_failed,
+            ))
+        if history is not None and len(targets) > 1:
+            # Every sheet goes into one run so the portfolio is valued as a whole
+            with metrics.stage("history"):
+                history.recordRun(positions)
+    finally:
+        if report_path:
+            metrics.writeReport(report_path)
+            logger.info("Wrote the run report to %s", report_path)
+        session.quit()
+        if source is not None:
+            source.close()
+        if cache is not None:
+            cache.close()
+        if history is not None:
+            history.close()
+
+
+def update_target_records(target, metrics, session, start_row=None, flush_rows=DEFAULT_FLUSH_ROWS,
+                          flush_seconds=DEFAULT_FLUSH_SECONDS, workers=1, price_source=None,
+                          cache=None, history=None, snapshot=True, incremental=False,
+                          stale_after=DEFAULT_STALE_AFTER, state_path=DEFAULT_STATE_PATH,
+                          checkpoint_path=DEFAULT_CHECKPOINT_PATH, filters_path=None,
+                          mirror_path=None, conflicts=PREFER_SHEET, resolve_ids=False,
+                          index_path=DEFAULT_INDEX_PATH, api_url=DEFAULT_API_URL,
+                          http_concurrency=DEFAULT_CONCURRENCY, rate_limit=DEFAULT_RATE_LIMIT,
+                          browser_profile=PRICE_PROFILE.name, attempts=DEFAULT_ATTEMPTS,
+                          dead_letter_path=DEFAULT_DEAD_LETTER_PATH, retry_failed=False):
+    """Refreshes the rows of one worksheet.
+
+    The arguments are those of ``update_sheet_records`` with the files
+    already chosen for the target.
+
+    Args:
+        target(SheetTarget): The worksheet to refresh
+        metrics(RunMetrics): Collects the timings and counters of every sheet
+        session(BrowserSession): Warm browser shared by every sheet
+        price_source(PriceSource): Prices products without a browser, or None
+        cache(PriceCache): Cache of recently fetched quotes, or None
+        history(PriceHistory): Price history shared by every sheet, or None
+        snapshot(bool): Store what the rows hold in the history as a run
+
+    Returns:
+        list<tuple>: What every row of the sheet holds, as stored in the history
+    """
+    state = None
+    if incremental:
+        state = RefreshState(state_path, stale_after=stale_after)
+    checkpoint = None
+    if checkpoint_path:
+        checkpoint = RefreshCheckpoint(checkpoint_path)
+    dead_letter = None
+    if dead_letter_path:
+        dead_letter = DeadLetterFile(dead_letter_path)
+    logger.info("Getting data from %s", target.name or "google sheet")
+    if target.name is None:
+        # The shared instance authorizes and opens the sheet once
+        manager = TCGPlayerSheetManager.shared_instance()
+    else:
+        manager = TCGPlayerSheetManager(target.spreadsheet, target.worksheet, label_row=target.label_row)
+    manager.browser_profile = PROFILES[browser_profile]
+    if filters_path:
+        manager.loadGameFilters(filters_path)
+    mirror = None
+    if mirror_path:
+        mirror = manager.useMirror(mirror_path, conflicts=conflicts)
     # sheet = manager.sheet
-    manager.updatePricing(driver, start_row=start_row)
+    records = None
+    try:
+        with metrics.stage("sheet_read"):
+            records = manager.loadRecords()
+        # The records and the header row
+        metrics.count("sheet_api_calls", 2)
+        if resolve_ids:
+            with metrics.stage("resolve_ids"), ProductIndex(index_path) as index, ProductResolver(
+                    index, base_url=api_url, concurrency=http_concurrency, rate_limit=rate_limit) as resolver:
+                resolve_missing_ids(manager, records, resolver)
+        manager.updatePricing(
+            start_row=start_row,
+            flush_rows=flush_rows,
+            flush_seconds=flush_seconds,
+            workers=workers,
+            price_source=price_source,
+            cache=cache,
+            state=state,
+            checkpoint=checkpoint,
+            metrics=metrics,
+            history=history,
+            records=records,
+            snapshot=snapshot,
+            retry=RetryPolicy(attempts=attempts),
+            dead_letter=dead_letter,
+            retry_failed=retry_failed,
+            session=session,
+        )
+        return manager.getPositions(records)
+    finally:
+        if mirror is not None:
+            # Whatever was priced before a failure is still worth sending
+            mirror.push()
+        if state is not None:
+            state.close()
+        # The shared manager outlives the run, so it has to let go of the closed mirror
+        manager.closeMirror()
+        if dead_letter is not None:
+            dead_letter.save()
+            if len(dead_letter):
+                logger.warning("%s rows failed, run again with --retry-failed to retry only them", len(dead_letter))
 
 def launch_ui():
     """Launches the UI for the script."""
@@ -397,7 +1078,7 @@ def launch_ui():
     window.show()
     application.exec()
     # For now, we will just print that the UI is not implemented    
-    print("Launching UI is not implemented yet.")
+    logger.warning("Launching UI is not implemented yet.")
 
 def main():
     parser = argparse.ArgumentParser(description='Process spreadsheet data')
@@ -416,13 +1097,253 @@ def main():
         help='Launch the UI for the script (default: False)',
     )
 
+    parser.add_argument(
+        '--flush-rows',
+        type=int,
+        default=DEFAULT_FLUSH_ROWS,
+        help='Number of updated rows to buffer before writing to the sheet (default: {})'.format(DEFAULT_FLUSH_ROWS),
+    )
+
+    parser.add_argument(
+        '--flush-seconds',
+        type=float,
+        default=DEFAULT_FLUSH_SECONDS,
+        help='Maximum seconds to buffer updated rows before writing (default: {})'.format(DEFAULT_FLUSH_SECONDS),
+    )
+
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Number of headless browsers scraping prices at the same time (default: 1)',
+    )
+
+    parser.add_argument(
+        '--price-source',
+        choices=['selenium', 'http', 'html'],
+        default='selenium',
+        help='Where to read prices from.  "http" uses the JSON endpoint and "html" server rendered product pages, '
+             'both fall back to selenium (default: selenium)',
+    )
+
+    parser.add_argument(
+        '--api-url',
+        default=DEFAULT_API_URL,
+        help='Base URL of the JSON endpoint used by the http price source (default: {})'.format(DEFAULT_API_URL),
+    )
+
+    parser.add_argument(
+        '--http-concurrency',
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help='Maximum requests in flight for the http and html price sources (default: {})'.format(DEFAULT_CONCURRENCY),
+    )
+
+    parser.add_argument(
+        '--requests-per-second',
+        type=float,
+        default=DEFAULT_RATE_LIMIT,
+        help='Maximum requests per second to one host for the http and html price sources (default: {:g})'.format(DEFAULT_RATE_LIMIT),
+    )
+
+    parser.add_argument(
+        '--cache-path',
+        default=DEFAULT_CACHE_PATH,
+        help='SQLite file used to cache prices between runs (default: {})'.format(DEFAULT_CACHE_PATH),
+    )
+
+    parser.add_argument(
+        '--cache-ttl-hours',
+        type=float,
+        default=DEFAULT_CACHE_TTL / 3600,
+        help='Hours a cached price is reused before fetching it again (default: {:g})'.format(DEFAULT_CACHE_TTL / 3600),
+    )
+
+    parser.add_argument(
+        '--cache-size',
+        type=int,
+        default=DEFAULT_CACHE_SIZE,
+        help='Maximum number of products kept in the price cache (default: {})'.format(DEFAULT_CACHE_SIZE),
+    )
+
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Fetch every price instead of reusing cached prices (default: False)',
+    )
+
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='Only reprice rows that are new, were edited or are older than --stale-hours (default: False)',
+    )
+
+    parser.add_argument(
+        '--stale-hours',
+        type=float,
+        default=DEFAULT_STALE_AFTER / 3600,
+        help='Hours before a product is repriced in incremental mode (default: {:g})'.format(DEFAULT_STALE_AFTER / 3600),
+    )
+
+    parser.add_argument(
+        '--state-path',
+        default=DEFAULT_STATE_PATH,
+        help='SQLite file recording what each row looked like when last priced (default: {})'.format(DEFAULT_STATE_PATH),
+    )
+
+    parser.add_argument(
+        '--checkpoint-path',
+        default=DEFAULT_CHECKPOINT_PATH,
+        help='File used to resume an interrupted run (default: {})'.format(DEFAULT_CHECKPOINT_PATH),
+    )
+
+    parser.add_argument(
+        '--no-checkpoint',
+        action='store_true',
+        help='Process every row instead of resuming an interrupted run (default: False)',
+    )
+
+    parser.add_argument(
+        '--history-path',
+        default=DEFAULT_HISTORY_PATH,
+        help='SQLite file every fetched price and portfolio is appended to (default: {})'.format(DEFAULT_HISTORY_PATH),
+    )
+
+    parser.add_argument(
+        '--no-history',
+        action='store_true',
+        help='Don\'t record the price history (default: False)',
+    )
+
+    parser.add_argument(
+        '--attempts',
+        type=int,
+        default=DEFAULT_ATTEMPTS,
+        help='Times a product is tried before its rows are given up on (default: {})'.format(DEFAULT_ATTEMPTS),
+    )
+
+    parser.add_argument(
+        '--dead-letter-path',
+        default=DEFAULT_DEAD_LETTER_PATH,
+        help='File listing the rows that failed (default: {})'.format(DEFAULT_DEAD_LETTER_PATH),
+    )
+
+    parser.add_argument(
+        '--retry-failed',
+        action='store_true',
+        help='Only refresh the rows listed in the dead letter file (default: False)',
+    )
+
+    parser.add_argument(
+        '--browser-profile',
+        choices=sorted(PROFILES),
+        default=PRICE_PROFILE.name,
+        help='What the web drivers load: "price" blocks images, fonts and trackers, '
+             '"full" loads everything (default: {})'.format(PRICE_PROFILE.name),
+    )
+
+    parser.add_argument(
+        '--resolve-ids',
+        action='store_true',
+        help='Search for the product ID of rows that only have a game, series and product name (default: False)',
+    )
+
+    parser.add_argument(
+        '--index-path',
+        default=DEFAULT_INDEX_PATH,
+        help='SQLite index of product names used by --resolve-ids (default: {})'.format(DEFAULT_INDEX_PATH),
+    )
+
+    parser.add_argument(
+        '--targets-config',
+        default=None,
+        help='JSON file listing the spreadsheets and worksheets to refresh in one run, '
+             'fetching each product once for all of them (default: the "{}" sheet)'.format(TCGPlayerSheetManager.SHEET_NAME),
+    )
+
+    parser.add_argument(
+        '--mirror-path',
+        default=None,
+        help='Work on a local SQLite copy of the sheet and sync only the changed cells (default: off)',
+    )
+
+    parser.add_argument(
+        '--conflicts',
+        choices=CONFLICT_POLICIES,
+        default=PREFER_SHEET,
+        help='Which value to keep when a cell changed both in the mirror and on the sheet (default: {})'.format(PREFER_SHEET),
+    )
+
+    parser.add_argument(
+        '--filters-config',
+        default=None,
+        help='JSON file mapping part of a game name to the condition, printing and language filters for it '
+             '(default: the built in filters)',
+    )
+
+    parser.add_argument(
+        '--log-level',
+        choices=LOG_LEVELS,
+        default=DEFAULT_LOG_LEVEL,
+        help='Only log messages at this level or above (default: {})'.format(DEFAULT_LOG_LEVEL),
+    )
+
+    parser.add_argument(
+        '--log-format',
+        choices=LOG_FORMATS,
+        default='text',
+        help='Log readable lines or one JSON object per line (default: text)',
+    )
+
+    parser.add_argument(
+        '--report',
+        default=None,
+        help='Write per-stage timings and counters to this file, as CSV for .csv and JSON otherwise',
+    )
+
+    parser.add_argument(
+        '--live-summary',
+        action='store_true',
+        help='Show a one line progress summary every {:g} seconds (default: False)'.format(DEFAULT_LIVE_INTERVAL),
+    )
+
     args = parser.parse_args()
+    configure_logging(args.log_level, log_format=args.log_format)
 
     if args.launch_ui:
         launch_ui()
         return
 
-    update_sheet_records(start_row=args.start_row)
+    update_sheet_records(
+        start_row=args.start_row,
+        flush_rows=args.flush_rows,
+        flush_seconds=args.flush_seconds,
+        workers=args.workers,
+        price_source=args.price_source,
+        api_url=args.api_url,
+        http_concurrency=args.http_concurrency,
+        rate_limit=args.requests_per_second,
+        cache_path=None if args.no_cache else args.cache_path,
+        cache_ttl=args.cache_ttl_hours * 3600,
+        cache_size=args.cache_size,
+        incremental=args.incremental,
+        stale_after=args.stale_hours * 3600,
+        state_path=args.state_path,
+        checkpoint_path=None if args.no_checkpoint else args.checkpoint_path,
+        report_path=args.report,
+        live_summary=args.live_summary,
+        filters_path=args.filters_config,
+        history_path=None if args.no_history else args.history_path,
+        mirror_path=args.mirror_path,
+        conflicts=args.conflicts,
+        resolve_ids=args.resolve_ids,
+        index_path=args.index_path,
+        browser_profile=args.browser_profile,
+        attempts=args.attempts,
+        dead_letter_path=args.dead_letter_path,
+        retry_failed=args.retry_failed,
+        targets_path=args.targets_config,
+    )
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,191 @@
+import logging
+import queue
+import random
+import threading
+import time
+
+from selenium.common.exceptions import InvalidSessionIdException, NoSuchWindowException, WebDriverException
+from urllib3.exceptions import HTTPError
+
+from tcgplayer_browser import DEFAULT_MAX_PAGES, BrowserSession
+
+
+# Close the web driver after this many pages when its memory can't be measured
+DRIVER_RECYCLE_PAGES = DEFAULT_MAX_PAGES
+DEFAULT_ATTEMPTS = 3
+DEFAULT_BACKOFF_BASE = 2.0
+DEFAULT_BACKOFF_MAX = 30.0
+
+# Failures worth another attempt
+RETRY_EXCEPTIONS = (WebDriverException, HTTPError, ConnectionError)
+# Failures that mean the browser is gone or geckodriver stopped answering, so
+# the driver is restarted first.  A timeout or a missing or stale element only
+# means the page needs another try.
+RESTART_EXCEPTIONS = (InvalidSessionIdException, NoSuchWindowException, HTTPError, ConnectionError)
+
+_STOP = object()
+
+logger = logging.getLogger(__name__)
+
+
+def needs_restart(error):
+    """(bool): Returns if the error means the web driver has to be restarted"""
+    # geckodriver reports a crashed browser as a plain WebDriverException
+    return isinstance(error, RESTART_EXCEPTIONS) or type(error) is WebDriverException
+
+
+class RetryPolicy(object):
+    """Bounded retries of one scrape with exponential backoff and full jitter.
+
+    The driver is restarted before the next attempt when the failure looks
+    like the browser crashed rather than a page that was slow or missing an
+    element.  ``retries`` counts every extra attempt made.
+    """
+
+    def __init__(self, attempts=DEFAULT_ATTEMPTS, backoff_base=DEFAULT_BACKOFF_BASE,
+                 backoff_max=DEFAULT_BACKOFF_MAX, sleep=time.sleep):
+        if attempts < 1:
+            raise ValueError("A retry policy needs at least 1 attempt, got {}".format(attempts))
+        self.attempts = attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.sleep = sleep
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def getBackoff(self, attempt):
+        """(float): Returns the seconds to wait after the attempt, starting at 0"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def run(self, scrape, session, record, name=""):
+        """
+        Scrapes the record with the session's driver until it works
+
+        Returns:
+            object: What ``scrape(driver, record)`` returned
+
+        Raises:
+            Exception: The last error once every attempt failed, or the first
+                error that isn't worth retrying.  Its ``attempts`` is the
+                number of attempts made.
+        """
+        for attempt in range(self.attempts):
+            try:
+                return scrape(session.nextDriver(), record)
+            except Exception as e:
+                e.attempts = attempt + 1
+                if not isinstance(e, RETRY_EXCEPTIONS) or attempt == self.attempts - 1:
+                    raise
+                if needs_restart(e):
+                    logger.warning("Restarting the web driver after: %s", str(e).strip() or type(e).__name__)
+                    session.restart()
+                delay = self.getBackoff(attempt)
+                logger.warning("Retrying %s in %.1fs (%s)", name, delay, type(e).__name__)
+                with self._lock:
+                    self.retries += 1
+                self.sleep(delay)
+
+
+class ScrapeResult(object):
+    """Result of scraping one job, handed back from a worker to the sheet writer."""
+
+    __slots__ = ("key", "record", "value", "error")
+
+    def __init__(self, key, record, value=None, error=None):
+        self.key = key
+        self.record = record
+        self.value = value
+        self.error = error
+
+
+class ScrapeWorkerPool(object):
+    """Pool of threads that each own a web driver and scrape rows from a shared queue.
+
+    Every worker pulls ``(key, record)`` jobs, calls ``scrape(driver, record)``
+    and pushes a ``ScrapeResult`` holding its return value onto a single
+    result queue so only one thread ever talks to the sheet.  Failed scrapes
+    are retried by ``retry`` and the error of the last attempt is handed back
+    in the result, so one bad row never stops the other workers.  Each worker
+    keeps its driver in a BrowserSession that recycles it once the browser
+    has grown too much, or every ``recycle_pages`` pages when its memory
+    can't be measured.
+    """
+
+    def __init__(self, scrape, driver_factory, workers=2, recycle_pages=DRIVER_RECYCLE_PAGES, retry=None):
+        if workers < 1:
+            raise ValueError("A worker pool needs at least 1 worker, got {}".format(workers))
+        self.scrape = scrape
+        self.driver_factory = driver_factory
+        self.workers = workers
+        self.recycle_pages = recycle_pages
+        self.retry = retry or RetryPolicy()
+        self._jobs = queue.Queue()
+        self._results = queue.Queue()
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        # Number of times a worker recycled its driver
+        self.restarts = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(
+                target=self._work,
+                name="scrape-worker-{}".format(index),
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def close(self):
+        """Stops the workers and waits for their drivers to quit."""
+        self._stop.set()
+        for _ in self._threads:
+            self._jobs.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def run(self, jobs):
+        """Queues every job and yields results as the workers finish them.
+
+        Args:
+            jobs(iterable<tuple<object, dict>>): A key identifying the job and
+                the record to scrape
+
+        Yields:
+            ScrapeResult: One result per job, in completion order
+        """
+        count = 0
+        for job in jobs:
+            self._jobs.put(job)
+            count += 1
+        for _ in range(count):
+            yield self._results.get()
+
+    def _work(self):
+        session = BrowserSession(self.driver_factory, max_pages=self.recycle_pages)
+        try:
+            while not self._stop.is_set():
+                job = self._jobs.get()
+                if job is _STOP:
+                    break
+                (key, record) = job
+                try:
+                    value = self.retry.run(self.scrape, session, record, name="job {}".format(key))
+                except Exception as e:
+                    self._results.put(ScrapeResult(key, record, error=e))
+                    continue
+                self._results.put(ScrapeResult(key, record, value=value))
+        finally:
+            with self._lock:
+                self.restarts += session.restarts
+            session.quit()
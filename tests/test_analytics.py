@@ -0,0 +1,19 @@
+import numpy as np
+
+from tcgplayer_analytics import find_outliers
+
+
+def test_find_outliers_uses_the_modified_z_score():
+    changes = np.array([1.0, 2.0, 3.0, 2.5, 1.5, 40.0, np.nan])
+    assert find_outliers(changes).tolist() == [False, False, False, False, False, True, False]
+
+
+def test_find_outliers_with_most_prices_unchanged():
+    # More than half the changes are 0, so the median absolute deviation is 0
+    changes = np.array([0.0, 0.0, 0.0, 0.0, 0.0, 0.5, -2.0, 25.0, -30.0, np.nan])
+    assert find_outliers(changes).tolist() == [False] * 5 + [False, False, True, True, False]
+
+
+def test_find_outliers_without_changes():
+    assert not find_outliers(np.array([np.nan, np.nan])).any()
+    assert not find_outliers(np.zeros(4)).any()
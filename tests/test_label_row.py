@@ -0,0 +1,90 @@
+import re
+
+from tcgplayer_inventory_mirror import InventoryMirror
+from tcgplayer_price_source import PriceQuote, PriceSource
+from tcgplayer_sheet_schema import column_number
+from tcgplayer_tracker import TCGPlayerSheetManager
+
+
+HEADERS = ["Game", "Series", "Product Name", "Number", "TCG Product ID", "TCG Link",
+           "Current Price (per unit)", "Total Value"]
+A1_REGEX = re.compile(r"([A-Z]+)(\d+)")
+
+
+class GridWorksheet(object):
+    """Stands in for a gspread worksheet holding a grid of cells."""
+
+    def __init__(self, grid):
+        self.grid = grid
+
+    def get_all_records(self, head=1):
+        keys = self.grid[head - 1]
+        return [dict(zip(keys, row)) for row in self.grid[head:]]
+
+    def row_values(self, row):
+        return list(self.grid[row - 1])
+
+    def batch_update(self, data, value_input_option=None):
+        for update in data:
+            match = A1_REGEX.match(update['range'].split(':')[0])
+            column = column_number(match.group(1))
+            row = self.grid[int(match.group(2)) - 1]
+            for (offset, value) in enumerate(update['values'][0]):
+                row[column - 1 + offset] = value
+
+
+class FixedPriceSource(PriceSource):
+    name = "fixed"
+    fallback_to_browser = False
+
+    def fetch(self, product_id, filters=None):
+        return PriceQuote(product_id, "$2.00", "Card {}".format(product_id), "Set", "")
+
+
+def make_sheet():
+    # Two rows of notes above the headers, which are on row 3
+    return GridWorksheet([
+        ["Inventory", "", "", "", "", "", "", ""],
+        ["", "", "", "", "", "", "", ""],
+        list(HEADERS),
+        ["Pokemon Sealed", "Set", "Card 100", 1, "100", "", "", ""],
+        ["Pokemon Sealed", "Set", "Card 200", 3, "200", "", "", ""],
+    ])
+
+
+def make_manager(monkeypatch, sheet):
+    monkeypatch.setattr(TCGPlayerSheetManager, "load", lambda self: sheet)
+    return TCGPlayerSheetManager("Inventory", 0, label_row=3)
+
+
+def test_records_are_read_under_the_label_row(monkeypatch):
+    manager = make_manager(monkeypatch, make_sheet())
+    records = manager.loadRecords()
+    assert [record["TCG Product ID"] for record in records] == ["100", "200"]
+    assert [manager.getRow(i) for i in range(len(records))] == [4, 5]
+    assert [position[0] for position in manager.getPositions(records)] == [4, 5]
+
+
+def test_prices_are_written_to_the_rows_of_their_records(monkeypatch):
+    sheet = make_sheet()
+    manager = make_manager(monkeypatch, sheet)
+    manager.updatePricing(price_source=FixedPriceSource(), snapshot=False)
+    assert sheet.grid[0][6:] == ["", ""]
+    assert sheet.grid[3][6:] == ["$2.00", "$2.00"]
+    assert sheet.grid[4][6:] == ["$2.00", "$6.00"]
+
+
+def test_mirror_pushes_to_the_rows_under_the_label_row(monkeypatch, tmp_path):
+    sheet = make_sheet()
+    manager = make_manager(monkeypatch, sheet)
+    manager.useMirror(str(tmp_path / "mirror.sqlite3"))
+    try:
+        assert manager.sheet.row_values(3) == HEADERS
+        manager.updatePricing(price_source=FixedPriceSource(), snapshot=False)
+        assert sheet.grid[4][6] == ""
+        manager.mirror.push()
+    finally:
+        manager.closeMirror()
+    assert manager.sheet is sheet
+    assert sheet.grid[3][6:] == ["$2.00", "$2.00"]
+    assert sheet.grid[4][6:] == ["$2.00", "$6.00"]